@@ -4,29 +4,45 @@ Provides REST API endpoints for EPUB composition from markdown files
 Following the same pattern as other DC services: compose/job_status/download
 """
 
+import atexit
+import hashlib
+import io
 import os
 import json
+import shutil
 import tempfile
-from datetime import datetime
-from pathlib import Path
-from typing import Dict, Any, Optional
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
 from werkzeug.utils import secure_filename
 from flask import Flask, request, jsonify, send_file
 from flask_swagger_ui import get_swaggerui_blueprint
 
 # Import the existing composer infrastructure
+from core.BlobStore import DEDUPED_INPUTS, BlobStore
 from core.ComposerFactory import ComposerFactory
-from common.configuration import get_storage_root
+from core.CostModel import schedule
+from core.JobScheduler import PRIORITY_CLASSES, DEFAULT_PRIORITY
+from core.JobSpool import write_ticket
+from core.RetryPolicy import FAILED, LEGACY_ERROR
+from core.StoragePlacement import StoragePlacement
+from core.StorageRetention import UPLOAD_DIR_PREFIX
+from common.configuration import get_storage_root, get_storage_roots, get_composer_config
 from common.logger import get_logger
+from common.storage_backend import StorageBackend, get_storage_backend
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 
-# Configure upload folder
-UPLOAD_FOLDER = tempfile.mkdtemp()
+# Configure upload folder; the retention manager removes the folders of API processes that did not exit cleanly
+UPLOAD_FOLDER = tempfile.mkdtemp(prefix=f'{UPLOAD_DIR_PREFIX}{os.getpid()}-')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+atexit.register(shutil.rmtree, UPLOAD_FOLDER, ignore_errors=True)
 
 logger = get_logger(get_storage_root())
+logger.use_storage(get_storage_backend())
+
+# Books live on one of the configured storage roots; new ones are placed by STORAGE_PLACEMENT
+storage_placement = StoragePlacement(get_storage_roots(), get_composer_config())
 
 # Swagger configuration
 SWAGGER_URL = '/api/docs'
@@ -40,57 +56,94 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
 
+def get_book_storage(job_id: str, create: bool = False) -> Optional[Tuple[StorageBackend, str]]:
+    """
+    The storage backend holding a book and the key of its folder, or None if no
+    root holds it. With `create`, a new book is placed on a root.
+    """
+    storage_root = storage_placement.find_book_root(job_id)
+    if storage_root is None:
+        if not create:
+            return None
+        storage_root = storage_placement.place(job_id)
+    storage = get_storage_backend(storage_root)
+    return storage, storage.book_key(job_id)
+
+
 def get_job_progress(job_id: str) -> Dict[str, Any]:
     """Get the current progress of a composition job"""
-    storage_root = get_storage_root()
-    job_dir = Path(storage_root) / job_id
-    progress_file = job_dir / 'composingservice-progress.json'
+    book = get_book_storage(job_id)
     
-    if not job_dir.exists():
+    if book is None:
         return {
             'status': 'not_found',
             'message': 'Job not found',
             'jobType': 'epub_composition'
         }
     
+    storage, book_key = book
     try:
-        if progress_file.exists():
-            with open(progress_file, 'r', encoding='utf-8') as f:
-                progress = json.load(f)
-                
+        try:
+            progress = json.loads(storage.read_bytes(f"{book_key}/composingservice-progress.json"))
+        except FileNotFoundError:
+            progress = None
+        if progress is not None:
+
             # Map internal status to API status
             status_mapping = {
                 'pending': 'pending',
                 'processing': 'processing', 
                 'completed': 'completed',
                 'error': 'failed',
+                'timeout': 'failed',
+                'oom': 'failed',
+                'cancelled': 'cancelled',
+                'retry_scheduled': 'pending',
+                'partial': 'processing',
+                'dead_letter': 'failed',
                 'not_implemented': 'failed'
             }
             
             api_status = status_mapping.get(progress.get('status', 'pending'), 'pending')
             
-            return {
+            result = {
                 'status': api_status,
                 'progress': progress,
                 'message': progress.get('message', f'EPUB composition {api_status}'),
                 'jobType': 'epub_composition',
                 'composer': progress.get('composer', 'unknown')
             }
+            if api_status == 'processing' and storage.exists(f"{book_key}/{get_composer_config()['cancel_filename']}"):
+                result['cancelRequested'] = True
+            if progress.get('status') == FAILED and not progress.get('error_type'):
+                # Failed before errors were classified: the worker will not retry it
+                progress.setdefault('dead_letter_reason', LEGACY_ERROR)
+            if 'attempts' in progress:
+                result['attempts'] = progress['attempts']
+            if progress.get('status') == 'retry_scheduled':
+                result['nextRetryAt'] = progress.get('next_retry_at')
+            if 'coverage' in progress:
+                result['coverage'] = progress['coverage']
+                result['interimAvailable'] = bool(progress.get('interim_file')) and storage.exists(f"{book_key}/{get_composer_config()['interim_epub_filename']}")
+            if progress.get('recomposing'):
+                result['recomposing'] = True
+                result['previousCompletedAt'] = progress.get('previous_completed_at')
+            return result
         else:
             # Check if output files exist (completed without progress file)
             output_files = [
-                job_dir / 'final.epub',
-                job_dir / 'dual-language-final.epub'
+                f'{book_key}/final.epub',
+                f'{book_key}/dual-language-final.epub'
             ]
             
             for output_file in output_files:
-                if output_file.exists():
+                if storage.exists(output_file):
                     return {
                         'status': 'completed',
                         'progress': {'status': 'completed'},
                         'message': 'EPUB composition completed (no progress file found)',
                         'jobType': 'epub_composition',
-                        'outputFile': str(output_file)
+                        'outputFile': str(storage.local_path(output_file) or output_file)
                     }
             
             return {
@@ -110,13 +163,114 @@ def get_job_progress(job_id: str) -> Dict[str, Any]:
         }
 
 
-def save_uploaded_files(job_id: str, files: Dict) -> Dict[str, str]:
-    """Save uploaded files to job directory"""
-    storage_root = get_storage_root()
-    job_dir = Path(storage_root) / job_id
-    job_dir.mkdir(parents=True, exist_ok=True)
+def open_stored_file(storage: StorageBackend, key: str):
+    """A stored file for send_file: its path when it is on local storage, its contents otherwise."""
+    local_path = storage.local_path(key)
+    if local_path is not None:
+        return str(local_path)
+    return io.BytesIO(storage.read_bytes(key))
+
+
+def get_queue_snapshot(storage_root: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Read the queue (dispatch order and wait times) published by the worker of a
+    storage root, or of every root merged, each job tagged with its root
+    """
+    if storage_root is None:
+        snapshots = [(root['path'], get_queue_snapshot(root['path'])) for root in get_storage_roots()]
+        return {
+            'updated_at': max((snapshot['updated_at'] for _, snapshot in snapshots if snapshot['updated_at']), default=None),
+            'jobs': [dict(job, storageRoot=path) for path, snapshot in snapshots for job in snapshot['jobs']],
+        }
+    try:
+        return json.loads(get_storage_backend(storage_root).read_bytes(get_composer_config()['queue_filename']))
+    except FileNotFoundError:
+        return {'updated_at': None, 'jobs': []}
+
+
+def get_scaling_signal(storage_root: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Read the scaling signal (concurrency and desired replicas) published by the
+    worker of a storage root, or the combined signal of every root
+    """
+    roots = get_storage_roots()
+    if storage_root is None and len(roots) > 1:
+        signals = [dict(get_scaling_signal(root['path']), storageRoot=root['path']) for root in roots]
+        return combine_scaling_signals(signals)
+    try:
+        return json.loads(get_storage_backend(storage_root or roots[0]['path']).read_bytes(get_composer_config()['scaling_filename']))
+    except FileNotFoundError:
+        return {'updated_at': None, 'desiredReplicas': None}
+
+
+def combine_scaling_signals(signals: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine per-root scaling signals. Every replica serves every root, so the
+    deployment needs as many replicas as its busiest root asks for.
+    """
+    published = [signal for signal in signals if signal.get('updated_at')]
+    desired = [signal['desiredReplicas'] for signal in published if signal.get('desiredReplicas')]
+    return {
+        'updated_at': max((signal['updated_at'] for signal in published), default=None),
+        'desiredReplicas': max(desired) if desired else None,
+        'queued': sum(signal.get('queued', 0) for signal in published),
+        'running': sum(signal.get('running', 0) for signal in published),
+        'concurrency': sum(signal.get('concurrency', 0) for signal in published),
+        'roots': signals,
+    }
+
+
+def estimate_completion(job_id: str, storage_root: str, result: Dict[str, Any]) -> None:
+    """
+    Add the estimated time to completion of a pending or processing job.
+
+    A pending job's finish is simulated from the estimates in the queue snapshot,
+    dispatched in queue order on the worker's current number of slots; a running
+    job's is its estimate (recorded when it started) less the time it has run.
+    """
+    if result['status'] == 'pending':
+        ahead = []
+        for entry in get_queue_snapshot(storage_root)['jobs']:
+            ahead.append(entry)
+            if entry['bookId'] == job_id:
+                break
+        else:
+            return
+        signal = get_scaling_signal(storage_root)
+        default_seconds = signal.get('avgJobSeconds') or 60.0
+        durations = [entry.get('estimatedSeconds') or default_seconds for entry in ahead]
+        slots = signal.get('concurrency') or get_composer_config()['concurrency']
+        remaining = schedule(durations, slots)[-1][1]
+        result['estimatedSeconds'] = ahead[-1].get('estimatedSeconds')
+    elif result['status'] == 'processing':
+        progress = result['progress']
+        if progress.get('estimated_seconds') is None or not progress.get('started_at'):
+            return
+        elapsed = (datetime.now() - datetime.fromisoformat(progress['started_at'])).total_seconds()
+        remaining = max(0.0, progress['estimated_seconds'] - elapsed)
+        result['estimatedSeconds'] = progress['estimated_seconds']
+        result['estimatedPeakRssBytes'] = progress.get('estimated_peak_rss')
+    else:
+        return
+    result['etaSeconds'] = round(remaining, 1)
+    result['eta'] = (datetime.now() + timedelta(seconds=remaining)).isoformat()
+
+
+def save_uploaded_files(job_id: str, files: Dict) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, dict]]:
+    """
+    Save uploaded files to job directory (on the book's storage root, or the one chosen for a new book).
+    Returns the saved file names by field, the SHA-256 of each saved file by file name, and on a local
+    root the size and mtime of each saved file, so the worker can tell its hash still applies.
+    With UPLOAD_DEDUPE, originalbook.md goes through the content-addressed blob store, so identical
+    originals are stored once.
+    """
+    storage, book_key = get_book_storage(job_id, create=True)
+    config = get_composer_config()
+    blob_store = BlobStore(storage, config) if config['upload_dedupe'] else None
     
     saved_files = {}
+    input_hashes = {}
+    input_stats = {}
     
     for field_name, file in files.items():
         if file and file.filename:
@@ -130,12 +284,20 @@ def save_uploaded_files(job_id: str, files: Dict) -> Dict[str, str]:
             }
             
             target_filename = filename_mapping.get(field_name, filename)
-            file_path = job_dir / target_filename
-            
-            file.save(str(file_path))
+            if blob_store is not None and target_filename in DEDUPED_INPUTS:
+                digest, _ = blob_store.store(file.stream, f'{book_key}/{target_filename}')
+            else:
+                data = file.read()
+                digest = hashlib.sha256(data).hexdigest()
+                storage.write_bytes(f'{book_key}/{target_filename}', data)
             saved_files[field_name] = target_filename
+            input_hashes[target_filename] = digest
+            local_path = storage.local_path(f'{book_key}/{target_filename}')
+            if local_path is not None:
+                stat = local_path.stat()
+                input_stats[target_filename] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
             
-    return saved_files
+    return saved_files, input_hashes, input_stats
 
 
 @app.route('/api/swagger.json')
@@ -182,6 +344,11 @@ def swagger():
                                             "type": "string",
                                             "enum": ["auto", "simple_markdown", "dual_language", "real_storage_dual_language"],
                                             "description": "Specific composer type to use (optional, defaults to auto-detection)"
+                                        },
+                                        "priority": {
+                                            "type": "string",
+                                            "enum": PRIORITY_CLASSES,
+                                            "description": "Scheduling priority class (optional, defaults to normal)"
                                         }
                                     },
                                     "oneOf": [
@@ -207,7 +374,8 @@ def swagger():
                                             "jobId": {"type": "string"},
                                             "message": {"type": "string"},
                                             "composer": {"type": "string"},
-                                            "uploadedFiles": {"type": "object"}
+                                            "uploadedFiles": {"type": "object"},
+                                            "inputSha256": {"type": "object", "description": "SHA-256 of each saved input file, by file name"}
                                         }
                                     }
                                 }
@@ -243,12 +411,24 @@ def swagger():
                                         "properties": {
                                             "status": {
                                                 "type": "string",
-                                                "enum": ["pending", "processing", "completed", "failed", "not_found"]
+                                                "enum": ["pending", "processing", "completed", "failed", "cancelled", "not_found"]
                                             },
                                             "progress": {"type": "object"},
                                             "message": {"type": "string"},
                                             "jobType": {"type": "string"},
-                                            "composer": {"type": "string"}
+                                            "composer": {"type": "string"},
+                                            "queuePosition": {"type": "integer"},
+                                            "cancelRequested": {"type": "boolean"},
+                                            "attempts": {"type": "integer"},
+                                            "nextRetryAt": {"type": "string", "format": "date-time"},
+                                            "coverage": {"type": "number", "description": "Percentage of the original's sections translated so far (progressive composition)"},
+                                            "interimAvailable": {"type": "boolean", "description": "An interim EPUB can be downloaded with interim=true"},
+                                            "recomposing": {"type": "boolean", "description": "The job's inputs changed after it completed and it is being composed again; the previous EPUB can still be downloaded"},
+                                            "previousCompletedAt": {"type": "string", "format": "date-time", "description": "When the previous EPUB of a job being recomposed was completed"},
+                                            "estimatedSeconds": {"type": "number", "description": "Estimated wall time of the composition, from the cost model"},
+                                            "estimatedPeakRssBytes": {"type": "integer", "description": "Estimated peak memory of a running composition"},
+                                            "etaSeconds": {"type": "number", "description": "Estimated seconds until a pending or processing job completes"},
+                                            "eta": {"type": "string", "format": "date-time", "description": "Estimated completion time"}
                                         }
                                     }
                                 }
@@ -260,16 +440,74 @@ def swagger():
                     }
                 }
             },
+            "/api/cancel": {
+                "post": {
+                    "summary": "Cancel a composition job",
+                    "description": "Cancel a pending job immediately, or ask an in-flight composition to stop at its next checkpoint",
+                    "parameters": [{
+                        "name": "jobId",
+                        "in": "query",
+                        "required": True,
+                        "schema": {"type": "string"},
+                        "description": "Job ID to cancel"
+                    }],
+                    "responses": {
+                        "200": {
+                            "description": "Pending job cancelled"
+                        },
+                        "202": {
+                            "description": "Cancellation requested for an in-flight job"
+                        },
+                        "400": {
+                            "description": "Missing jobId parameter"
+                        },
+                        "404": {
+                            "description": "Job not found"
+                        },
+                        "409": {
+                            "description": "Job already completed, failed or cancelled"
+                        }
+                    }
+                }
+            },
+            "/api/queue": {
+                "get": {
+                    "summary": "Inspect the composition queue",
+                    "description": "Pending jobs in dispatch order, with priority, input size, lane, wait time and estimated duration. With several storage roots each root's queue is listed in its own order, and every job carries its storageRoot",
+                    "responses": {
+                        "200": {
+                            "description": "Queue snapshot published by the worker"
+                        }
+                    }
+                }
+            },
+            "/api/scaling": {
+                "get": {
+                    "summary": "Read the worker scaling signal",
+                    "description": "Queue depth, current and bounded concurrency, and the number of worker replicas needed to drain the queue within AUTOSCALE_TARGET_DRAIN_SECONDS. With several storage roots the totals are combined, desiredReplicas is the largest of the roots' and each root's own signal is listed under roots",
+                    "responses": {
+                        "200": {
+                            "description": "Scaling signal published by the worker"
+                        }
+                    }
+                }
+            },
             "/api/download": {
                 "get": {
                     "summary": "Download composed EPUB file",
-                    "description": "Download the generated EPUB file for a completed composition job",
+                    "description": "Download the generated EPUB file for a completed composition job (the previous one while the job is recomposed), or with interim=true the interim EPUB of a job whose translation is still arriving",
                     "parameters": [{
                         "name": "jobId",
                         "in": "query",
                         "required": True, 
                         "schema": {"type": "string"},
                         "description": "Job ID to download EPUB for"
+                    }, {
+                        "name": "interim",
+                        "in": "query",
+                        "required": False,
+                        "schema": {"type": "boolean"},
+                        "description": "Download the interim EPUB of the sections translated so far"
                     }],
                     "responses": {
                         "200": {
@@ -327,6 +565,12 @@ def compose():
         if not files:
             return jsonify({'error': 'No files uploaded'}), 400
 
+        priority = request.form.get('priority', DEFAULT_PRIORITY)
+        if priority not in PRIORITY_CLASSES:
+            return jsonify({
+                'error': f'Invalid priority. Must be one of: {", ".join(PRIORITY_CLASSES)}'
+            }), 400
+
         # Validate file combinations
         has_single = 'markdownFile' in files
         has_dual = 'originalBook' in files and 'translatedContent' in files
@@ -344,7 +588,10 @@ def compose():
 
         # Save uploaded files
         try:
-            saved_files = save_uploaded_files(job_id, files)
+            saved_files, input_hashes, input_stats = save_uploaded_files(job_id, files)
+            # A resubmitted job must not inherit an earlier cancellation
+            storage, book_key = get_book_storage(job_id, create=True)
+            storage.delete(f"{book_key}/{get_composer_config()['cancel_filename']}")
         except Exception as e:
             return jsonify({
                 'error': 'Failed to save uploaded files',
@@ -360,27 +607,37 @@ def compose():
                 composer_type = 'simple_markdown'
 
         # Create initial progress file
-        storage_root = get_storage_root()
-        job_dir = Path(storage_root) / job_id
-        progress_file = job_dir / 'composingservice-progress.json'
-        
         progress = {
             'book_id': job_id,
             'composer': composer_type,
             'status': 'pending',
+            'priority': priority,
             'created_at': datetime.now().isoformat(),
             'message': 'EPUB composition job submitted via API',
-            'uploaded_files': saved_files
+            'uploaded_files': saved_files,
+            # Keys for downstream caches, so they need not read the inputs to know their content
+            'input_sha256': input_hashes,
+            # What the files looked like when hashed; while they still do, the worker reuses input_sha256
+            'input_stat': input_stats
         }
 
-        with open(progress_file, 'w', encoding='utf-8') as f:
-            json.dump(progress, f, indent=2, ensure_ascii=False)
+        storage.write_bytes(f'{book_key}/composingservice-progress.json',
+                            json.dumps(progress, indent=2, ensure_ascii=False).encode('utf-8'))
+
+        # Tell the worker about the job directly instead of waiting for its next storage scan
+        config = get_composer_config()
+        if config['job_spool']:
+            try:
+                write_ticket(storage_placement.find_book_root(job_id), config['spool_dirname'], job_id, priority=priority)
+            except Exception as e:
+                logger.warn(f"Error writing job ticket for {job_id}, the worker's scan will pick it up: {str(e)}")
 
         return jsonify({
             'jobId': job_id,
             'message': 'EPUB composition job submitted successfully. The composing service will process it automatically.',
             'composer': composer_type,
-            'uploadedFiles': saved_files
+            'uploadedFiles': saved_files,
+            'inputSha256': input_hashes
         })
 
     except Exception as e:
@@ -402,9 +659,112 @@ def job_status():
         return jsonify({'error': 'Missing jobId parameter'}), 400
 
     progress = get_job_progress(job_id)
+    storage_root = storage_placement.find_book_root(job_id)
+    if storage_root is None:
+        return jsonify(progress)
+    if progress['status'] == 'pending':
+        try:
+            for entry in get_queue_snapshot(storage_root)['jobs']:
+                if entry['bookId'] == job_id:
+                    progress['queuePosition'] = entry['position']
+                    break
+        except Exception as e:
+            logger.warn(f"Error reading queue snapshot: {str(e)}")
+    try:
+        estimate_completion(job_id, storage_root, progress)
+    except Exception as e:
+        logger.warn(f"Error estimating completion of {job_id}: {str(e)}")
     return jsonify(progress)
 
 
+@app.route('/api/cancel', methods=['POST'])
+def cancel():
+    """
+    POST /api/cancel?jobId=...
+    Cancel a pending or in-flight EPUB composition job
+    """
+    job_id = request.args.get('jobId') or request.form.get('jobId')
+    if not job_id:
+        return jsonify({'error': 'Missing jobId parameter'}), 400
+
+    current_status = get_job_progress(job_id)
+    if current_status['status'] == 'not_found':
+        return jsonify({'error': 'Job not found', 'jobId': job_id}), 404
+    if current_status['status'] in ['completed', 'failed', 'cancelled']:
+        return jsonify({
+            'error': f"Job already {current_status['status']}",
+            'jobId': job_id,
+            'status': current_status['status']
+        }), 409
+
+    try:
+        storage, book_key = get_book_storage(job_id, create=True)
+        config = get_composer_config()
+        # The worker polls for this marker between stages and inside its loops
+        storage.write_bytes(f"{book_key}/{config['cancel_filename']}",
+                            json.dumps({'requested_at': datetime.now().isoformat()}).encode('utf-8'))
+
+        if current_status['status'] == 'pending':
+            progress = current_status['progress'] or {'book_id': job_id}
+            progress['status'] = 'cancelled'
+            progress['cancelled_at'] = datetime.now().isoformat()
+            storage.write_bytes(f'{book_key}/composingservice-progress.json',
+                                json.dumps(progress, indent=2, ensure_ascii=False).encode('utf-8'))
+            return jsonify({'jobId': job_id, 'status': 'cancelled', 'message': 'Job cancelled before it started'})
+
+        if config['job_spool'] and not storage.is_local():
+            # A worker composing from a working copy only sees the marker once it pulls the book again
+            try:
+                write_ticket(storage_placement.find_book_root(job_id), config['spool_dirname'], job_id)
+            except Exception as e:
+                logger.warn(f"Error writing job ticket for {job_id}, the worker's next scan will pick up the cancellation: {str(e)}")
+
+        return jsonify({
+            'jobId': job_id,
+            'status': 'cancelling',
+            'message': 'Cancellation requested. The composition will stop at its next checkpoint.'
+        }), 202
+
+    except Exception as e:
+        logger.error(f"Error in cancel endpoint: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error',
+            'details': str(e)
+        }), 500
+
+
+@app.route('/api/queue')
+def queue():
+    """
+    GET /api/queue
+    Inspect pending composition jobs in dispatch order
+    """
+    try:
+        return jsonify(get_queue_snapshot())
+    except Exception as e:
+        logger.error(f"Error reading queue snapshot: {str(e)}")
+        return jsonify({
+            'error': 'Error reading queue',
+            'details': str(e)
+        }), 500
+
+
+@app.route('/api/scaling')
+def scaling():
+    """
+    GET /api/scaling
+    Desired worker replicas and current concurrency, for an external autoscaler
+    """
+    try:
+        return jsonify(get_scaling_signal())
+    except Exception as e:
+        logger.error(f"Error reading scaling signal: {str(e)}")
+        return jsonify({
+            'error': 'Error reading scaling signal',
+            'details': str(e)
+        }), 500
+
+
 @app.route('/api/download')
 def download():
     """
@@ -419,7 +779,29 @@ def download():
     current_status = get_job_progress(job_id)
     if current_status['status'] == 'not_found':
         return jsonify({'error': 'Job not found'}), 404
-    elif current_status['status'] != 'completed':
+    elif request.args.get('interim', 'false').lower() == 'true':
+        if not current_status.get('interimAvailable'):
+            return jsonify({
+                'error': 'No interim EPUB available',
+                'status': current_status['status'],
+                'message': current_status['message']
+            }), 400
+        storage, book_key = get_book_storage(job_id)
+        interim_file = f"{book_key}/{get_composer_config()['interim_epub_filename']}"
+        try:
+            return send_file(
+                open_stored_file(storage, interim_file),
+                as_attachment=True,
+                download_name=f'interim-{job_id}.epub',
+                mimetype='application/epub+zip'
+            )
+        except Exception as e:
+            logger.error(f"Error downloading file {interim_file}: {str(e)}")
+            return jsonify({
+                'error': 'Error downloading file',
+                'details': str(e)
+            }), 500
+    elif current_status['status'] != 'completed' and not current_status.get('recomposing'):
         return jsonify({
             'error': 'Job not completed',
             'status': current_status['status'],
@@ -427,18 +809,17 @@ def download():
         }), 400
 
     # Find the output EPUB file
-    storage_root = get_storage_root()
-    job_dir = Path(storage_root) / job_id
+    storage, book_key = get_book_storage(job_id)
     
     # Prioritize dual-language EPUB if available
     possible_files = [
-        job_dir / 'dual-language-final.epub',
-        job_dir / 'final.epub'
+        f'{book_key}/dual-language-final.epub',
+        f'{book_key}/final.epub'
     ]
     
     output_file = None
     for file_path in possible_files:
-        if file_path.exists():
+        if storage.exists(file_path):
             output_file = file_path
             break
     
@@ -449,14 +830,14 @@ def download():
         }), 500
 
     # Determine download filename
-    if 'dual-language' in output_file.name:
+    if 'dual-language' in output_file.rpartition('/')[2]:
         download_filename = f'dual-language-{job_id}.epub'
     else:
         download_filename = f'composed-{job_id}.epub'
 
     try:
         return send_file(
-            str(output_file),
+            open_stored_file(storage, output_file),
             as_attachment=True,
             download_name=download_filename,
             mimetype='application/epub+zip'
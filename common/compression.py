@@ -0,0 +1,99 @@
+import gzip
+import io
+import os
+import pathlib
+import shutil
+from typing import IO, Iterable, Optional, Set
+
+# Codecs for cold artifacts (see core/StorageRetention.py) and the suffix each adds to a file name
+COMPRESSION_CODECS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Copy buffer when compressing
+CHUNK_SIZE = 1024 * 1024
+
+
+def logical_name(name: str) -> str:
+    """The name a file is known by, without its compression suffix."""
+    for suffix in COMPRESSION_CODECS.values():
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def with_logical_names(names: Iterable[str]) -> Set[str]:
+    """A folder listing in which compressed files also appear under their uncompressed names."""
+    names = set(names)
+    return names | {logical_name(name) for name in names}
+
+
+def stored_path(path: pathlib.Path) -> Optional[pathlib.Path]:
+    """The file holding `path`: itself, or its compressed copy. None if neither exists."""
+    path = pathlib.Path(path)
+    if path.exists():
+        return path
+    for suffix in COMPRESSION_CODECS.values():
+        compressed = path.with_name(path.name + suffix)
+        if compressed.exists():
+            return compressed
+    return None
+
+
+def open_binary(path: pathlib.Path) -> IO[bytes]:
+    """
+    Open a file for reading whether it is stored as is or was compressed by the
+    retention manager. FileNotFoundError if there is neither.
+    """
+    stored = stored_path(path)
+    if stored is None:
+        raise FileNotFoundError(str(path))
+    if stored.name.endswith(COMPRESSION_CODECS['gzip']):
+        return gzip.open(stored, 'rb')
+    if stored.name.endswith(COMPRESSION_CODECS['zstd']):
+        zstd = _zstandard()
+        return io.BufferedReader(zstd.ZstdDecompressor().stream_reader(open(stored, 'rb'), closefd=True))
+    return open(stored, 'rb')
+
+
+def open_text(path: pathlib.Path, encoding: str = 'utf-8', errors: Optional[str] = None) -> IO[str]:
+    """Open a text file for reading, plain or compressed (see open_binary)."""
+    return io.TextIOWrapper(open_binary(path), encoding=encoding, errors=errors)
+
+
+def compress_file(path: pathlib.Path, codec: str, level: Optional[int] = None) -> int:
+    """
+    Replace a file with its compressed copy (same modification time) and return
+    the size of the copy. The copy is written under a temporary name first, so a
+    reader always finds one of the two.
+    """
+    if codec not in COMPRESSION_CODECS:
+        raise ValueError(f"Unknown compression codec '{codec}', expected one of {', '.join(COMPRESSION_CODECS)}")
+    path = pathlib.Path(path)
+    target = path.with_name(path.name + COMPRESSION_CODECS[codec])
+    tmp_path = path.with_name(f".{target.name}.{os.getpid()}.tmp")
+    source_stat = path.stat()
+    try:
+        with open(path, 'rb') as source, open(tmp_path, 'wb') as raw:
+            if codec == 'gzip':
+                with gzip.GzipFile(filename=path.name, mode='wb', fileobj=raw, compresslevel=level or 6,
+                                   mtime=int(source_stat.st_mtime)) as f:
+                    shutil.copyfileobj(source, f, CHUNK_SIZE)
+            else:
+                zstd = _zstandard()
+                zstd.ZstdCompressor(level=level or 10).copy_stream(source, raw, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE)
+        os.utime(tmp_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        os.replace(tmp_path, target)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    # Only remove the original if nobody rewrote it meanwhile; the newer plain file then wins
+    if path.stat().st_mtime_ns == source_stat.st_mtime_ns:
+        path.unlink()
+    return target.stat().st_size
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("zstd compression requires the zstandard package (pip install zstandard)") from e
+    return zstandard
@@ -1,16 +1,149 @@
 import os
 import pathlib
+import socket
+from typing import Dict, List
+
+# Per-root options accepted in STORAGE_ROOTS, and the worker setting each one overrides
+STORAGE_ROOT_OPTIONS = {
+    'concurrency': 'COMPOSER_CONCURRENCY',
+    'min_concurrency': 'COMPOSER_MIN_CONCURRENCY',
+    'max_concurrency': 'COMPOSER_MAX_CONCURRENCY',
+    'sleep_interval': 'SLEEP_INTERVAL',
+    'reconcile_interval': 'DISCOVERY_RECONCILE_INTERVAL',
+    'discovery': 'DISCOVERY_MODE',
+    'layout': 'STORAGE_LAYOUT',
+}
 
 def get_storage_root() -> str:
-    """Get the storage root directory path."""
-    return os.environ.get('STORAGE_ROOT', str(pathlib.Path(__file__).parent.parent.parent / 'storage'))
+    """Get the storage root directory path (the first of STORAGE_ROOTS when several are configured)."""
+    return get_storage_roots()[0]['path']
+
+def get_storage_roots() -> List[dict]:
+    """
+    Get the storage roots served by this deployment.
+
+    STORAGE_ROOTS is a comma-separated list of `path[;option=value...]`, where the
+    options are `weight` (share of new jobs placed on the root) and the per-root
+    worker settings in STORAGE_ROOT_OPTIONS. Without it, STORAGE_ROOT is the only root.
+    """
+    spec = os.environ.get('STORAGE_ROOTS', '').strip()
+    if not spec:
+        return [{'path': os.environ.get('STORAGE_ROOT', str(pathlib.Path(__file__).parent.parent.parent / 'storage')),
+                 'weight': 1, 'options': {}}]
+    roots = []
+    for entry in spec.split(','):
+        path, *options = [part.strip() for part in entry.split(';')]
+        if not path:
+            continue
+        root = {'path': path, 'weight': 1, 'options': {}}
+        for option in options:
+            name, _, value = option.partition('=')
+            name = name.strip()
+            if name == 'weight':
+                root['weight'] = max(0, int(value))
+            elif name in STORAGE_ROOT_OPTIONS:
+                root['options'][name] = value.strip()
+            else:
+                raise ValueError(f"Unknown option '{name}' for storage root {path}")
+        roots.append(root)
+    if not roots:
+        raise ValueError("STORAGE_ROOTS does not name any storage root")
+    if not any(root['weight'] > 0 for root in roots):
+        raise ValueError("STORAGE_ROOTS gives every storage root weight 0, so no root can take new jobs")
+    return roots
+
+def storage_root_environment(root: dict) -> Dict[str, str]:
+    """
+    Environment for a worker serving one storage root: STORAGE_ROOT set to the
+    root and its options applied. A per-root `concurrency` alone fixes the
+    root's concurrency, as COMPOSER_CONCURRENCY does on its own.
+    """
+    environment = {'STORAGE_ROOT': root['path']}
+    options = root['options']
+    if 'concurrency' in options:
+        environment['COMPOSER_MIN_CONCURRENCY'] = options['concurrency']
+        environment['COMPOSER_MAX_CONCURRENCY'] = options['concurrency']
+    for name, value in options.items():
+        environment[STORAGE_ROOT_OPTIONS[name]] = value
+    return environment
 
 def get_composer_config() -> dict:
     """Get composer configuration."""
+    concurrency = max(1, int(os.environ.get('COMPOSER_CONCURRENCY', '1')))
+    min_concurrency = max(1, int(os.environ.get('COMPOSER_MIN_CONCURRENCY', str(concurrency))))
     return {
         'default_composer': os.environ.get('DEFAULT_COMPOSER', 'real_storage_dual_language_markdown'),
         'sleep_interval': int(os.environ.get('SLEEP_INTERVAL', '10')),
+        'discovery_mode': os.environ.get('DISCOVERY_MODE', 'auto'),
+        'discovery_reconcile_interval': int(os.environ.get('DISCOVERY_RECONCILE_INTERVAL', '300')),
+        'concurrency': concurrency,
+        'min_concurrency': min_concurrency,
+        'max_concurrency': max(min_concurrency, int(os.environ.get('COMPOSER_MAX_CONCURRENCY', str(max(concurrency, min_concurrency))))),
+        'autoscale_interval': int(os.environ.get('AUTOSCALE_INTERVAL', '30')),
+        'autoscale_target_drain_seconds': max(1, int(os.environ.get('AUTOSCALE_TARGET_DRAIN_SECONDS', '600'))),
+        'job_timeout': int(os.environ.get('JOB_TIMEOUT', '0')),
+        'job_memory_limit_mb': int(os.environ.get('JOB_MEMORY_LIMIT_MB', '0')),
+        'pool_start_method': os.environ.get('COMPOSER_POOL_START_METHOD', 'forkserver'),
+        'max_jobs_per_child': int(os.environ.get('COMPOSER_MAX_JOBS_PER_CHILD', '50')),
+        'max_child_rss_mb': int(os.environ.get('COMPOSER_MAX_CHILD_RSS_MB', '0')),
+        'composer_executor': os.environ.get('COMPOSER_EXECUTOR', 'process'),
+        'pipeline_io_workers': max(1, int(os.environ.get('PIPELINE_IO_WORKERS', '2'))),
+        'pipeline_cpu_workers': max(0, int(os.environ.get('PIPELINE_CPU_WORKERS', '0'))),
+        'pipeline_queue_size': max(1, int(os.environ.get('PIPELINE_QUEUE_SIZE', '4'))),
+        'scheduler_paid_weight': int(os.environ.get('SCHEDULER_PAID_WEIGHT', '3')),
+        'scheduler_free_weight': int(os.environ.get('SCHEDULER_FREE_WEIGHT', '1')),
+        'scheduler_large_job_bytes': int(os.environ.get('SCHEDULER_LARGE_JOB_BYTES', str(20 * 1024 * 1024))),
+        'scheduler_large_job_slots': int(os.environ.get('SCHEDULER_LARGE_JOB_SLOTS', '1')),
+        'scheduler_max_wait': int(os.environ.get('SCHEDULER_MAX_WAIT', '1800')),
+        'node_id': os.environ.get('WORKER_NODE_ID') or socket.gethostname(),
+        'lease_ttl': int(os.environ.get('LEASE_TTL', '120')),
+        'lease_heartbeat_interval': int(os.environ.get('LEASE_HEARTBEAT_INTERVAL', '30')),
+        'retry_max_attempts': max(1, int(os.environ.get('RETRY_MAX_ATTEMPTS', '5'))),
+        'retry_base_delay': int(os.environ.get('RETRY_BASE_DELAY', '60')),
+        'retry_max_delay': int(os.environ.get('RETRY_MAX_DELAY', '3600')),
+        'progressive_composition': os.environ.get('PROGRESSIVE_COMPOSITION', 'false').lower() == 'true',
+        'progressive_settle_seconds': int(os.environ.get('PROGRESSIVE_SETTLE_SECONDS', '120')),
+        'speculative_preparation': os.environ.get('SPECULATIVE_PREPARATION', 'false').lower() == 'true',
+        'recompose_on_input_change': os.environ.get('RECOMPOSE_ON_INPUT_CHANGE', 'true').lower() == 'true',
+        'drain_grace_period': int(os.environ.get('DRAIN_GRACE_PERIOD', '25')),
+        'storage_placement': os.environ.get('STORAGE_PLACEMENT', 'most_free'),
+        'job_index': os.environ.get('JOB_INDEX', 'true').lower() == 'true',
+        'job_index_dir': os.environ.get('JOB_INDEX_DIR', ''),
+        'storage_backend': os.environ.get('STORAGE_BACKEND', 'local').strip().lower() or 'local',
+        's3_bucket': os.environ.get('S3_BUCKET', ''),
+        's3_prefix': os.environ.get('S3_PREFIX', ''),
+        's3_endpoint_url': os.environ.get('S3_ENDPOINT_URL', ''),
+        's3_region': os.environ.get('S3_REGION', os.environ.get('AWS_REGION', '')),
+        's3_max_pool_connections': max(1, int(os.environ.get('S3_MAX_POOL_CONNECTIONS', '32'))),
+        's3_transfer_workers': max(1, int(os.environ.get('S3_TRANSFER_WORKERS', '8'))),
+        's3_multipart_threshold_mb': max(5, int(os.environ.get('S3_MULTIPART_THRESHOLD_MB', '16'))),
+        's3_multipart_chunk_mb': max(5, int(os.environ.get('S3_MULTIPART_CHUNK_MB', '8'))),
+        's3_range_size_mb': max(1, int(os.environ.get('S3_RANGE_SIZE_MB', '8'))),
+        'retention_interval': int(os.environ.get('RETENTION_INTERVAL', '0')),
+        'retention_compression': os.environ.get('RETENTION_COMPRESSION', 'gzip').strip().lower() or 'gzip',
+        'retention_compress_after_days': float(os.environ.get('RETENTION_COMPRESS_AFTER_DAYS', '7')),
+        'retention_artifact_max_age_days': float(os.environ.get('RETENTION_ARTIFACT_MAX_AGE_DAYS', '7')),
+        'retention_book_max_age_days': float(os.environ.get('RETENTION_BOOK_MAX_AGE_DAYS', '0')),
+        'retention_max_storage_gb': float(os.environ.get('RETENTION_MAX_STORAGE_GB', '0')),
+        'retention_temp_max_age_hours': float(os.environ.get('RETENTION_TEMP_MAX_AGE_HOURS', '24')),
+        'job_spool': os.environ.get('JOB_SPOOL', 'true').lower() == 'true',
+        'spool_poll_interval': float(os.environ.get('JOB_SPOOL_POLL_INTERVAL', '1')),
+        # Defaults to the scan interval: books written into storage without a ticket are found as quickly as before
+        'spool_reconcile_interval': int(os.environ.get('JOB_SPOOL_RECONCILE_INTERVAL', os.environ.get('SLEEP_INTERVAL', '10'))),
+        'spool_dirname': 'queue',
+        'upload_dedupe': os.environ.get('UPLOAD_DEDUPE', 'true').lower() == 'true',
+        'blob_dirname': 'blobs',
+        'lease_filename': 'composingservice.lease',
+        'cancel_filename': 'composingservice-cancel.json',
+        'scaling_filename': 'composingservice-scaling.json',
+        'prepared_original_filename': 'composingservice-original-prepared.json',
+        'rendered_sections_filename': 'composingservice-rendered-sections.json',
+        'interim_epub_filename': 'interim.epub',
+        'queue_filename': 'composingservice-queue.json',
+        'retention_report_filename': 'composingservice-retention.json',
+        'cost_measurements_filename': 'composingservice-cost-measurements.jsonl',
+        'cost_model_filename': 'composingservice-cost-model.json',
         'progress_filename': 'composingservice-progress.json',
         'translated_content_filename': 'translatedcontent.md',
         'final_epub_filename': 'final.epub'
-    } 
\ No newline at end of file
+    }
@@ -4,11 +4,20 @@ import pathlib
 from datetime import datetime
 from typing import Optional
 
+from common.storage_backend import LocalStorageBackend
+
 class ComposingServiceLogger:
     def __init__(self, storage_root: str, service_name: str = "ComposingService"):
         self.storage_root = storage_root
         self.service_name = service_name
         self.logger = self._setup_logger()
+        # Where per-book logs go; the worker keeps them in its storage root (a working
+        # copy with a remote STORAGE_BACKEND), the API writes them to the backend
+        self.storage = None
+    
+    def use_storage(self, storage) -> None:
+        """Write per-book logs through the given StorageBackend."""
+        self.storage = storage
     
     def _setup_logger(self) -> logging.Logger:
         """Setup logger with file and console handlers."""
@@ -42,15 +51,14 @@ class ComposingServiceLogger:
     def _write_book_log(self, book_id: str, message: str, level: str = "INFO"):
         """Write to book-specific log file."""
         try:
-            book_log_dir = pathlib.Path(self.storage_root) / book_id
-            book_log_dir.mkdir(parents=True, exist_ok=True)
-            book_log_path = book_log_dir / f"{self.service_name.lower()}-book.log"
+            if self.storage is None:
+                self.storage = LocalStorageBackend(self.storage_root)
+            book_log_key = f"{self.storage.book_key(book_id)}/{self.service_name.lower()}-book.log"
             
             timestamp = datetime.now().isoformat()
             log_entry = f"[{timestamp}] {level} [{self.service_name}] [{book_id}] {message}\n"
             
-            with open(book_log_path, 'a', encoding='utf-8') as f:
-                f.write(log_entry)
+            self.storage.append_bytes(book_log_key, log_entry.encode('utf-8'))
         except Exception as e:
             self.logger.error(f"Failed to write book log: {e}")
     
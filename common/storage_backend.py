@@ -0,0 +1,479 @@
+import hashlib
+import io
+import itertools
+import os
+import pathlib
+import re
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from common.storage_layout import book_path, get_storage_layout, shard_of
+
+# Backends selected by STORAGE_BACKEND
+STORAGE_BACKENDS = ['local', 'memory', 's3']
+
+# Last segment of the objects S3 appends are written to: '<key>/<time_ns>-<pid>-<sequence>'
+APPENDED_RECORD = re.compile(r'\d{20}-\d+-\d+')
+
+
+class ObjectStat:
+    __slots__ = ('size', 'mtime', 'etag')
+
+    def __init__(self, size: int, mtime: float, etag: Optional[str] = None):
+        self.size = size
+        self.mtime = mtime
+        # Changes whenever the object's content is replaced; None where the backend has no such tag
+        self.etag = etag
+
+
+class StorageBackend(ABC):
+    """
+    Access to what lives under a storage root: the book folders, the events and
+    queue folders and the files the worker publishes for the API.
+
+    Keys are '/'-separated paths relative to the root, e.g. 'book-1/final.epub'
+    or 'events/<name>.json'. Writes replace the whole object atomically.
+    """
+
+    @abstractmethod
+    def get_name(self) -> str:
+        """Return the name of this backend."""
+        pass
+
+    @abstractmethod
+    def read_bytes(self, key: str) -> bytes:
+        """Read an object; FileNotFoundError if there is none."""
+        pass
+
+    @abstractmethod
+    def write_bytes(self, key: str, data: bytes) -> None:
+        """Create or replace an object."""
+        pass
+
+    @abstractmethod
+    def append_bytes(self, key: str, data: bytes) -> None:
+        """
+        Append to an object, creating it if needed. Concurrent appends from
+        several processes all land; read the result with read_appended().
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove an object if it exists."""
+        pass
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[ObjectStat]:
+        """Size, modification time and (where the backend has one) ETag of an object, None if there is none."""
+        pass
+
+    @abstractmethod
+    def list(self, prefix: str = '') -> Dict[str, ObjectStat]:
+        """Every object whose key starts with `prefix`, recursively, keyed by full key."""
+        pass
+
+    def read_appended(self, key: str) -> bytes:
+        """Read an object written with append_bytes(); FileNotFoundError if nothing was written."""
+        return self.read_bytes(key)
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def download(self, key: str, path: pathlib.Path) -> None:
+        """Copy an object to a local file."""
+        data = self.read_bytes(key)
+        _write_file(path, lambda f: f.write(data))
+
+    def upload(self, path: pathlib.Path, key: str) -> None:
+        """Copy a local file to an object."""
+        with open(path, 'rb') as f:
+            self.write_bytes(key, f.read())
+
+    def link(self, source_key: str, key: str) -> None:
+        """Make `key` hold the content of `source_key`, sharing the stored data where the backend can."""
+        self.write_bytes(key, self.read_bytes(source_key))
+
+    def local_path(self, key: str) -> Optional[pathlib.Path]:
+        """The local file behind a key, for backends that keep objects on the local filesystem."""
+        return None
+
+    def is_local(self) -> bool:
+        """Whether the storage root is a local (or network-mounted) directory the worker composes in directly."""
+        return False
+
+    def book_key(self, book_id: str) -> str:
+        """Key of a book's folder, following STORAGE_LAYOUT."""
+        if get_storage_layout() == 'sharded':
+            return f"{shard_of(book_id).as_posix()}/{book_id}"
+        return book_id
+
+    def book_exists(self, book_id: str) -> bool:
+        return bool(self.list(self.book_key(book_id) + '/'))
+
+
+class LocalStorageBackend(StorageBackend):
+    """A storage root on the local filesystem or a network mount such as EFS (the default)."""
+
+    def __init__(self, storage_root: str):
+        self.root = pathlib.Path(storage_root)
+
+    def get_name(self) -> str:
+        return "local"
+
+    def read_bytes(self, key: str) -> bytes:
+        with open(self.root / key, 'rb') as f:
+            return f.read()
+
+    def write_bytes(self, key: str, data: bytes) -> None:
+        _write_file(self.root / key, lambda f: f.write(data))
+
+    def append_bytes(self, key: str, data: bytes) -> None:
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(data)
+
+    def delete(self, key: str) -> None:
+        try:
+            (self.root / key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def stat(self, key: str) -> Optional[ObjectStat]:
+        try:
+            st = os.stat(self.root / key)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return ObjectStat(st.st_size, st.st_mtime)
+
+    def list(self, prefix: str = '') -> Dict[str, ObjectStat]:
+        objects: Dict[str, ObjectStat] = {}
+        for dirpath, _, filenames in os.walk(self.root / prefix.rpartition('/')[0]):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                key = pathlib.Path(path).relative_to(self.root).as_posix()
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                objects[key] = ObjectStat(st.st_size, st.st_mtime)
+        return objects
+
+    def download(self, key: str, path: pathlib.Path) -> None:
+        shutil.copyfile(self.root / key, path)
+
+    def upload(self, path: pathlib.Path, key: str) -> None:
+        target = self.root / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, target)
+
+    def link(self, source_key: str, key: str) -> None:
+        # A hard link under a temporary name renamed into place; a copy where the filesystem has no hard links
+        target = self.root / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            try:
+                os.link(self.root / source_key, tmp_path)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                shutil.copyfile(self.root / source_key, tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def local_path(self, key: str) -> Optional[pathlib.Path]:
+        return self.root / key
+
+    def is_local(self) -> bool:
+        return True
+
+    def book_key(self, book_id: str) -> str:
+        # In the sharded layout a book that is not migrated yet keeps its flat folder
+        return book_path(str(self.root), book_id).relative_to(self.root).as_posix()
+
+    def book_exists(self, book_id: str) -> bool:
+        return book_path(str(self.root), book_id).is_dir()
+
+
+class InMemoryStorageBackend(StorageBackend):
+    """Objects kept in this process's memory, for tests and offline experiments."""
+
+    def __init__(self):
+        self._objects: Dict[str, Tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    def get_name(self) -> str:
+        return "memory"
+
+    def read_bytes(self, key: str) -> bytes:
+        with self._lock:
+            if key not in self._objects:
+                raise FileNotFoundError(key)
+            return self._objects[key][0]
+
+    def write_bytes(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._objects[key] = (bytes(data), time.time())
+
+    def append_bytes(self, key: str, data: bytes) -> None:
+        with self._lock:
+            previous = self._objects.get(key, (b'', 0.0))[0]
+            self._objects[key] = (previous + data, time.time())
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def link(self, source_key: str, key: str) -> None:
+        with self._lock:
+            if source_key not in self._objects:
+                raise FileNotFoundError(source_key)
+            self._objects[key] = (self._objects[source_key][0], time.time())
+
+    def stat(self, key: str) -> Optional[ObjectStat]:
+        with self._lock:
+            entry = self._objects.get(key)
+        return ObjectStat(len(entry[0]), entry[1], _etag(entry[0])) if entry is not None else None
+
+    def list(self, prefix: str = '') -> Dict[str, ObjectStat]:
+        with self._lock:
+            return {key: ObjectStat(len(data), mtime, _etag(data)) for key, (data, mtime) in self._objects.items()
+                    if key.startswith(prefix)}
+
+
+class S3StorageBackend(StorageBackend):
+    """
+    A storage root in an S3-compatible bucket (AWS S3, MinIO, or a local stand-in
+    such as moto_server, selected with S3_ENDPOINT_URL).
+
+    One client per process holds a pool of up to S3_MAX_POOL_CONNECTIONS
+    connections shared by all threads. Objects larger than S3_MULTIPART_THRESHOLD_MB
+    (composed EPUBs) are uploaded in parts, and objects larger than S3_RANGE_SIZE_MB
+    (inputs, images) are read as parallel ranged GETs pinned to the object's ETag,
+    both with S3_TRANSFER_WORKERS threads.
+    """
+
+    def __init__(self, config: dict):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)") from e
+        if not config['s3_bucket']:
+            raise ValueError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        self._client_error = ClientError
+        self.bucket = config['s3_bucket']
+        self.prefix = config['s3_prefix'].strip('/') + '/' if config['s3_prefix'].strip('/') else ''
+        self.range_size = config['s3_range_size_mb'] * 1024 * 1024
+        self.multipart_threshold = config['s3_multipart_threshold_mb'] * 1024 * 1024
+        self.workers = config['s3_transfer_workers']
+        self.client = boto3.session.Session().client(
+            's3',
+            endpoint_url=config['s3_endpoint_url'] or None,
+            region_name=config['s3_region'] or None,
+            config=Config(max_pool_connections=config['s3_max_pool_connections'],
+                          retries={'max_attempts': 5, 'mode': 'standard'}),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=max(5 * 1024 * 1024, config['s3_multipart_chunk_mb'] * 1024 * 1024),
+            max_concurrency=self.workers,
+            use_threads=True,
+        )
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def get_name(self) -> str:
+        return "s3"
+
+    def read_bytes(self, key: str) -> bytes:
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        size = head['ContentLength']
+        if size <= self.range_size:
+            return self._get(key)
+        buffer = bytearray(size)
+
+        def store(offset: int, data: bytes) -> None:
+            buffer[offset:offset + len(data)] = data
+
+        self._read_ranges(key, size, head['ETag'], store)
+        return bytes(buffer)
+
+    def write_bytes(self, key: str, data: bytes) -> None:
+        if len(data) > self.multipart_threshold:
+            self.client.upload_fileobj(io.BytesIO(data), self.bucket, self.prefix + key, Config=self.transfer_config)
+        else:
+            self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def append_bytes(self, key: str, data: bytes) -> None:
+        # S3 cannot append, and rewriting the object would lose records appended
+        # meanwhile by other processes: each record is an object of its own
+        record_key = f"{key}/{time.time_ns():020d}-{os.getpid()}-{next(self._sequence)}"
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + record_key, Body=data)
+
+    def read_appended(self, key: str) -> bytes:
+        """The object itself, if any (e.g. a log pushed from a working copy), followed by its records in order."""
+        try:
+            data = self._get(key)
+        except FileNotFoundError:
+            data = None
+        # In order of time, then of process and sequence number
+        records = sorted((record_key for record_key in self.list(key + '/') if is_appended_record(record_key)),
+                         key=lambda record_key: tuple(int(part) for part in record_key.rsplit('/', 1)[1].split('-')))
+        if data is None and not records:
+            raise FileNotFoundError(key)
+        return (data or b'') + b''.join(self._get(record_key) for record_key in records)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def stat(self, key: str) -> Optional[ObjectStat]:
+        head = self._head(key)
+        if head is None:
+            return None
+        return ObjectStat(head['ContentLength'], head['LastModified'].timestamp(), head.get('ETag'))
+
+    def list(self, prefix: str = '') -> Dict[str, ObjectStat]:
+        objects: Dict[str, ObjectStat] = {}
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get('Contents', []):
+                objects[item['Key'][len(self.prefix):]] = ObjectStat(item['Size'], item['LastModified'].timestamp(),
+                                                                     item.get('ETag'))
+        return objects
+
+    def download(self, key: str, path: pathlib.Path) -> None:
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        size = head['ContentLength']
+        if size <= self.range_size:
+            data = self._get(key)
+            _write_file(path, lambda f: f.write(data))
+            return
+
+        def fetch(f) -> None:
+            f.truncate(size)
+            fd = f.fileno()
+            self._read_ranges(key, size, head['ETag'], lambda offset, data: os.pwrite(fd, data, offset))
+
+        _write_file(path, fetch)
+
+    def upload(self, path: pathlib.Path, key: str) -> None:
+        # upload_file switches to a parallel multipart upload above the threshold
+        self.client.upload_file(str(path), self.bucket, self.prefix + key, Config=self.transfer_config)
+
+    def link(self, source_key: str, key: str) -> None:
+        # A server-side copy: the data is not transferred again (in parts above the multipart threshold)
+        if self._head(source_key) is None:
+            raise FileNotFoundError(source_key)
+        self.client.copy({'Bucket': self.bucket, 'Key': self.prefix + source_key}, self.bucket, self.prefix + key,
+                         Config=self.transfer_config)
+
+    def book_exists(self, book_id: str) -> bool:
+        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=f"{self.prefix}{self.book_key(book_id)}/", MaxKeys=1)
+        return response.get('KeyCount', 0) > 0
+
+    def _get(self, key: str, **kwargs) -> bytes:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key, **kwargs)['Body'].read()
+        except self._client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self._client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404', 'NotFound'):
+                return None
+            raise
+
+    def _read_ranges(self, key: str, size: int, etag: str, store: Callable[[int, bytes], None]) -> None:
+        """Read an object as parallel ranged GETs; IfMatch fails the read if the object is replaced meanwhile."""
+        def fetch(start: int) -> None:
+            end = min(start + self.range_size, size) - 1
+            store(start, self._get(key, Range=f"bytes={start}-{end}", IfMatch=etag))
+
+        for _ in self._pool().map(fetch, range(0, size, self.range_size)):
+            pass
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='s3-read')
+            return self._executor
+
+
+def is_appended_record(key: str) -> bool:
+    """Whether a key is one of the records S3StorageBackend.append_bytes() writes under the appended key."""
+    return APPENDED_RECORD.fullmatch(key.rsplit('/', 1)[-1]) is not None
+
+
+def _etag(data: bytes) -> str:
+    """An S3-style ETag (quoted MD5) for objects held in memory."""
+    return '"' + hashlib.md5(data).hexdigest() + '"'
+
+
+def _write_file(path: pathlib.Path, write: Callable) -> None:
+    """Write a local file under a temporary name and rename it into place."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+_backends: Dict[Tuple[int, str, str], StorageBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_storage_backend(storage_root: Optional[str] = None) -> StorageBackend:
+    """
+    The backend selected by STORAGE_BACKEND for a storage root, one per process.
+
+    With `s3` or `memory` the objects live in the backend, and STORAGE_ROOT is the
+    worker's local working copy (see core/StorageSync.py).
+    """
+    from common.configuration import get_composer_config, get_storage_root, get_storage_roots
+    config = get_composer_config()
+    name = config['storage_backend']
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{name}', expected one of {', '.join(STORAGE_BACKENDS)}")
+    if name != 'local' and len(get_storage_roots()) > 1:
+        raise ValueError(f"STORAGE_BACKEND={name} serves a single storage root, STORAGE_ROOTS names several")
+    storage_root = storage_root or get_storage_root()
+    # Clients must not be shared with forked children
+    cache_key = (os.getpid(), name, storage_root)
+    with _backends_lock:
+        backend = _backends.get(cache_key)
+        if backend is None:
+            if name == 'local':
+                backend = LocalStorageBackend(storage_root)
+            elif name == 'memory':
+                backend = InMemoryStorageBackend()
+            else:
+                backend = S3StorageBackend(config)
+            _backends[cache_key] = backend
+        return backend
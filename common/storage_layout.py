@@ -0,0 +1,99 @@
+import hashlib
+import os
+import pathlib
+import re
+from typing import Iterator, Optional
+
+# Layouts of the book folders under a storage root, selected by STORAGE_LAYOUT:
+# - flat: STORAGE_ROOT/<book_id>
+# - sharded: STORAGE_ROOT/<xx>/<yy>/<book_id>, where xxyy are the first hex digits of sha1(book_id)
+STORAGE_LAYOUTS = ['flat', 'sharded']
+
+# Number of directory levels above a book folder in the sharded layout, and hex digits per level
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+# Folders under the storage root that never hold a book
+NON_BOOK_DIRS = {'events', 'queue', 'blobs'}
+
+_SHARD_NAME = re.compile(r'^[0-9a-f]{%d}$' % SHARD_WIDTH)
+
+
+def get_storage_layout() -> str:
+    """Get the layout of the book folders (STORAGE_LAYOUT, default flat)."""
+    layout = os.environ.get('STORAGE_LAYOUT', 'flat').strip().lower() or 'flat'
+    if layout not in STORAGE_LAYOUTS:
+        raise ValueError(f"Unknown STORAGE_LAYOUT '{layout}', expected one of {', '.join(STORAGE_LAYOUTS)}")
+    return layout
+
+
+def is_shard_name(name: str) -> bool:
+    """Whether a folder name is a shard level of the sharded layout."""
+    return _SHARD_NAME.match(name) is not None
+
+
+def shard_of(book_id: str) -> pathlib.PurePath:
+    """The shard folders of a book in the sharded layout, e.g. 'a3/f0'."""
+    digest = hashlib.sha1(book_id.encode('utf-8')).hexdigest()
+    return pathlib.PurePath(*(digest[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH] for level in range(SHARD_LEVELS)))
+
+
+def sharded_book_path(storage_root: str, book_id: str) -> pathlib.Path:
+    """Where a book lives in the sharded layout."""
+    return pathlib.Path(storage_root) / shard_of(book_id) / book_id
+
+
+def book_path(storage_root: str, book_id: str, layout: Optional[str] = None) -> pathlib.Path:
+    """
+    The folder of a book under a storage root.
+
+    In the sharded layout a book that still has a flat folder (not migrated yet,
+    see core/StorageMigration.py) is found there, so a root can be switched to
+    the sharded layout before its existing folders are moved. New books get
+    sharded folders.
+    """
+    root = pathlib.Path(storage_root)
+    if (layout or get_storage_layout()) == 'flat':
+        return root / book_id
+    sharded = sharded_book_path(storage_root, book_id)
+    if not sharded.is_dir():
+        flat = root / book_id
+        if flat.is_dir():
+            return flat
+    return sharded
+
+
+def iter_flat_book_dirs(storage_root: str, layout: Optional[str] = None) -> Iterator[pathlib.Path]:
+    """The book folders directly under the storage root (in the sharded layout, those still to migrate)."""
+    sharded = (layout or get_storage_layout()) == 'sharded'
+    try:
+        with os.scandir(storage_root) as entries:
+            for entry in entries:
+                if entry.name in NON_BOOK_DIRS or entry.name.startswith('.') or (sharded and is_shard_name(entry.name)):
+                    continue
+                if entry.is_dir():
+                    yield pathlib.Path(entry.path)
+    except FileNotFoundError:
+        return
+
+
+def iter_book_dirs(storage_root: str, layout: Optional[str] = None) -> Iterator[pathlib.Path]:
+    """Every book folder under a storage root, flat ones first."""
+    layout = layout or get_storage_layout()
+    yield from iter_flat_book_dirs(storage_root, layout)
+    if layout == 'sharded':
+        yield from _iter_sharded(pathlib.Path(storage_root), SHARD_LEVELS)
+
+
+def _iter_sharded(folder: pathlib.Path, levels: int) -> Iterator[pathlib.Path]:
+    try:
+        with os.scandir(folder) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.')
+                           and (levels == 0 or is_shard_name(entry.name)))
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    for name in names:
+        if levels == 0:
+            yield folder / name
+        else:
+            yield from _iter_sharded(folder / name, levels - 1)
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import pathlib
+import tempfile
+from typing import BinaryIO, Tuple
+
+from common.storage_backend import StorageBackend
+
+# Bytes read from an upload stream at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Inputs stored through the blob area. Only those that are never rewritten after
+# upload: translations may be appended to or rewritten in place by their producers
+DEDUPED_INPUTS = {'originalbook.md'}
+
+
+class BlobStore:
+    """
+    Content-addressed store for uploaded inputs, under `blob_dirname` of a storage root.
+
+    Each distinct content is stored once, as `blobs/<xx>/<sha256>`, and a job's
+    input is a reference to it: a hard link on a local root (a copy where the
+    filesystem has none), a server-side copy on S3. So the same originalbook.md
+    submitted for several translation tiers, or resubmitted after a failure,
+    takes the space of one file and is not uploaded to the bucket twice.
+
+    A hard-linked input shares its data with every job linking the blob, so a
+    write to it in place would change all of them. Blobs are made read-only,
+    which only stops processes not running as root, so just the inputs in
+    DEDUPED_INPUTS, which nothing rewrites, are stored here. An updated
+    original must be written as a new file and renamed over the old one. Blobs
+    no job refers to any more are removed by the retention manager (see
+    core/StorageRetention.py).
+    """
+
+    def __init__(self, storage: StorageBackend, config: dict):
+        self.storage = storage
+        self.dirname = config['blob_dirname']
+
+    def blob_key(self, digest: str) -> str:
+        return f"{self.dirname}/{digest[:2]}/{digest}"
+
+    def store(self, stream: BinaryIO, key: str) -> Tuple[str, int]:
+        """
+        Store the content of a stream at `key` through the blob area, hashing it
+        while it is read. Returns its SHA-256 hex digest and size.
+        """
+        spool_dir = self.storage.local_path(self.dirname)
+        if spool_dir is not None:
+            # Spool next to the blobs, so the finished file is linked into place rather than copied
+            spool_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix='.upload-', suffix='.tmp', dir=spool_dir)
+        tmp_path = pathlib.Path(tmp_name)
+        try:
+            sha256 = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = sha256.hexdigest()
+            blob_key = self.blob_key(digest)
+            blob_path = self.storage.local_path(blob_key)
+            if blob_path is None:
+                if not self.storage.exists(blob_key):
+                    self.storage.upload(tmp_path, blob_key)
+                self.storage.link(blob_key, key)
+                return digest, size
+            os.chmod(tmp_path, 0o444)
+            blob_path.parent.mkdir(exist_ok=True)
+            # An unreferenced blob may be removed by retention between linking it and linking to it; then store it again
+            for attempt in range(2):
+                try:
+                    os.link(tmp_path, blob_path)
+                except FileExistsError:
+                    pass
+                try:
+                    self.storage.link(blob_key, key)
+                    return digest, size
+                except FileNotFoundError:
+                    if attempt:
+                        raise
+        finally:
+            try:
+                tmp_path.unlink()
+            except FileNotFoundError:
+                pass
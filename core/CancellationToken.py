@@ -0,0 +1,59 @@
+import os
+import pathlib
+import time
+from typing import Optional
+from common.storage_layout import book_path
+
+
+class CompositionCancelled(Exception):
+    """Raised inside a composition when its job has been cancelled."""
+    pass
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation for a running composition.
+
+    Cancellation is requested by creating a marker file in the book folder
+    (see POST /api/cancel), so it works across the API, the worker and its
+    pool processes. The marker is checked at most every `check_interval`
+    seconds, which keeps checks inside tight per-section loops cheap.
+
+    interrupt_all() makes every token in the process raise a given exception on
+    its next check, which is how a worker running compositions on threads
+    aborts them when its drain deadline passes.
+    """
+
+    # Raised by every check() in this process once set (see interrupt_all)
+    _interrupt: Optional[BaseException] = None
+
+    def __init__(self, marker_path: Optional[pathlib.Path] = None, check_interval: float = 0.5):
+        self.marker_path = marker_path
+        self.check_interval = check_interval
+        self._cancelled = False
+        self._next_check = 0.0
+
+    @classmethod
+    def interrupt_all(cls, exc: Optional[BaseException]) -> None:
+        """Make check() raise `exc` in every composition of this process; None clears it."""
+        CancellationToken._interrupt = exc
+
+    @classmethod
+    def for_book(cls, storage_root: str, book_id: str, cancel_filename: str) -> 'CancellationToken':
+        return cls(book_path(storage_root, book_id) / cancel_filename)
+
+    def is_cancelled(self) -> bool:
+        if self._cancelled or self.marker_path is None:
+            return self._cancelled
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._cancelled = os.path.exists(self.marker_path)
+        return self._cancelled
+
+    def check(self) -> None:
+        """Raise CompositionCancelled if the job has been cancelled."""
+        if CancellationToken._interrupt is not None:
+            raise CancellationToken._interrupt
+        if self.is_cancelled():
+            raise CompositionCancelled()
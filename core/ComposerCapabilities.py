@@ -0,0 +1,51 @@
+import os
+import pathlib
+from typing import Dict, Iterable, List, Optional, Set
+
+from common.compression import with_logical_names
+
+
+class ComposerCapabilities:
+    """
+    What a composer needs from a book folder, declared on the composer class so
+    the factory can match it against a single directory listing without
+    instantiating the composer.
+
+    - filenames: the composer's configurable file names and their defaults, keyed
+      by the names set_filenames() accepts (e.g. 'translated_content_filename')
+    - requires: files that must all be present
+    - excludes: groups of files that, when all present, mean the book has
+      already been composed by this composer
+
+    Entries of `requires` and `excludes` are keys of `filenames`, resolved with
+    any overrides, or literal file names.
+    """
+
+    def __init__(self, filenames: Dict[str, str], requires: List[str], excludes: Iterable[List[str]] = ()):
+        self.filenames = filenames
+        self.requires = requires
+        self.excludes = list(excludes)
+
+    def resolve(self, overrides: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """The composer's file names with the overrides that apply to it."""
+        overrides = overrides or {}
+        return {key: overrides.get(key, default) for key, default in self.filenames.items()}
+
+    def matches(self, listing: Set[str], overrides: Optional[Dict[str, str]] = None) -> bool:
+        """Whether a book folder with these names can be composed."""
+        names = self.resolve(overrides)
+        if not all(names.get(entry, entry) in listing for entry in self.requires):
+            return False
+        return not any(all(names.get(entry, entry) in listing for entry in group) for group in self.excludes)
+
+
+def list_book_files(book_dir: pathlib.Path) -> Set[str]:
+    """
+    The names in a book folder from a single scandir (empty if there is no such
+    folder). Compressed files also count under their uncompressed names.
+    """
+    try:
+        with os.scandir(book_dir) as entries:
+            return with_logical_names(entry.name for entry in entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
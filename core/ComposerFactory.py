@@ -1,10 +1,12 @@
-from typing import Any, Dict, Type, Optional
+from typing import Any, Dict, Set, Tuple, Type, Optional
 from core.IComposer import IComposer
+from core.ComposerCapabilities import list_book_files
 from core.SimpleMarkdownComposer import SimpleMarkdownComposer
 from core.ParagraphByParagraphComposer import ParagraphByParagraphComposer
 from core.DualLanguageMarkdownComposer import DualLanguageMarkdownComposer
 from core.RealStorageDualLanguageComposer import RealStorageDualLanguageComposer
 from common.logger import get_logger
+from common.storage_layout import book_path
 
 class ComposerFactory:
     """Factory for creating composer instances."""
@@ -12,6 +14,8 @@ class ComposerFactory:
     def __init__(self):
         self.logger = get_logger()
         self._composers: Dict[str, Type[IComposer]] = {}
+        # Composer chosen per book, then per (storage root, filename overrides), kept until forget()
+        self._decisions: Dict[str, Dict[Tuple, Optional[str]]] = {}
         self._register_default_composers()
     
     def _register_default_composers(self):
@@ -41,15 +45,43 @@ class ComposerFactory:
         """Get list of available composer names."""
         return list(self._composers.keys())
     
-    def find_suitable_composer(self, book_id: str, storage_root: str, filenames: Optional[Dict[str, Any]] = None) -> Optional[IComposer]:
-        """Find the first composer that can handle the given book."""
-        for name, composer_class in self._composers.items():
-            composer = composer_class()
-            if filenames is not None:
-                composer.set_filenames(filenames)
-            if composer.can_compose(book_id, storage_root):
-                self.logger.info(f"Found suitable composer '{name}' for book {book_id}", book_id)
-                return composer
+    def find_suitable_composer(self, book_id: str, storage_root: str, filenames: Optional[Dict[str, Any]] = None,
+                               listing: Optional[Set[str]] = None) -> Optional[IComposer]:
+        """
+        Find the first composer that can handle the given book.
         
-        self.logger.warn(f"No suitable composer found for book {book_id}", book_id)
-        return None 
\ No newline at end of file
+        The composers' declared capabilities are matched against one listing of
+        the book folder (`listing` if the caller already has it), and only the
+        chosen composer is instantiated. A decision made from a given listing (a
+        scan) is kept for the book until forget() is called, so later lookups
+        without a listing reuse it; passing a fresh listing always re-evaluates
+        it. Lookups without a listing are never kept.
+        """
+        overrides = filenames or {}
+        key = (storage_root, tuple(sorted(overrides.items())))
+        decisions = self._decisions.get(book_id, {})
+        if listing is None and key in decisions:
+            name = decisions[key]
+        else:
+            remember = listing is not None
+            if listing is None:
+                listing = list_book_files(book_path(storage_root, book_id))
+            name = next((name for name, composer_class in self._composers.items()
+                         if composer_class.capabilities.matches(listing, overrides)), None)
+            if key not in decisions or decisions[key] != name:
+                if name is not None:
+                    self.logger.info(f"Found suitable composer '{name}' for book {book_id}", book_id)
+                else:
+                    self.logger.warn(f"No suitable composer found for book {book_id}", book_id)
+            if remember:
+                self._decisions.setdefault(book_id, {})[key] = name
+        if name is None:
+            return None
+        composer = self._composers[name]()
+        if filenames is not None:
+            composer.set_filenames(filenames)
+        return composer
+    
+    def forget(self, book_id: str) -> None:
+        """Drop the cached composer decisions for a book, once its job is over or it is not a job."""
+        self._decisions.pop(book_id, None)
@@ -0,0 +1,24 @@
+import time
+from typing import Optional, Set
+
+
+class ComposingJob:
+    """A unit of work produced by the storage scan: one book for one composing service."""
+
+    def __init__(self, service: str, book_id: str, filenames: Optional[Set[str]] = None,
+                 priority: str = 'normal', input_bytes: int = 0):
+        self.service = service
+        self.book_id = book_id
+        # Names found in the book folder during the scan that produced this job
+        self.filenames = filenames or set()
+        self.priority = priority
+        # Total size of the input markdown files, used for shortest-job-first ordering
+        self.input_bytes = input_bytes
+        self.enqueued_at = time.time()
+        # Wall time predicted by the cost model when the job was queued
+        self.estimated_seconds: Optional[float] = None
+        # Set when the job is dispatched, to measure job durations
+        self.started_at: Optional[float] = None
+
+    def __repr__(self) -> str:
+        return f"ComposingJob(service={self.service!r}, book_id={self.book_id!r})"
@@ -1,26 +1,119 @@
+import multiprocessing
 import os
 import pathlib
+import signal
+import threading
 import time
-from typing import List, Optional
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from core.CancellationToken import CancellationToken
 from core.ComposerFactory import ComposerFactory
+from core.ComposingJob import ComposingJob
+from core.ConcurrencyController import ConcurrencyController
+from core.CostModel import CostModel, PeakRssSampler, current_rss, prescan, schedule
 from core.IComposer import IComposer
 from core.IComposingWorker import IComposingWorker
+from core.JobDiscovery import JobDiscovery, create_job_discovery
+from core.JobIndex import JobIndex
+from core.JobIsolation import JobIsolation, OUTCOME_CRASHED, OUTCOME_FAILURE, OUTCOME_OOM, OUTCOME_SUCCESS, OUTCOME_TIMEOUT
+from core.JobLease import JobLeaseManager
+from core.JobScheduler import DEFAULT_PRIORITY, JobScheduler
+from core.RetryPolicy import DEAD_LETTER, RetryPolicy
+from core.StorageRetention import StorageRetention
+from core.StorageSync import create_storage_sync
+from core.composition_stages import get_composition_pipeline
+from core.input_fingerprints import changed_inputs, fingerprint_inputs, uploaded_fingerprints
+from core.original_preparation import ORIGINAL_FILENAME, needs_preparation, prepare_original
 from abc import ABC, abstractmethod
+from common.compression import stored_path, with_logical_names
 from common.configuration import get_storage_root, get_composer_config
 from common.logger import get_logger
+from common.storage_layout import book_path, iter_book_dirs
 from event_logger import write_service_event
 
+# How often the pool loop checks for finished jobs while it still has spare capacity
+POOL_POLL_INTERVAL = 1.0
+
+# How long pool processes get to abort their jobs once the drain grace period is over
+DRAIN_ABORT_TIMEOUT = 5.0
+
+# The EPUBs a paid composition publishes
+PAID_OUTPUTS = ['final.epub', 'dual-language-final.epub']
+
+# Files a paid composition may have left half-written when it is interrupted
+PAID_PARTIAL_OUTPUTS = PAID_OUTPUTS + ['combined-dual-language.md']
+
+
+class DrainDeadlineExceeded(BaseException):
+    """
+    Raised in a running job when the SIGTERM drain grace period is over.
+
+    Derives from BaseException, like KeyboardInterrupt, so that the composers'
+    `except Exception` handlers do not record it as a failed composition.
+    """
+    pass
+
+def _iter_book_dirs(storage_root: str, book_ids: Optional[Iterable[str]]) -> Iterator[pathlib.Path]:
+    """Yield book folders: every folder under storage, or only the given book ids."""
+    if book_ids is None:
+        yield from iter_book_dirs(storage_root)
+    else:
+        for book_id in sorted(book_ids):
+            yield book_path(storage_root, book_id)
+
+def _list_book_files(book_dir: pathlib.Path) -> Optional[Set[str]]:
+    """
+    List the entries of a book folder with a single scandir, or None if it is not
+    a folder. Files compressed by the retention manager also count under their plain names.
+    """
+    try:
+        with os.scandir(book_dir) as entries:
+            return with_logical_names(entry.name for entry in entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+def _remove_partial_outputs(book_dir: pathlib.Path, filenames: List[str]) -> None:
+    for filename in filenames:
+        try:
+            (book_dir / filename).unlink()
+        except FileNotFoundError:
+            pass
+
+def _input_bytes(book_dir: pathlib.Path, filenames: Set[str], inputs: List[str]) -> int:
+    """Sum the sizes of the given input files that appear in a book folder listing."""
+    total = 0
+    for name in inputs:
+        if name in filenames:
+            try:
+                total += (stored_path(book_dir / name) or book_dir / name).stat().st_size
+            except OSError:
+                pass
+    return total
+
 class BaseComposingWorker(IComposingWorker, ABC):
+    # Prefix of this service's status, error and retry keys in the progress file
+    progress_prefix = ''
+
     def __init__(self, storage_root: Optional[str] = None):
         self.storage_root = storage_root or get_storage_root()
         self.config = get_composer_config()
         self.logger = get_logger(self.storage_root)
         self.composer_factory = ComposerFactory()
+        self.isolation = JobIsolation(self.config['job_timeout'], self.config['job_memory_limit_mb'])
+        self.retry_policy = RetryPolicy(self.config)
+        self.cost_model = CostModel(self.storage_root, self.config)
+        # With an S3 (or other non-local) STORAGE_BACKEND, storage_root is a working copy of the books
+        self.storage_sync = create_storage_sync(self.storage_root, self.config)
+        # book_id -> when to scan it again: its scheduled retry becomes due, or the
+        # translation behind its interim EPUB has settled
+        self._pending_retries: Dict[str, datetime] = {}
         self.logger.info(f"ComposingWorker initialized with storage root: {self.storage_root}")
         self.logger.info(f"Available composers: {self.composer_factory.get_available_composers()}")
 
     @abstractmethod
-    def find_jobs(self) -> List[str]:
+    def find_jobs(self, book_ids: Optional[Iterable[str]] = None) -> List[str]:
         pass
 
     @abstractmethod
@@ -31,70 +124,347 @@ class BaseComposingWorker(IComposingWorker, ABC):
     def run(self):
         pass
 
+    @abstractmethod
+    def _record_job_killed(self, book_id: str, status: str, message: str) -> None:
+        """Record in the progress file that a job was killed with the given status (timeout or oom)."""
+        pass
+
+    def _cancellation_token(self, book_id: str) -> CancellationToken:
+        return CancellationToken.for_book(self.storage_root, book_id, self.config['cancel_filename'])
+
+    @abstractmethod
+    def _hand_back_job(self, book_id: str) -> None:
+        """Return an interrupted job to the queue: remove partial outputs and reset its status."""
+        pass
+
+    @abstractmethod
+    def find_composer(self, book_id: str, listing: Optional[Set[str]] = None) -> Optional[IComposer]:
+        """
+        The composer this service would use for a book, or None if none can handle it.
+        Pass the book folder's listing when it is at hand to re-evaluate the choice from it.
+        """
+        pass
+
+    def estimate_job(self, book_id: str) -> Optional[dict]:
+        """Estimated wall time and peak RSS of composing a book now, from a pre-scan of its inputs."""
+        composer = self.find_composer(book_id)
+        if composer is None:
+            return None
+        features = prescan(book_path(self.storage_root, book_id), composer.get_input_filenames())
+        self.cost_model.load()
+        seconds, rss, basis = self.cost_model.estimate(composer.get_name(), features)
+        return {
+            'composer': composer.get_name(),
+            'features': features,
+            'estimatedSeconds': seconds,
+            'estimatedPeakRssBytes': rss,
+            'basis': basis,
+        }
+
+    def _compose_measured(self, composer: IComposer, book_id: str, config: dict) -> bool:
+        """
+        Run a composition, recording its estimated cost in the progress file first
+        (for the ETA in /api/job_status), and feed its wall time and peak RSS to
+        the cost model when it finishes the book.
+        """
+        prefix = self.progress_prefix
+        features = prescan(book_path(self.storage_root, book_id), composer.get_input_filenames())
+        self.cost_model.load()
+        seconds, rss, _ = self.cost_model.estimate(composer.get_name(), features)
+        progress = self._load_progress(book_id)
+        progress[f'{prefix}estimated_seconds'] = seconds
+        progress[f'{prefix}estimated_peak_rss'] = rss
+        self._save_progress(book_id, progress)
+        started = time.monotonic()
+        with PeakRssSampler() as sampler:
+            success = composer.compose(book_id, self.storage_root, config)
+        if self._stop_result(book_id, success) == "success":
+            try:
+                self.cost_model.record(composer.get_name(), features, time.monotonic() - started, sampler.peak)
+            except Exception as e:
+                self.logger.error(f"Error recording composition cost for {book_id}: {str(e)}", book_id, error=e)
+        return success
+
+    def _stop_result(self, book_id: str, success: bool) -> str:
+        """Result for the service-stop event; an interim (partial) composition is not the finished book."""
+        if not success:
+            return "error"
+        return "partial" if self._load_progress(book_id).get(f'{self.progress_prefix}status') == 'partial' else "success"
+
+    def process_book_isolated(self, book_id: str, isolate: bool = True) -> bool:
+        """
+        Process a book, in a child process with JOB_TIMEOUT / JOB_MEMORY_LIMIT_MB
+        applied when either is configured and `isolate` is set.
+        """
+        if not (isolate and self.isolation.enabled):
+            outcome = OUTCOME_SUCCESS if self.process_book(book_id) else OUTCOME_FAILURE
+        else:
+            outcome, message = self.isolation.run(_process_book_for_service, (self.storage_root, self.service_name, book_id))
+            if outcome in (OUTCOME_TIMEOUT, OUTCOME_OOM):
+                self.logger.error(f"Composition of {book_id} killed ({outcome}): {message}", book_id)
+                self._record_job_killed(book_id, outcome, message)
+            elif outcome == OUTCOME_CRASHED:
+                self.logger.error(f"Composition of {book_id} crashed: {message}", book_id)
+                self._record_job_killed(book_id, 'error', message)
+        if outcome != OUTCOME_SUCCESS:
+            self._record_failed_attempt(book_id, outcome)
+        # The job is over; the next scan decides afresh from the book folder's listing
+        self.composer_factory.forget(book_id)
+        self._push_book(book_id)
+        return outcome == OUTCOME_SUCCESS
+
+    def _push_book(self, book_id: str) -> None:
+        """Upload what a job wrote to the storage backend, when the storage root is a working copy."""
+        if self.storage_sync is None:
+            return
+        try:
+            self.storage_sync.push(book_id)
+        except Exception as e:
+            self.logger.error(f"Error uploading {book_id} to {self.storage_sync.backend.get_name()} storage: {str(e)}", book_id, error=e)
+
+    def _pull_books(self, book_ids: Optional[Iterable[str]]) -> None:
+        """Bring the working copy up to date with the storage backend before a scan."""
+        if self.storage_sync is None:
+            return
+        try:
+            fetched = self.storage_sync.pull(book_ids)
+            if fetched:
+                self.logger.info(f"Fetched {fetched} file(s) from {self.storage_sync.backend.get_name()} storage")
+        except Exception as e:
+            self.logger.error(f"Error fetching books from {self.storage_sync.backend.get_name()} storage: {str(e)}", error=e)
+
+    def _record_failed_attempt(self, book_id: str, outcome: str) -> None:
+        """Apply the retry policy to a failed job: schedule a retry or move it to the dead-letter state."""
+        prefix = self.progress_prefix
+        progress = self._load_progress(book_id)
+        if progress.get(f'{prefix}status') == 'cancelled':
+            return
+        status = self.retry_policy.record_failure(progress, outcome, prefix)
+        self._save_progress(book_id, progress)
+        if status == DEAD_LETTER:
+            self.logger.error(f"Giving up on {book_id} after {progress[f'{prefix}attempts']} attempt(s): {progress[f'{prefix}dead_letter_reason']}", book_id)
+        else:
+            self.logger.warn(f"Attempt {progress[f'{prefix}attempts']} for {book_id} failed, retrying at {progress[f'{prefix}next_retry_at']}", book_id)
+
+    def _retry_not_due(self, book_id: str, progress: dict) -> bool:
+        """True while a scheduled retry is still backing off; remembers it so the worker rescans the book when due."""
+        retry_at = self.retry_policy.retry_at(progress, self.progress_prefix)
+        if retry_at is None:
+            self._pending_retries.pop(book_id, None)
+            return False
+        if retry_at > datetime.now():
+            self._pending_retries[book_id] = retry_at
+            return True
+        self._pending_retries.pop(book_id, None)
+        return False
+
+    def due_retries(self) -> Set[str]:
+        """Books whose scheduled retry has become due since they were last scanned."""
+        now = datetime.now()
+        due = {book_id for book_id, retry_at in self._pending_retries.items() if retry_at <= now}
+        for book_id in due:
+            del self._pending_retries[book_id]
+        return due
+
 class ComposingWorker(BaseComposingWorker):
     """Main worker that continuously scans for composition jobs."""
+    service_name = "composingservice"
+
+    def __init__(self, storage_root: Optional[str] = None):
+        super().__init__(storage_root)
+        # Books whose original arrived without a translation and should be prepared while idle
+        self._unprepared: Set[str] = set()
+        self.job_index: Optional[JobIndex] = JobIndex(self.storage_root, self.config) if self.config['job_index'] else None
+        # Input path -> (size, mtime_ns, sha256) of inputs hashed while checking completed books for changes
+        self._verified_inputs: Dict[str, Tuple[int, int, str]] = {}
     
-    def find_jobs(self) -> List[str]:
-        """Find books that need composition."""
-        jobs = []
+    def find_jobs(self, book_ids: Optional[Iterable[str]] = None) -> List[str]:
+        """Find books that need composition, optionally limited to the given book ids."""
+        return [job.book_id for job in self.scan_jobs(None, book_ids)]
+
+    def scan_jobs(self, free_worker: Optional['FreeComposingWorker'], book_ids: Optional[Iterable[str]] = None) -> List[ComposingJob]:
+        """
+        Find paid (and, if free_worker is given, free) composition jobs in one pass.
+
+        Each book folder is listed once with scandir and its progress file is read
+        at most once; both the paid and the free checks work from that listing.
+        With the job index enabled, books whose folder and progress file are
+        unchanged are served from the index instead, and the books given in
+        book_ids (reported by change notifications) are always re-read.
+        Completed books whose inputs changed since their composition are paid
+        jobs again. Paid jobs are returned before free jobs.
+        """
+        jobs: List[ComposingJob] = []
+        free_jobs: List[ComposingJob] = []
+        self._pull_books(book_ids)
         try:
             storage_path = pathlib.Path(self.storage_root)
             if not storage_path.exists():
                 self.logger.warn(f"Storage directory does not exist: {self.storage_root}")
                 return jobs
             
-            self.logger.info(f"Scanning for jobs in: {self.storage_root}")
+            if book_ids is None:
+                self.logger.info(f"Scanning for jobs in: {self.storage_root}")
+            
+            for item in _iter_book_dirs(self.storage_root, book_ids):
+                if self.job_index is not None:
+                    filenames = self.job_index.listing(item, force=book_ids is not None)
+                else:
+                    filenames = _list_book_files(item)
+                if filenames is None:
+                    continue
+                book_id = item.name
+                
+                paid_candidate = self._has_composition_inputs(filenames)
+                recompose_candidate = not paid_candidate and self._has_composed_output(filenames)
+                free_candidate = free_worker is not None and free_worker._has_free_composition_inputs(filenames)
+                if self._awaits_translation(item, filenames):
+                    self._unprepared.add(book_id)
+                if not (paid_candidate or recompose_candidate or free_candidate):
+                    self._forget_composers(book_id, free_worker)
+                    continue
+                
+                if self.job_index is not None:
+                    progress = self.job_index.progress(book_id)
+                else:
+                    progress = self._load_progress(book_id, filenames)
+                priority = progress.get('priority', DEFAULT_PRIORITY)
+                if (paid_candidate and self._needs_composition(book_id, filenames, progress)) or (
+                        recompose_candidate and self._needs_recomposition(book_id, item, progress)):
+                    self.logger.info(f"Found composition job: {book_id}", book_id)
+                    input_bytes = _input_bytes(item, filenames, ['originalbook.md', self.config['translated_content_filename']])
+                    jobs.append(ComposingJob(self.service_name, book_id, filenames, priority, input_bytes))
+                else:
+                    # Only queued jobs keep their composer decision, until they run
+                    self.composer_factory.forget(book_id)
+                if free_candidate and free_worker._needs_free_composition(book_id, filenames, progress):
+                    self.logger.info(f"Found free composition job: {book_id}", book_id)
+                    input_bytes = _input_bytes(item, filenames, ['originalbook.md', free_worker.config['translated_content_filename']])
+                    free_jobs.append(ComposingJob(free_worker.service_name, book_id, filenames, priority, input_bytes))
+                elif free_worker is not None:
+                    free_worker.composer_factory.forget(book_id)
             
-            for item in storage_path.iterdir():
-                if item.is_dir():
-                    book_id = item.name
-                    
-                    # Check if this book needs composition
-                    if self._needs_composition(book_id):
-                        self.logger.info(f"Found composition job: {book_id}", book_id)
-                        jobs.append(book_id)
+            if self.job_index is not None:
+                self.job_index.commit(book_ids)
         
         except Exception as e:
             self.logger.error(f"Error finding jobs: {str(e)}", error=e)
         
-        return jobs
+        return jobs + free_jobs
     
-    def _needs_composition(self, book_id: str) -> bool:
-        """Check if a book needs composition."""
-        book_dir = pathlib.Path(self.storage_root) / book_id
-        
+    def _forget_composers(self, book_id: str, free_worker: Optional['FreeComposingWorker']) -> None:
+        self.composer_factory.forget(book_id)
+        if free_worker is not None:
+            free_worker.composer_factory.forget(book_id)
+
+    def _has_composition_inputs(self, filenames: Set[str]) -> bool:
+        """Check, from a folder listing, that a book has inputs and no final.epub yet."""
         # Check if final.epub already exists
-        final_epub_path = book_dir / self.config['final_epub_filename']
-        if final_epub_path.exists():
+        if self.config['final_epub_filename'] in filenames:
             return False
         
-        # Check for dual-language files (originalbook.md + translatedcontent.md)
-        original_path = book_dir / "originalbook.md"
-        translated_content_path = book_dir / self.config['translated_content_filename']
-        
-        # If we have both original and translated files, we can do dual-language composition
-        has_dual_language_files = original_path.exists() and translated_content_path.exists()
-        
-        # If we only have translated content, we can do simple composition
-        has_translated_only = translated_content_path.exists()
+        # Dual-language composition needs originalbook.md + translatedcontent.md and
+        # simple composition only translatedcontent.md, so the translation is required
+        return self.config['translated_content_filename'] in filenames
+    
+    def _has_composed_output(self, filenames: Set[str]) -> bool:
+        """Check, from a folder listing, that a book has been composed and may be recomposed."""
+        return self.config['recompose_on_input_change'] and any(name in filenames for name in PAID_OUTPUTS)
+    
+    def _awaits_translation(self, book_dir: pathlib.Path, filenames: Set[str]) -> bool:
+        """Check if a book has an unprepared original but no translation or output yet."""
+        if not self.config['speculative_preparation'] or ORIGINAL_FILENAME not in filenames:
+            return False
+        if self.config['translated_content_filename'] in filenames or self.config['final_epub_filename'] in filenames:
+            return False
+        return needs_preparation(book_dir, self.config['prepared_original_filename'])
+
+    def prepare_next_original(self) -> bool:
+        """
+        Speculatively parse one waiting original so that its composition only has
+        the translation and the merge left. Returns False when there was none.
+        """
+        if not self._unprepared:
+            return False
+        book_id = self._unprepared.pop()
+        try:
+            if prepare_original(book_path(self.storage_root, book_id), self.config['prepared_original_filename']):
+                self.logger.info(f"Prepared original ahead of its translation for book: {book_id}", book_id)
+        except Exception as e:
+            self.logger.error(f"Error preparing original for {book_id}: {str(e)}", book_id, error=e)
+        return True
+
+    def _needs_composition(self, book_id: str, filenames: Optional[Set[str]] = None, progress: Optional[dict] = None) -> bool:
+        """Check if a book needs composition."""
+        if filenames is None:
+            filenames = _list_book_files(book_path(self.storage_root, book_id)) or set()
         
-        # Need at least one of these scenarios
-        if not (has_dual_language_files or has_translated_only):
+        if not self._has_composition_inputs(filenames):
             return False
         
         # Check progress to see if it's already been processed
-        progress = self._load_progress(book_id)
-        if progress.get('status') in ['completed', 'error']:
+        if progress is None:
+            progress = self._load_progress(book_id, filenames)
+        if not self._is_due(book_id, progress):
             return False
         
         # Find a suitable composer
-        composer = self.composer_factory.find_suitable_composer(book_id, self.storage_root)
-        return composer is not None
+        return self.find_composer(book_id, filenames) is not None
+    
+    def _is_due(self, book_id: str, progress: dict) -> bool:
+        """Check, from its progress, that a book's composition is not finished, failed for good or waiting."""
+        if progress.get('status') in ['completed', 'cancelled', OUTCOME_TIMEOUT, OUTCOME_OOM]:
+            return False
+        if self.retry_policy.gave_up(progress):
+            return False
+        if progress.get('status') == 'partial' and self._interim_is_current(book_id, progress):
+            return False
+        return not self._retry_not_due(book_id, progress)
+    
+    def _needs_recomposition(self, book_id: str, book_dir: pathlib.Path, progress: dict) -> bool:
+        """
+        Check if a composed book's inputs changed since its composition. Books
+        composed before inputs were recorded are left alone.
+        """
+        if 'composed_inputs' not in progress:
+            return False
+        if progress.get('recomposing') and progress.get('status') != 'completed':
+            # A recomposition that was handed back, awaits a retry or has an interim EPUB
+            return self._is_due(book_id, progress)
+        if progress.get('status') != 'completed':
+            return False
+        # Stat the inputs even when the job index served this book: an input rewritten
+        # in place moves neither the folder's nor the progress file's mtime
+        changed = changed_inputs(book_dir, progress['composed_inputs'], self._verified_inputs)
+        if not changed:
+            return False
+        self.logger.info(f"Inputs of {book_id} changed since its composition: {', '.join(changed)}", book_id)
+        return True
+    
+    def _interim_is_current(self, book_id: str, progress: dict) -> bool:
+        """
+        True while the translation behind an interim EPUB is unchanged and may still
+        grow; remembers when it settles so the worker rescans the book for the final composition.
+        """
+        translation_file = progress.get('translation_file', self.config['translated_content_filename'])
+        try:
+            mtime = (book_path(self.storage_root, book_id) / translation_file).stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime != progress.get('translation_mtime'):
+            return False
+        settles_at = datetime.fromtimestamp(mtime + self.config['progressive_settle_seconds'])
+        if settles_at <= datetime.now():
+            return False
+        self._pending_retries[book_id] = settles_at
+        return True
     
-    def _load_progress(self, book_id: str) -> dict:
-        """Load progress for a book."""
-        progress_path = pathlib.Path(self.storage_root) / book_id / self.config['progress_filename']
+    def _load_progress(self, book_id: str, filenames: Optional[Set[str]] = None) -> dict:
+        """Load progress for a book, skipping the read when a listing shows there is no progress file."""
+        progress_path = book_path(self.storage_root, book_id) / self.config['progress_filename']
         
+        if filenames is not None and self.config['progress_filename'] not in filenames:
+            return {'status': 'pending'}
         if progress_path.exists():
             try:
                 import json
@@ -105,19 +475,77 @@ class ComposingWorker(BaseComposingWorker):
         
         return {'status': 'pending'}
     
+    def _save_progress(self, book_id: str, progress: dict) -> None:
+        """Save progress for a book."""
+        progress_path = book_path(self.storage_root, book_id) / self.config['progress_filename']
+        try:
+            import json
+            with open(progress_path, 'w', encoding='utf-8') as f:
+                json.dump(progress, f, ensure_ascii=False, indent=2)
+            if self.storage_sync is not None:
+                self.storage_sync.push(book_id, [self.config['progress_filename']])
+        except Exception as e:
+            self.logger.error(f"Error saving progress for {book_id}: {str(e)}", book_id, error=e)
+    
+    def _record_job_killed(self, book_id: str, status: str, message: str) -> None:
+        progress = self._load_progress(book_id)
+        progress['status'] = status
+        progress['error'] = message
+        progress['error_at'] = datetime.now().isoformat()
+        self._save_progress(book_id, progress)
+    
+    def _hand_back_job(self, book_id: str) -> None:
+        progress = self._load_progress(book_id)
+        if not progress.get('recomposing'):
+            # A recomposition only replaces the previous EPUB once its new one is complete, so that stays
+            _remove_partial_outputs(book_path(self.storage_root, book_id), PAID_PARTIAL_OUTPUTS)
+        progress['status'] = 'pending'
+        progress.pop('step', None)
+        progress.pop('started_at', None)
+        progress['requeued_at'] = datetime.now().isoformat()
+        self._save_progress(book_id, progress)
+    
+    def find_composer(self, book_id: str, listing: Optional[Set[str]] = None) -> Optional[IComposer]:
+        if listing is None or self._has_composed_output(listing):
+            progress = self._load_progress(book_id, listing)
+            if 'composed_inputs' in progress and progress.get('composer'):
+                # A recomposed book's outputs keep the composers' capabilities from matching it again
+                return self.composer_factory.get_composer(progress['composer'])
+        return self.composer_factory.find_suitable_composer(book_id, self.storage_root, listing=listing)
+
     def process_book(self, book_id: str) -> bool:
         """Process a single book."""
         try:
             self.logger.info(f"Processing book: {book_id}", book_id)
             
             # Find suitable composer
-            composer = self.composer_factory.find_suitable_composer(book_id, self.storage_root)
+            composer = self.find_composer(book_id)
             if not composer:
                 self.logger.error(f"No suitable composer found for {book_id}", book_id)
                 return False
             
-            # Perform composition
-            success = composer.compose(book_id, self.storage_root)
+            progress = self._load_progress(book_id)
+            if 'composed_inputs' in progress and progress.get('status') == 'completed':
+                # The previous EPUB stays downloadable (see /api/download) until the new one replaces it
+                self.logger.info(f"Recomposing book with changed inputs: {book_id}", book_id)
+                progress['recomposing'] = True
+                progress['previous_completed_at'] = progress.get('completed_at')
+                self._save_progress(book_id, progress)
+            
+            # Perform composition, recording the inputs it is made from; hashes of unchanged files are reused
+            known = uploaded_fingerprints(progress)
+            known.update(progress.get('composed_inputs') or {})
+            inputs = fingerprint_inputs(book_path(self.storage_root, book_id), composer.get_input_filenames(), known)
+            config = {'cancellation_token': self._cancellation_token(book_id)}
+            if self.config['progressive_composition']:
+                config['progressive_settle_seconds'] = self.config['progressive_settle_seconds']
+            success = self._compose_measured(composer, book_id, config)
+            if self._stop_result(book_id, success) == "success":
+                progress = self._load_progress(book_id)
+                progress['composer'] = composer.get_name()
+                progress['composed_inputs'] = inputs
+                progress.pop('recomposing', None)
+                self._save_progress(book_id, progress)
             
             if success:
                 self.logger.info(f"Successfully processed book: {book_id}", book_id)
@@ -134,52 +562,437 @@ class ComposingWorker(BaseComposingWorker):
         """Main run loop."""
         self.logger.info("Starting ComposingWorker main loop...")
         free_worker = FreeComposingWorker(self.storage_root)
+        discovery = create_job_discovery(self.storage_root, self.config)
+        self.logger.info(f"Using {discovery.get_name()} job discovery")
+        scheduler = self._create_scheduler(free_worker)
+        controller = ConcurrencyController(self.storage_root, self.config)
+        leases = JobLeaseManager(self.storage_root, self.config)
+        leases.start_heartbeat()
+        retention = None
+        if self.config['retention_interval'] > 0:
+            retention = StorageRetention(self.storage_root, self.config)
+            retention.start(self.config['retention_interval'])
+        previous_handlers = self._install_drain_handlers()
+        try:
+            if self.config['max_concurrency'] > 1:
+                self._run_pool(free_worker, discovery, scheduler, leases, controller)
+            else:
+                self._run_sequential(free_worker, discovery, scheduler, leases, controller)
+        finally:
+            self._remove_drain_handlers(previous_handlers)
+            if retention is not None:
+                retention.stop()
+            leases.stop_heartbeat()
+            leases.release_all()
+            discovery.close()
+            if self.job_index is not None:
+                self.job_index.close()
+        if self._draining:
+            self.logger.info("Drain complete, worker stopped")
+
+    def _create_scheduler(self, free_worker: 'FreeComposingWorker', publish: bool = True) -> JobScheduler:
+        workers = {self.service_name: self, free_worker.service_name: free_worker}
+
+        def estimate_seconds(job: ComposingJob) -> Optional[float]:
+            estimate = workers[job.service].estimate_job(job.book_id)
+            return estimate['estimatedSeconds'] if estimate else None
+
+        return JobScheduler(self.storage_root, self.config, {
+            self.service_name: self.config['scheduler_paid_weight'],
+            free_worker.service_name: self.config['scheduler_free_weight'],
+        }, estimator=estimate_seconds, publish=publish)
+
+    def plan(self) -> dict:
+        """
+        Dry run: the pending jobs in dispatch order with their estimated cost and
+        simulated start and finish at the configured concurrency. Nothing is
+        composed and no queue or progress file is written.
+        """
+        free_worker = FreeComposingWorker(self.storage_root)
+        workers = {self.service_name: self, free_worker.service_name: free_worker}
+        scheduler = self._create_scheduler(free_worker, publish=False)
+        scheduler.update(self.scan_jobs(free_worker))
+        concurrency = self.config['concurrency']
+        jobs = []
         while True:
+            job = scheduler.next_job()
+            if job is None:
+                break
+            estimate = workers[job.service].estimate_job(job.book_id)
+            # Nothing is composed, so the scan's composer decisions are not needed past the estimate
+            workers[job.service].composer_factory.forget(job.book_id)
+            if estimate is None:
+                continue
+            estimate.update({'bookId': job.book_id, 'service': job.service, 'priority': job.priority})
+            jobs.append(estimate)
+        times = schedule([job['estimatedSeconds'] for job in jobs], concurrency)
+        for job, (start, end) in zip(jobs, times):
+            job['startSeconds'] = round(start, 1)
+            job['finishSeconds'] = round(end, 1)
+        # Peak memory of the simulated schedule: the largest sum of RSS over jobs running at the same time
+        peak_rss = max((sum(other['estimatedPeakRssBytes'] for other in jobs
+                            if other['startSeconds'] <= job['startSeconds'] < other['finishSeconds'])
+                        for job in jobs), default=0)
+        return {
+            'concurrency': concurrency,
+            'jobs': jobs,
+            'makespanSeconds': max((job['finishSeconds'] for job in jobs), default=0.0),
+            'peakRssBytes': peak_rss,
+        }
+
+    def _install_drain_handlers(self) -> Dict[int, object]:
+        """
+        Handle SIGTERM (sent by ECS on every deploy) by draining: stop claiming
+        jobs and give the running ones DRAIN_GRACE_PERIOD seconds to finish.
+        When the grace period is over, SIGALRM aborts whatever is still running
+        and the worker hands those jobs back to the queue.
+        """
+        self._draining = False
+        if threading.current_thread() is not threading.main_thread() or not hasattr(signal, 'SIGALRM'):
+            return {}
+        worker_pid = os.getpid()
+        grace_period = self.config['drain_grace_period']
+
+        def on_sigterm(signum, frame):
+            # Isolated job processes forked from the worker inherit this handler
+            if os.getpid() != worker_pid or self._draining:
+                return
+            self._draining = True
+            self.logger.info(f"Received SIGTERM. Draining in-flight jobs for up to {grace_period}s...")
+            signal.alarm(max(1, grace_period))
+
+        def on_deadline(signum, frame):
+            if os.getpid() == worker_pid:
+                # Also stop the compositions running on other threads (pipeline stages)
+                CancellationToken.interrupt_all(DrainDeadlineExceeded())
+                raise DrainDeadlineExceeded()
+
+        return {
+            signal.SIGTERM: signal.signal(signal.SIGTERM, on_sigterm),
+            signal.SIGALRM: signal.signal(signal.SIGALRM, on_deadline),
+        }
+
+    def _remove_drain_handlers(self, previous_handlers: Dict[int, object]) -> None:
+        if previous_handlers:
+            signal.alarm(0)
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    def _hand_back(self, worker: BaseComposingWorker, book_id: str) -> None:
+        """Hand an interrupted job back to the queue so the next worker starts it cleanly."""
+        self.logger.warn(f"Drain grace period over, handing {book_id} back to the queue", book_id)
+        try:
+            worker._hand_back_job(book_id)
+        except Exception as e:
+            self.logger.error(f"Error handing back {book_id}: {str(e)}", book_id, error=e)
+        write_service_event("service-stop", book_id, worker.service_name, storage_root=self.storage_root, result="requeued")
+
+    def _run_sequential(self, free_worker: 'FreeComposingWorker', discovery: JobDiscovery, scheduler: JobScheduler,
+                        leases: JobLeaseManager, controller: ConcurrencyController):
+        """Main run loop for COMPOSER_CONCURRENCY = 1: jobs run one after another in-process."""
+        # None means "scan every book"; otherwise only the books discovery reported
+        changed: Optional[Set[str]] = None
+        while not self._draining:
             try:
-                found_job = False
-                jobs = self.find_jobs()
+                scheduler.update(self.scan_jobs(free_worker, changed), changed, discovery.submission_times())
+                # A single slot; the controller only publishes the desired replicas signal
+                controller.update(len(scheduler), 0)
+                job = scheduler.next_job()
                 
-                for book_id in jobs:
-                    found_job = True
-                    # Log service-start event for this book/job
-                    write_service_event("service-start", book_id, "composingservice", storage_root=self.storage_root)
-                    try:
-                        success = self.process_book(book_id)
-                        if success:
-                            write_service_event("service-stop", book_id, "composingservice", storage_root=self.storage_root, result="success")
-                        else:
-                            write_service_event("service-stop", book_id, "composingservice", storage_root=self.storage_root, result="error")
-                    except Exception as e:
-                        write_service_event("service-stop", book_id, "composingservice", storage_root=self.storage_root, result="error", error=str(e))
-                        raise
-                free_jobs = free_worker.find_jobs()
-                for book_id in free_jobs:
-                    found_job = True
-                    write_service_event("service-start", book_id, "free-composingservice", storage_root=self.storage_root)
-                    try:
-                        success = free_worker.process_book(book_id)
-                        if success:
-                            write_service_event("service-stop", book_id, "free-composingservice", storage_root=self.storage_root, result="success")
-                        else:
-                            write_service_event("service-stop", book_id, "free-composingservice", storage_root=self.storage_root, result="error")
-                    except Exception as e:
-                        write_service_event("service-stop", book_id, "free-composingservice", storage_root=self.storage_root, result="error", error=str(e))
-                        raise
-                if not found_job:
-                    self.logger.info("No jobs found. Sleeping...")
+                if job is None:
+                    if self.prepare_next_original():
+                        # Idle: prepare waiting originals one at a time, still picking up new inputs in between
+                        changed = self._with_due_retries(discovery.wait_for_changes(0), free_worker)
+                        continue
+                    if changed is None:
+                        self.logger.info("No jobs found. Sleeping...")
+                    # Wait for new inputs or the next scheduled scan
+                    changed = self._with_due_retries(discovery.wait_for_changes(self.config['sleep_interval']), free_worker)
+                    continue
                 
-                # Sleep before next scan
-                time.sleep(self.config['sleep_interval'])
+                if self._draining or not self._claim_job(job, leases, free_worker):
+                    continue
+                worker = free_worker if job.service == free_worker.service_name else self
+                started_at = time.time()
+                try:
+                    self._run_job(worker, job.book_id)
+                    controller.record_job(time.time() - started_at)
+                except DrainDeadlineExceeded:
+                    # The job's pipeline stages have settled by now (CompositionPipeline.run
+                    # waits for them), so nothing writes to the book after it is handed back
+                    CancellationToken.interrupt_all(DrainDeadlineExceeded())
+                    self._hand_back(worker, job.book_id)
+                    CancellationToken.interrupt_all(None)
+                    break
+                finally:
+                    leases.release(job.book_id)
+                # Pick up anything that arrived while the job ran before choosing the next one,
+                # and look at the book again so a scheduled retry is tracked
+                changed = self._with_due_retries(discovery.wait_for_changes(0), free_worker)
+                if changed is not None:
+                    changed.add(job.book_id)
                 
             except KeyboardInterrupt:
                 self.logger.info("Received interrupt signal. Shutting down...")
                 break
             except Exception as e:
                 self.logger.error(f"Unexpected error in main loop: {str(e)}", error=e)
-                time.sleep(self.config['sleep_interval']) 
+                time.sleep(self.config['sleep_interval'])
+                changed = None
+
+    def _claim_job(self, job: ComposingJob, leases: JobLeaseManager, free_worker: 'FreeComposingWorker') -> bool:
+        """
+        Take the lease for a job, then check that the book still needs it. The
+        scan behind the job may be stale: another node can have composed the
+        book and released its lease since. Returns False, holding no lease, when
+        the book is claimed elsewhere or no longer due.
+        """
+        worker = free_worker if job.service == free_worker.service_name else self
+        if not leases.claim(job.book_id, job.service):
+            self.logger.info(f"Book {job.book_id} is claimed by another worker, skipping", job.book_id)
+            worker.composer_factory.forget(job.book_id)
+            return False
+        try:
+            due = self._is_job_still_due(job, free_worker)
+        except Exception:
+            leases.release(job.book_id)
+            worker.composer_factory.forget(job.book_id)
+            raise
+        if not due:
+            self.logger.info(f"Book {job.book_id} no longer needs composition, skipping", job.book_id)
+            leases.release(job.book_id)
+            worker.composer_factory.forget(job.book_id)
+        return due
+
+    def _is_job_still_due(self, job: ComposingJob, free_worker: 'FreeComposingWorker') -> bool:
+        """Re-check a job from a fresh listing of its book folder and its progress file, bypassing the job index."""
+        item = book_path(self.storage_root, job.book_id)
+        filenames = _list_book_files(item)
+        if filenames is None:
+            return False
+        if job.service == free_worker.service_name:
+            return free_worker._needs_free_composition(job.book_id, filenames, free_worker._load_progress(job.book_id, filenames))
+        progress = self._load_progress(job.book_id, filenames)
+        if self._has_composition_inputs(filenames):
+            return self._needs_composition(job.book_id, filenames, progress)
+        return self._has_composed_output(filenames) and self._needs_recomposition(job.book_id, item, progress)
+
+    def _with_due_retries(self, changed: Optional[Set[str]], free_worker: 'FreeComposingWorker') -> Optional[Set[str]]:
+        """Add books whose retry backoff has expired to the books to rescan (None already means all)."""
+        if changed is None:
+            return None
+        return changed | self.due_retries() | free_worker.due_retries()
+
+    def _run_job(self, worker: BaseComposingWorker, book_id: str) -> bool:
+        """Run a single job in-process, wrapped in service-start/stop events."""
+        write_service_event("service-start", book_id, worker.service_name, storage_root=self.storage_root)
+        try:
+            success = worker.process_book_isolated(book_id)
+            write_service_event("service-stop", book_id, worker.service_name, storage_root=self.storage_root,
+                                result=worker._stop_result(book_id, success))
+            return success
+        except Exception as e:
+            write_service_event("service-stop", book_id, worker.service_name, storage_root=self.storage_root, result="error", error=str(e))
+            raise
+
+    def _run_pool(self, free_worker: 'FreeComposingWorker', discovery: JobDiscovery, scheduler: JobScheduler,
+                  leases: JobLeaseManager, controller: ConcurrencyController):
+        """
+        Main run loop for COMPOSER_CONCURRENCY > 1, or when COMPOSER_MAX_CONCURRENCY
+        allows autoscaling above one.
+
+        Jobs are dispatched onto a process pool. A book that is already in flight
+        (paid or free) is never submitted again until its current job finishes,
+        and its lease keeps other worker nodes away from it, so no book is
+        composed by two workers at once. The number of jobs in flight follows
+        the ConcurrencyController between COMPOSER_MIN_CONCURRENCY and
+        COMPOSER_MAX_CONCURRENCY.
+
+        With COMPOSER_EXECUTOR=pipeline the jobs run on threads instead and share
+        this process's composition pipeline, so one book's inputs are read while
+        another is rendered (see core/CompositionPipeline.py).
+        """
+        threaded = self._uses_pipeline_executor()
+        max_child_rss = 0 if threaded else self.config['max_child_rss_mb'] * 1024 * 1024
+        entry_point = _process_book_in_thread if threaded else _process_book_in_child
+        if threaded:
+            if self.isolation.enabled:
+                self.logger.warn("JOB_TIMEOUT and JOB_MEMORY_LIMIT_MB are not applied with COMPOSER_EXECUTOR=pipeline")
+            controller.stage_metrics = get_composition_pipeline().metrics
+        self.logger.info(f"Running with {'thread' if threaded else 'process'} pool of {controller.min_concurrency}-{controller.max_concurrency} workers")
+        in_flight: Dict[Future, ComposingJob] = {}
+        busy_books: Set[str] = set()
+        changed: Optional[Set[str]] = None
+        pool = self._create_pool()
+        # Pools replaced after a child outgrew the RSS ceiling; they finish their running jobs
+        retired_pools: List[Executor] = []
+        future_pools: Dict[Future, Executor] = {}
+        try:
+            while True:
+                try:
+                    for future in [f for f in in_flight if f.done()]:
+                        job = in_flight.pop(future)
+                        job_pool = future_pools.pop(future, None)
+                        busy_books.discard(job.book_id)
+                        child_rss = self._finish_pooled_job(future, free_worker if job.service == free_worker.service_name else self, job.book_id)
+                        controller.record_job(time.time() - job.started_at, child_rss)
+                        leases.release(job.book_id)
+                        self._forget_composers(job.book_id, free_worker)
+                        # Look at the book again in case its inputs changed while it was busy
+                        if changed is not None:
+                            changed.add(job.book_id)
+                        if max_child_rss and child_rss > max_child_rss and job_pool is pool:
+                            self.logger.info(f"Pool child reached {child_rss // (1024 * 1024)}MB RSS, recycling pool processes")
+                            pool.shutdown(wait=False)
+                            retired_pools.append(pool)
+                            pool = self._create_pool()
+
+                    if self._draining:
+                        if not in_flight:
+                            break
+                        # Stop claiming jobs and let the running ones finish
+                        wait(list(in_flight), timeout=self.config['sleep_interval'], return_when=FIRST_COMPLETED)
+                        continue
+
+                    concurrency = controller.update(len(scheduler), len(in_flight))
+                    if len(in_flight) < concurrency:
+                        scheduler.update(self.scan_jobs(free_worker, changed), changed, discovery.submission_times())
+                        changed = set()
+                        while len(in_flight) < concurrency:
+                            job = scheduler.next_job(busy_books, list(in_flight.values()))
+                            if job is None:
+                                break
+                            if not self._claim_job(job, leases, free_worker):
+                                continue
+                            write_service_event("service-start", job.book_id, job.service, storage_root=self.storage_root)
+                            try:
+                                future = pool.submit(entry_point, self.storage_root, job.service, job.book_id)
+                            except BrokenProcessPool:
+                                # A child died abruptly (e.g. killed by the OOM killer); start a fresh pool
+                                self.logger.warn("Process pool is broken, starting a new one")
+                                pool = self._create_pool()
+                                future = pool.submit(entry_point, self.storage_root, job.service, job.book_id)
+                            job.started_at = time.time()
+                            in_flight[future] = job
+                            future_pools[future] = pool
+                            busy_books.add(job.book_id)
+
+                    if len(in_flight) < concurrency and self.prepare_next_original():
+                        # Spare capacity: prepare a waiting original, then look for new inputs right away
+                        updates = discovery.wait_for_changes(0)
+                    elif not in_flight:
+                        updates = discovery.wait_for_changes(self.config['sleep_interval'])
+                    elif len(in_flight) < concurrency:
+                        # Spare capacity: wake up for new inputs as well as finished jobs
+                        updates = discovery.wait_for_changes(POOL_POLL_INTERVAL)
+                    else:
+                        wait(list(in_flight), timeout=self.config['sleep_interval'], return_when=FIRST_COMPLETED)
+                        updates = set()
+                    changed = None if updates is None or changed is None else changed | updates
+                    changed = self._with_due_retries(changed, free_worker)
+
+                except KeyboardInterrupt:
+                    self.logger.info("Received interrupt signal. Shutting down...")
+                    for future in in_flight:
+                        future.cancel()
+                    break
+                except DrainDeadlineExceeded:
+                    self._abort_pooled_jobs([pool] + retired_pools, list(in_flight))
+                    for future, job in in_flight.items():
+                        worker = free_worker if job.service == free_worker.service_name else self
+                        if future.done() and not future.cancelled() and future.exception() is None:
+                            # Finished within the abort window
+                            self._finish_pooled_job(future, worker, job.book_id)
+                        else:
+                            self._hand_back(worker, job.book_id)
+                        leases.release(job.book_id)
+                    break
+                except Exception as e:
+                    self.logger.error(f"Unexpected error in main loop: {str(e)}", error=e)
+                    time.sleep(self.config['sleep_interval'])
+                    changed = None
+                pools_in_use = set(future_pools.values())
+                retired_pools = [p for p in retired_pools if p in pools_in_use]
+        finally:
+            pool.shutdown(wait=True)
+            for retired in retired_pools:
+                retired.shutdown(wait=True)
+            CancellationToken.interrupt_all(None)
+
+    def _uses_pipeline_executor(self) -> bool:
+        return self.config['composer_executor'] == 'pipeline'
+
+    def _create_pool(self) -> Executor:
+        """
+        Create the composition pool.
+
+        With the default forkserver start method the heavy composition modules are
+        imported once in the forkserver parent (see core/pool_preload.py), and each
+        child is replaced after COMPOSER_MAX_JOBS_PER_CHILD jobs. With
+        COMPOSER_EXECUTOR=pipeline it is a thread pool in this process.
+        """
+        if self._uses_pipeline_executor():
+            return ThreadPoolExecutor(max_workers=self.config['max_concurrency'], thread_name_prefix='composition')
+        method = self.config['pool_start_method']
+        if method not in multiprocessing.get_all_start_methods():
+            self.logger.warn(f"Start method '{method}' is not available, using the platform default")
+            method = None
+        context = multiprocessing.get_context(method)
+        if context.get_start_method() == 'forkserver':
+            context.set_forkserver_preload(['core.pool_preload'])
+        kwargs = {}
+        if self.config['max_jobs_per_child'] > 0 and context.get_start_method() != 'fork':
+            kwargs['max_tasks_per_child'] = self.config['max_jobs_per_child']
+        return ProcessPoolExecutor(max_workers=self.config['max_concurrency'], mp_context=context,
+                                   initializer=_init_pool_process, **kwargs)
+
+    def _abort_pooled_jobs(self, pools: List[Executor], futures: List[Future]) -> None:
+        """
+        Abort every job still running in the pools: SIGUSR1 makes a pool process
+        raise DrainDeadlineExceeded in its job (which also stops an isolated job
+        process), and anything still alive after DRAIN_ABORT_TIMEOUT is killed.
+        Jobs on threads get DrainDeadlineExceeded from their next cancellation check.
+        """
+        CancellationToken.interrupt_all(DrainDeadlineExceeded())
+        # ProcessPoolExecutor has no public way to reach its processes before Python 3.14
+        processes = [process for pool in pools for process in list((getattr(pool, '_processes', None) or {}).values())]
+        for process in processes:
+            try:
+                os.kill(process.pid, signal.SIGUSR1)
+            except (ProcessLookupError, AttributeError):
+                pass
+        wait(futures, timeout=DRAIN_ABORT_TIMEOUT)
+        for process in processes:
+            if process.is_alive():
+                process.kill()
+
+    def _finish_pooled_job(self, future: Future, worker: BaseComposingWorker, book_id: str) -> int:
+        """
+        Emit the service-stop event for a job that ran in the process pool and
+        return the child's RSS. A job whose pool process died (a broken pool, or
+        a child killed outright) counts as a crashed attempt, like in process_book_isolated.
+        """
+        service = worker.service_name
+        try:
+            success, child_rss = future.result()
+        except Exception as e:
+            self.logger.error(f"Error processing book {book_id} in worker process: {str(e)}", book_id, error=e)
+            try:
+                worker._record_job_killed(book_id, 'error', str(e))
+                worker._record_failed_attempt(book_id, OUTCOME_CRASHED)
+            except Exception as record_error:
+                self.logger.error(f"Error recording the failed attempt for {book_id}: {str(record_error)}", book_id, error=record_error)
+            write_service_event("service-stop", book_id, service, storage_root=self.storage_root, result="error", error=str(e))
+            return 0
+        result = self._stop_result(book_id, success) if service == self.service_name else ("success" if success else "error")
+        write_service_event("service-stop", book_id, service, storage_root=self.storage_root, result=result)
+        return child_rss
 
 class FreeComposingWorker(BaseComposingWorker):
     """Worker that processes free-final.epub using free-translatedcontent files and sets isFreeRequestCompleted flag."""
+    service_name = "free-composingservice"
+    progress_prefix = 'free_'
+
     def __init__(self, storage_root: Optional[str] = None):
         super().__init__(storage_root)
         self.config['progress_filename'] = 'composingservice-progress.json'
@@ -187,46 +1000,57 @@ class FreeComposingWorker(BaseComposingWorker):
         self.config['translated_json_filename'] = 'free-translatedcontent.json'
         self.config['final_epub_filename'] = 'free-final.epub'
 
-    def find_jobs(self) -> List[str]:
+    def find_jobs(self, book_ids: Optional[Iterable[str]] = None) -> List[str]:
         jobs = []
+        self._pull_books(book_ids)
         try:
             storage_path = pathlib.Path(self.storage_root)
             if not storage_path.exists():
                 self.logger.warn(f"Storage directory does not exist: {self.storage_root}")
                 return jobs
-            self.logger.info(f"Scanning for free jobs in: {self.storage_root}")
-            for item in storage_path.iterdir():
-                if item.is_dir():
-                    book_id = item.name
-                    if self._needs_free_composition(book_id):
-                        self.logger.info(f"Found free composition job: {book_id}", book_id)
-                        jobs.append(book_id)
+            if book_ids is None:
+                self.logger.info(f"Scanning for free jobs in: {self.storage_root}")
+            for item in _iter_book_dirs(self.storage_root, book_ids):
+                filenames = _list_book_files(item)
+                if filenames is None:
+                    continue
+                book_id = item.name
+                if self._needs_free_composition(book_id, filenames):
+                    self.logger.info(f"Found free composition job: {book_id}", book_id)
+                    jobs.append(book_id)
+                else:
+                    self.composer_factory.forget(book_id)
         except Exception as e:
             self.logger.error(f"Error finding free jobs: {str(e)}", error=e)
         return jobs
 
-    def _needs_free_composition(self, book_id: str) -> bool:
-        book_dir = pathlib.Path(self.storage_root) / book_id
-        free_final_epub_path = book_dir / 'free-final.epub'
-        if free_final_epub_path.exists():
+    def _has_free_composition_inputs(self, filenames: Set[str]) -> bool:
+        """Check, from a folder listing, that a book has free inputs and no free-final.epub yet."""
+        if 'free-final.epub' in filenames:
             return False
-        free_translated_md = book_dir / 'free-translatedcontent.md'
-        free_translated_json = book_dir / 'free-translatedcontent.json'
-        if not (free_translated_md.exists() and free_translated_json.exists()):
+        return 'free-translatedcontent.md' in filenames and 'free-translatedcontent.json' in filenames
+
+    def _needs_free_composition(self, book_id: str, filenames: Optional[Set[str]] = None, progress: Optional[dict] = None) -> bool:
+        if filenames is None:
+            filenames = _list_book_files(book_path(self.storage_root, book_id)) or set()
+        if not self._has_free_composition_inputs(filenames):
             return False
-        progress = self._load_progress(book_id)
+        if progress is None:
+            progress = self._load_progress(book_id, filenames)
         if progress.get('isFreeRequestCompleted') is True:
             return False
-        composer = self.composer_factory.find_suitable_composer(
-			book_id, self.storage_root, {
-			'progress_filename': self.config['progress_filename'],
-			'translated_content_filename': self.config['translated_content_filename'],
-			'translated_json_filename': self.config['translated_json_filename'],
-			'final_epub_filename': self.config['final_epub_filename']})
-        return composer is not None
-
-    def _load_progress(self, book_id: str) -> dict:
-        progress_path = pathlib.Path(self.storage_root) / book_id / self.config['progress_filename']
+        if progress.get('free_status') in [OUTCOME_TIMEOUT, OUTCOME_OOM, 'cancelled']:
+            return False
+        if self.retry_policy.gave_up(progress, self.progress_prefix):
+            return False
+        if self._retry_not_due(book_id, progress):
+            return False
+        return self.find_composer(book_id, filenames) is not None
+
+    def _load_progress(self, book_id: str, filenames: Optional[Set[str]] = None) -> dict:
+        progress_path = book_path(self.storage_root, book_id) / self.config['progress_filename']
+        if filenames is not None and self.config['progress_filename'] not in filenames:
+            return {'status': 'pending'}
         if progress_path.exists():
             try:
                 import json
@@ -237,33 +1061,63 @@ class FreeComposingWorker(BaseComposingWorker):
         return {'status': 'pending'}
 
     def _save_progress(self, book_id: str, progress: dict) -> None:
-        progress_path = pathlib.Path(self.storage_root) / book_id / self.config['progress_filename']
+        progress_path = book_path(self.storage_root, book_id) / self.config['progress_filename']
         try:
             import json
             with open(progress_path, 'w', encoding='utf-8') as f:
                 json.dump(progress, f, ensure_ascii=False, indent=2)
+            if self.storage_sync is not None:
+                self.storage_sync.push(book_id, [self.config['progress_filename']])
         except Exception as e:
             self.logger.error(f"Error saving progress for {book_id}: {str(e)}", book_id, error=e)
 
+    def _record_job_killed(self, book_id: str, status: str, message: str) -> None:
+        progress = self._load_progress(book_id)
+        progress['isFreeRequestCompleted'] = False
+        progress['free_status'] = status
+        progress['free_error'] = message
+        progress['free_error_at'] = datetime.now().isoformat()
+        self._save_progress(book_id, progress)
+
+    def _hand_back_job(self, book_id: str) -> None:
+        _remove_partial_outputs(book_path(self.storage_root, book_id), [self.config['final_epub_filename']])
+        progress = self._load_progress(book_id)
+        progress['isFreeRequestCompleted'] = False
+        progress.pop('free_status', None)
+        if progress.get('status') == 'processing':
+            progress['status'] = 'pending'
+        progress['free_requeued_at'] = datetime.now().isoformat()
+        self._save_progress(book_id, progress)
+
+    def find_composer(self, book_id: str, listing: Optional[Set[str]] = None) -> Optional[IComposer]:
+        return self.composer_factory.find_suitable_composer(book_id, self.storage_root,
+            {
+                'progress_filename': self.config['progress_filename'],
+                'translated_content_filename': self.config['translated_content_filename'],
+                'translated_json_filename': self.config['translated_json_filename'],
+                'final_epub_filename': self.config['final_epub_filename']
+            },
+            listing
+        )
+
     def process_book(self, book_id: str) -> bool:
         try:
             self.logger.info(f"Processing free book: {book_id}", book_id)
-            composer = self.composer_factory.find_suitable_composer(book_id, self.storage_root,
-				{
-					'progress_filename': self.config['progress_filename'],
-					'translated_content_filename': self.config['translated_content_filename'],
-					'translated_json_filename': self.config['translated_json_filename'],
-					'final_epub_filename': self.config['final_epub_filename']
-				}
-				)
+            composer = self.find_composer(book_id)
             if not composer:
                 self.logger.error(f"No suitable composer found for {book_id}", book_id)
                 return False
             # Compose with free content files (pass config to indicate free mode)
-            config = {'free_mode': True, 'free_md': self.config['translated_content_filename'], 'free_json': self.config['translated_json_filename'], 'free_epub': self.config['final_epub_filename']}
-            success = composer.compose(book_id, self.storage_root, config)
+            token = self._cancellation_token(book_id)
+            config = {'free_mode': True, 'free_md': self.config['translated_content_filename'], 'free_json': self.config['translated_json_filename'], 'free_epub': self.config['final_epub_filename'], 'cancellation_token': token}
+            success = self._compose_measured(composer, book_id, config)
             progress = self._load_progress(book_id)
             progress['isFreeRequestCompleted'] = success
+            if not success and token.is_cancelled():
+                progress['free_status'] = 'cancelled'
+            elif not success:
+                progress['free_status'] = 'error'
+                progress['free_error_type'] = progress.get('error_type')
             self._save_progress(book_id, progress)
             if success:
                 self.logger.info(f"Successfully processed free book: {book_id}", book_id)
@@ -282,15 +1136,15 @@ class FreeComposingWorker(BaseComposingWorker):
                 jobs = self.find_jobs()
                 for book_id in jobs:
                     found_job = True
-                    write_service_event("service-start", book_id, "free-composingservice", storage_root=self.storage_root)
+                    write_service_event("service-start", book_id, self.service_name, storage_root=self.storage_root)
                     try:
                         success = self.process_book(book_id)
                         if success:
-                            write_service_event("service-stop", book_id, "free-composingservice", storage_root=self.storage_root, result="success")
+                            write_service_event("service-stop", book_id, self.service_name, storage_root=self.storage_root, result="success")
                         else:
-                            write_service_event("service-stop", book_id, "free-composingservice", storage_root=self.storage_root, result="error")
+                            write_service_event("service-stop", book_id, self.service_name, storage_root=self.storage_root, result="error")
                     except Exception as e:
-                        write_service_event("service-stop", book_id, "free-composingservice", storage_root=self.storage_root, result="error", error=str(e))
+                        write_service_event("service-stop", book_id, self.service_name, storage_root=self.storage_root, result="error", error=str(e))
                         raise
                 if not found_job:
                     self.logger.info("No free jobs found. Sleeping...")
@@ -300,4 +1154,40 @@ class FreeComposingWorker(BaseComposingWorker):
                 break
             except Exception as e:
                 self.logger.error(f"Unexpected error in main loop: {str(e)}", error=e)
-                time.sleep(self.config['sleep_interval']) 
\ No newline at end of file
+                time.sleep(self.config['sleep_interval'])
+
+
+# Per-process worker cache used by the composition pool, so a child only builds
+# its ComposerFactory once instead of once per job.
+_child_workers: Dict[str, BaseComposingWorker] = {}
+
+_child_workers_lock = threading.Lock()
+
+def _child_worker(storage_root: str, service: str) -> BaseComposingWorker:
+    with _child_workers_lock:
+        worker = _child_workers.get(service)
+        if worker is None:
+            worker_class = FreeComposingWorker if service == FreeComposingWorker.service_name else ComposingWorker
+            worker = worker_class(storage_root)
+            _child_workers[service] = worker
+        return worker
+
+def _init_pool_process() -> None:
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, _abort_pooled_job)
+
+def _abort_pooled_job(signum, frame) -> None:
+    raise DrainDeadlineExceeded()
+
+def _process_book_in_child(storage_root: str, service: str, book_id: str) -> Tuple[bool, int]:
+    """Entry point executed inside a pool process for a single job; returns (success, child RSS bytes)."""
+    success = _child_worker(storage_root, service).process_book_isolated(book_id)
+    return success, current_rss()
+
+def _process_book_in_thread(storage_root: str, service: str, book_id: str) -> Tuple[bool, int]:
+    """Entry point executed on a pool thread (COMPOSER_EXECUTOR=pipeline); no per-child RSS to report."""
+    return _child_worker(storage_root, service).process_book_isolated(book_id, isolate=False), 0
+
+def _process_book_for_service(storage_root: str, service: str, book_id: str) -> bool:
+    """Entry point executed inside an isolated per-job process."""
+    return _child_worker(storage_root, service).process_book(book_id)
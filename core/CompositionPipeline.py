@@ -0,0 +1,194 @@
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+# Stage kinds: I/O stages run on threads, CPU stages on a process pool when one is configured
+STAGE_IO = 'io'
+STAGE_CPU = 'cpu'
+
+Listener = Callable[[Any, str], None]
+
+
+class PipelineStage:
+    """One step of the pipeline: func(task) -> task, run on the executor for its kind."""
+
+    def __init__(self, name: str, kind: str, func: Callable[[Any], Any]):
+        if kind not in (STAGE_IO, STAGE_CPU):
+            raise ValueError(f"Unknown stage kind: {kind}")
+        self.name = name
+        self.kind = kind
+        self.func = func
+
+
+class StageMetrics:
+    """Queue and timing counters for one stage."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.queued = 0
+        self.max_queued = 0
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        finished = self.processed + self.failed
+        return {
+            'kind': self.kind,
+            'queued': self.queued,
+            'maxQueued': self.max_queued,
+            'active': self.active,
+            'processed': self.processed,
+            'failed': self.failed,
+            'avgWaitSeconds': round(self.wait_seconds / finished, 3) if finished else None,
+            'avgBusySeconds': round(self.busy_seconds / finished, 3) if finished else None,
+        }
+
+
+class _PipelineItem:
+    def __init__(self, task: Any, listener: Optional[Listener]):
+        self.task = task
+        self.listener = listener
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.aborted = False
+        # Set whenever no stage is working on the task
+        self.settled = threading.Event()
+        self.settled.set()
+
+
+class CompositionPipeline:
+    """
+    Runs tasks through a fixed sequence of stages connected by bounded queues.
+
+    Each stage has its own worker threads: `io_workers` for I/O stages and
+    `cpu_workers` for CPU stages, whose work is handed to a process pool of the
+    same size (or run on the stage thread when `cpu_workers` is 0). Several tasks
+    are in the pipeline at once, so one book's inputs are read while another is
+    rendered.
+
+    A full queue blocks the stage feeding it, and submit() blocks while the first
+    queue is full, so a slow stage holds back its producers instead of letting
+    work pile up in memory.
+    """
+
+    def __init__(self, stages: List[PipelineStage], io_workers: int = 2, cpu_workers: int = 0,
+                 queue_size: int = 4, start_method: Optional[str] = None):
+        self.stages = stages
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+        self._metrics = {stage.name: StageMetrics(stage.kind) for stage in stages}
+        self._lock = threading.Lock()
+        self._cpu_executor: Optional[ProcessPoolExecutor] = None
+        if cpu_workers > 0:
+            self._cpu_executor = ProcessPoolExecutor(max_workers=cpu_workers, mp_context=_mp_context(start_method))
+        self._workers = [max(1, io_workers if stage.kind == STAGE_IO else cpu_workers) for stage in stages]
+        for index, stage in enumerate(stages):
+            for n in range(self._workers[index]):
+                threading.Thread(target=self._stage_loop, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True).start()
+
+    def submit(self, task: Any, listener: Optional[Listener] = None) -> Future:
+        """
+        Queue a task at the first stage; blocks while that stage is full.
+
+        `listener(task, stage_name)` is called on the pipeline's thread before each
+        stage, e.g. to record progress or raise to abandon the task.
+        """
+        item = _PipelineItem(task, listener)
+        self._put(0, item)
+        return item.future
+
+    def run(self, task: Any, listener: Optional[Listener] = None) -> Any:
+        """Run one task through every stage and return the final task, re-raising a stage's exception."""
+        item = _PipelineItem(task, listener)
+        self._put(0, item)
+        try:
+            return item.future.result()
+        except BaseException:
+            # Interrupted from outside (e.g. the worker is shutting down): drop the
+            # task and wait for the stage still working on it, so it cannot write
+            # outputs after the caller has cleaned up. A drain also interrupts the
+            # stage's cancellation checks, so this takes until its next check
+            item.aborted = True
+            item.settled.wait()
+            raise
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Per-stage queue depth, throughput and timing."""
+        with self._lock:
+            return {name: metrics.snapshot() for name, metrics in self._metrics.items()}
+
+    def close(self) -> None:
+        for index, workers in enumerate(self._workers):
+            for _ in range(workers):
+                self._queues[index].put(None)
+        if self._cpu_executor is not None:
+            self._cpu_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _put(self, index: int, item: _PipelineItem) -> None:
+        metrics = self._metrics[self.stages[index].name]
+        with self._lock:
+            metrics.queued += 1
+            metrics.max_queued = max(metrics.max_queued, metrics.queued)
+        item.enqueued_at = time.monotonic()
+        self._queues[index].put(item)
+
+    def _stage_loop(self, index: int) -> None:
+        stage = self.stages[index]
+        metrics = self._metrics[stage.name]
+        while True:
+            item = self._queues[index].get()
+            if item is None:
+                return
+            started = time.monotonic()
+            with self._lock:
+                metrics.queued -= 1
+                metrics.active += 1
+                metrics.wait_seconds += started - item.enqueued_at
+            # Unsettle before looking at aborted, so run() either sees the stage
+            # working or the stage sees the abort
+            item.settled.clear()
+            if item.aborted:
+                with self._lock:
+                    metrics.active -= 1
+                item.settled.set()
+                continue
+            try:
+                if item.listener is not None:
+                    item.listener(item.task, stage.name)
+                if stage.kind == STAGE_CPU and self._cpu_executor is not None:
+                    item.task = self._cpu_executor.submit(stage.func, item.task).result()
+                else:
+                    item.task = stage.func(item.task)
+            except BaseException as e:
+                with self._lock:
+                    metrics.active -= 1
+                    metrics.failed += 1
+                    metrics.busy_seconds += time.monotonic() - started
+                item.settled.set()
+                if not item.future.done():
+                    item.future.set_exception(e)
+                continue
+            with self._lock:
+                metrics.active -= 1
+                metrics.processed += 1
+                metrics.busy_seconds += time.monotonic() - started
+            item.settled.set()
+            if index + 1 < len(self.stages):
+                if not item.aborted:
+                    self._put(index + 1, item)
+            elif not item.future.done():
+                item.future.set_result(item.task)
+
+
+def _mp_context(start_method: Optional[str]):
+    if start_method not in multiprocessing.get_all_start_methods():
+        start_method = None
+    context = multiprocessing.get_context(start_method)
+    if context.get_start_method() == 'forkserver':
+        context.set_forkserver_preload(['core.pool_preload'])
+    return context
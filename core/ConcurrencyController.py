@@ -0,0 +1,204 @@
+import json
+import math
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from common.logger import get_logger
+from common.storage_backend import get_storage_backend
+
+# Job duration assumed until the first job has finished
+DEFAULT_JOB_SECONDS = 60.0
+
+# Weight of the newest sample in the moving averages of job duration and child RSS
+SMOOTHING = 0.3
+
+# No scale-up while the container's CPU is busier than this share of its capacity
+CPU_HIGH_WATERMARK = 0.85
+
+# Memory kept free for the worker itself and page cache when sizing scale-ups
+MEMORY_RESERVE = 0.15
+
+# cgroup v1 reports "no limit" as a huge page-aligned number
+_UNLIMITED = 1 << 60
+
+
+class ConcurrencyController:
+    """
+    Sizes the number of concurrent compositions from the observed queue.
+
+    Every `autoscale_interval` seconds the backlog (queued + running jobs times
+    the moving average job duration) is turned into the number of slots needed
+    to drain it within `autoscale_target_drain_seconds`, clamped to
+    COMPOSER_MIN_CONCURRENCY..COMPOSER_MAX_CONCURRENCY.
+
+    Scaling up is held back while the container's CPU is saturated and limited
+    to what its memory headroom can fit, given the average RSS of a composition
+    process. Scaling down happens one slot per interval to avoid flapping, and
+    sooner when memory runs short.
+
+    The same estimate divided by the per-node maximum is published as
+    `desiredReplicas` for an external autoscaler (see /api/scaling).
+    """
+
+    def __init__(self, storage_root: str, config: dict):
+        self.logger = get_logger()
+        self.node_id = config['node_id']
+        self.min_concurrency = config['min_concurrency']
+        self.max_concurrency = config['max_concurrency']
+        self.interval = config['autoscale_interval']
+        self.target_drain_seconds = config['autoscale_target_drain_seconds']
+        self.storage = get_storage_backend(storage_root)
+        self.signal_key = config['scaling_filename']
+        self.concurrency = min(self.max_concurrency, max(self.min_concurrency, config['concurrency']))
+        self.avg_job_seconds: Optional[float] = None
+        self.avg_job_rss = 0.0
+        self.desired_replicas = 1
+        self._last_adjust = 0.0
+        self._last_published: Optional[dict] = None
+        self._last_published_at = 0.0
+        self._cpu_sample: Optional[Tuple[float, float]] = None
+        # Per-stage pipeline counters to publish, when compositions run in this process
+        self.stage_metrics: Optional[Callable[[], Dict[str, Any]]] = None
+
+    def record_job(self, duration: float, rss: int = 0) -> None:
+        """Feed the duration (and composition process RSS, if known) of a finished job."""
+        if self.avg_job_seconds is None:
+            self.avg_job_seconds = duration
+        else:
+            self.avg_job_seconds += SMOOTHING * (duration - self.avg_job_seconds)
+        if rss > 0:
+            self.avg_job_rss = rss if not self.avg_job_rss else self.avg_job_rss + SMOOTHING * (rss - self.avg_job_rss)
+
+    def update(self, queued: int, running: int) -> int:
+        """Re-evaluate the concurrency limit (at most every `autoscale_interval` seconds) and return it."""
+        now = time.monotonic()
+        if now - self._last_adjust < self.interval:
+            return self.concurrency
+        self._last_adjust = now
+
+        avg_job_seconds = self.avg_job_seconds or DEFAULT_JOB_SECONDS
+        needed = math.ceil((queued + running) * avg_job_seconds / self.target_drain_seconds)
+        self.desired_replicas = max(1, math.ceil(needed / self.max_concurrency))
+        cpu_busy = self._cpu_busy()
+        memory_available, memory_limit = _memory_headroom()
+
+        target = min(self.max_concurrency, max(self.min_concurrency, needed))
+        if target > self.concurrency:
+            if cpu_busy is not None and cpu_busy > CPU_HIGH_WATERMARK:
+                target = self.concurrency
+            elif self.avg_job_rss and memory_available is not None:
+                spare = memory_available - memory_limit * MEMORY_RESERVE
+                target = min(target, self.concurrency + max(0, int(spare // self.avg_job_rss)))
+        elif target < self.concurrency:
+            target = self.concurrency - 1
+        if memory_available is not None and memory_available < memory_limit * MEMORY_RESERVE:
+            target = min(target, self.concurrency - 1)
+        target = min(self.max_concurrency, max(self.min_concurrency, target))
+
+        if target != self.concurrency:
+            self.logger.info(f"Adjusting concurrency {self.concurrency} -> {target} "
+                             f"(queued={queued}, running={running}, avg job {avg_job_seconds:.0f}s)")
+            self.concurrency = target
+        self._publish(queued, running, needed, cpu_busy, memory_available)
+        return self.concurrency
+
+    def _cpu_busy(self) -> Optional[float]:
+        """Share of the container's CPU capacity used since the previous call."""
+        usage = _cpu_usage_seconds()
+        now = time.monotonic()
+        previous, self._cpu_sample = self._cpu_sample, (now, usage) if usage is not None else None
+        if usage is None or previous is None or now <= previous[0]:
+            return None
+        return (usage - previous[1]) / ((now - previous[0]) * _cpu_capacity())
+
+    def _publish(self, queued: int, running: int, needed: int, cpu_busy: Optional[float], memory_available: Optional[int]) -> None:
+        """Write the scaling signal for /api/scaling when it changed, or every 30s."""
+        signal = {
+            'nodeId': self.node_id,
+            'queued': queued,
+            'running': running,
+            'concurrency': self.concurrency,
+            'minConcurrency': self.min_concurrency,
+            'maxConcurrency': self.max_concurrency,
+            'neededSlots': needed,
+            'desiredReplicas': self.desired_replicas,
+        }
+        if signal == self._last_published and time.monotonic() - self._last_published_at < 30:
+            return
+        self._last_published = dict(signal)
+        self._last_published_at = time.monotonic()
+        signal.update({
+            'updated_at': time.time(),
+            'avgJobSeconds': round(self.avg_job_seconds, 1) if self.avg_job_seconds is not None else None,
+            'avgJobRssBytes': int(self.avg_job_rss),
+            'cpuBusy': round(cpu_busy, 2) if cpu_busy is not None else None,
+            'memoryAvailableBytes': memory_available,
+        })
+        if self.stage_metrics is not None:
+            signal['stages'] = self.stage_metrics()
+        try:
+            self.storage.write_bytes(self.signal_key, json.dumps(signal, indent=2).encode('utf-8'))
+        except Exception as e:
+            self.logger.error(f"Error writing scaling signal: {str(e)}", error=e)
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path, 'r') as f:
+            value = f.read().split()[0]
+    except (OSError, IndexError):
+        return None
+    if value == 'max':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _cpu_capacity() -> float:
+    """CPUs available to the container: the cgroup quota (v2 or v1), else the host CPU count."""
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        quota_v1 = _read_int('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+        period_v1 = _read_int('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if quota_v1 and quota_v1 > 0 and period_v1:
+            return quota_v1 / period_v1
+    return float(os.cpu_count() or 1)
+
+
+def _cpu_usage_seconds() -> Optional[float]:
+    """CPU time consumed by the container so far, from cgroup v2 or v1 accounting."""
+    try:
+        with open('/sys/fs/cgroup/cpu.stat', 'r') as f:
+            for line in f:
+                if line.startswith('usage_usec'):
+                    return int(line.split()[1]) / 1e6
+    except (OSError, ValueError, IndexError):
+        pass
+    usage_ns = _read_int('/sys/fs/cgroup/cpuacct/cpuacct.usage')
+    return usage_ns / 1e9 if usage_ns is not None else None
+
+
+def _memory_headroom() -> Tuple[Optional[int], Optional[int]]:
+    """(available, limit) memory in bytes for the container, from the cgroup limit or /proc/meminfo."""
+    for limit_path, usage_path in [('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+                                   ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes')]:
+        limit = _read_int(limit_path)
+        usage = _read_int(usage_path)
+        if limit is not None and usage is not None and limit < _UNLIMITED:
+            return max(0, limit - usage), limit
+    try:
+        meminfo = {}
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                meminfo[key] = int(value.split()[0]) * 1024
+        return meminfo['MemAvailable'], meminfo['MemTotal']
+    except (OSError, ValueError, KeyError):
+        return None, None
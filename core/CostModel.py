@@ -0,0 +1,243 @@
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from common.compression import open_text, stored_path
+from common.logger import get_logger
+
+# Features of a book, from a cheap line-based pre-scan of its input markdown files
+FEATURES = ['input_bytes', 'sections', 'paragraphs', 'images']
+
+# Fit a regression once a composer has this many measurements; use a per-byte ratio below it
+MIN_REGRESSION_SAMPLES = 8
+
+# Measurements kept per composer when fitting
+MAX_HISTORY = 500
+
+# Ridge penalty on the standardized coefficients, keeps small or collinear samples stable
+RIDGE = 1.0
+
+# Rough estimates used before a composer has any measurements
+DEFAULT_SECONDS_PER_MB = 5.0
+DEFAULT_BASE_RSS = 150 * 1024 * 1024
+DEFAULT_RSS_PER_INPUT_BYTE = 20
+
+HEADING = re.compile(r'^\s{0,3}#{1,6}\s')
+
+
+def schedule(durations: List[float], slots: int) -> List[Tuple[float, float]]:
+    """(start, end) offsets of jobs started in the given order on `slots` parallel slots."""
+    free_at = [0.0] * max(1, slots)
+    times = []
+    for duration in durations:
+        slot = min(range(len(free_at)), key=lambda i: free_at[i])
+        start = free_at[slot]
+        free_at[slot] = start + duration
+        times.append((start, free_at[slot]))
+    return times
+
+
+def prescan(book_dir: pathlib.Path, inputs: List[str]) -> Dict[str, int]:
+    """Count the model features of the given input files in one pass over their lines."""
+    features = dict.fromkeys(FEATURES, 0)
+    for name in inputs:
+        path = book_dir / name
+        try:
+            features['input_bytes'] += (stored_path(path) or path).stat().st_size
+            with open_text(path, errors='replace') as f:
+                in_paragraph = False
+                for line in f:
+                    if not line.strip():
+                        in_paragraph = False
+                        continue
+                    if HEADING.match(line):
+                        features['sections'] += 1
+                        in_paragraph = False
+                        continue
+                    if not in_paragraph:
+                        features['paragraphs'] += 1
+                        in_paragraph = True
+                    features['images'] += line.count('![')
+        except FileNotFoundError:
+            continue
+    return features
+
+
+class CostModel:
+    """
+    Estimates the wall time and peak RSS of a composition from the features of
+    its inputs.
+
+    Every measured job is appended to `cost_measurements_filename` in the
+    storage root. fit() turns the latest measurements into, per composer, a
+    ridge regression of wall time and peak RSS on the features (a per-byte
+    ratio while there are fewer than MIN_REGRESSION_SAMPLES), which is saved to
+    `cost_model_filename` for the planner and the API.
+    """
+
+    def __init__(self, storage_root: str, config: dict):
+        self.logger = get_logger()
+        self.measurements_path = pathlib.Path(storage_root) / config['cost_measurements_filename']
+        self.model_path = pathlib.Path(storage_root) / config['cost_model_filename']
+        self.composers: Dict[str, dict] = {}
+        self._loaded_mtime: Optional[float] = None
+
+    def record(self, composer: str, features: Dict[str, int], seconds: float, peak_rss: int) -> None:
+        """Append the measurement of a finished job and refit the model."""
+        measurement = {'composer': composer, 'seconds': round(seconds, 3), 'peak_rss': peak_rss, 'at': time.time()}
+        measurement.update({name: features.get(name, 0) for name in FEATURES})
+        with open(self.measurements_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(measurement) + '\n')
+        self.fit()
+
+    def fit(self) -> None:
+        """Fit every composer's model from the latest measurements and save it."""
+        by_composer: Dict[str, List[dict]] = {}
+        lines = 0
+        try:
+            with open(self.measurements_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        measurement = json.loads(line)
+                    except ValueError:
+                        continue
+                    by_composer.setdefault(measurement.get('composer'), []).append(measurement)
+        except FileNotFoundError:
+            return
+        for composer, measurements in by_composer.items():
+            del measurements[:-MAX_HISTORY]
+            self.composers[composer] = _fit_composer(measurements)
+        if lines > 2 * MAX_HISTORY * max(1, len(by_composer)):
+            self._compact(by_composer)
+        self._save()
+
+    def load(self) -> None:
+        """(Re)load the saved model if it changed since the last load."""
+        try:
+            mtime = self.model_path.stat().st_mtime
+            if mtime == self._loaded_mtime:
+                return
+            with open(self.model_path, 'r', encoding='utf-8') as f:
+                self.composers = json.load(f).get('composers', {})
+            self._loaded_mtime = mtime
+        except (OSError, ValueError):
+            self.composers = {}
+
+    def estimate(self, composer: str, features: Dict[str, int]) -> Tuple[float, int, str]:
+        """(wall seconds, peak RSS bytes, basis) for a job; basis is regression, ratio or default."""
+        model = self.composers.get(composer)
+        if model is None:
+            megabytes = features.get('input_bytes', 0) / (1024 * 1024)
+            rss = DEFAULT_BASE_RSS + DEFAULT_RSS_PER_INPUT_BYTE * features.get('input_bytes', 0)
+            return round(1.0 + DEFAULT_SECONDS_PER_MB * megabytes, 2), rss, 'default'
+        if model['basis'] == 'ratio':
+            seconds = model['seconds_per_byte'] * features.get('input_bytes', 0)
+            return round(max(model['min_seconds'], seconds), 2), model['max_rss'], 'ratio'
+        x = [1.0] + [(features.get(name, 0) - mean) / scale
+                     for name, mean, scale in zip(FEATURES, model['mean'], model['scale'])]
+        seconds = sum(c * v for c, v in zip(model['seconds'], x))
+        rss = sum(c * v for c, v in zip(model['rss'], x))
+        return round(max(model['min_seconds'], seconds), 2), int(max(model['min_rss'], rss)), 'regression'
+
+    def _save(self) -> None:
+        try:
+            tmp_path = self.model_path.with_name(f".{self.model_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'updated_at': time.time(), 'features': FEATURES, 'composers': self.composers}, f, indent=2)
+            os.replace(tmp_path, self.model_path)
+        except Exception as e:
+            self.logger.error(f"Error saving cost model: {str(e)}", error=e)
+
+    def _compact(self, by_composer: Dict[str, List[dict]]) -> None:
+        """Rewrite the measurements file with only the history the fit uses."""
+        tmp_path = self.measurements_path.with_name(f".{self.measurements_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for measurements in by_composer.values():
+                for measurement in measurements:
+                    f.write(json.dumps(measurement) + '\n')
+        os.replace(tmp_path, self.measurements_path)
+
+
+def _fit_composer(measurements: List[dict]) -> dict:
+    seconds = [m['seconds'] for m in measurements]
+    rss = [m['peak_rss'] for m in measurements]
+    model = {
+        'samples': len(measurements),
+        'min_seconds': min(seconds),
+        'min_rss': min(rss),
+        'max_rss': max(rss),
+    }
+    if len(measurements) < MIN_REGRESSION_SAMPLES:
+        total_bytes = sum(m['input_bytes'] for m in measurements)
+        model['basis'] = 'ratio'
+        model['seconds_per_byte'] = sum(seconds) / total_bytes if total_bytes else 0.0
+        return model
+
+    # Standardize the features so a single ridge penalty suits all of them
+    columns = [[float(m.get(name, 0)) for m in measurements] for name in FEATURES]
+    means = [sum(column) / len(column) for column in columns]
+    scales = [(sum((v - mean) ** 2 for v in column) / len(column)) ** 0.5 or 1.0
+              for column, mean in zip(columns, means)]
+    rows = [[1.0] + [(column[i] - mean) / scale for column, mean, scale in zip(columns, means, scales)]
+            for i in range(len(measurements))]
+    model['basis'] = 'regression'
+    model['mean'] = means
+    model['scale'] = scales
+    model['seconds'] = _ridge(rows, seconds)
+    model['rss'] = _ridge(rows, rss)
+    return model
+
+
+def _ridge(rows: List[List[float]], targets: List[float]) -> List[float]:
+    """Solve (X'X + RIDGE*I) b = X'y by Gaussian elimination; the intercept is not penalized."""
+    n = len(rows[0])
+    a = [[sum(row[i] * row[j] for row in rows) + (RIDGE if i == j and i > 0 else 0.0) for j in range(n)]
+         + [sum(row[i] * y for row, y in zip(rows, targets))] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        if abs(a[col][col]) < 1e-12:
+            continue
+        for r in range(n):
+            if r != col:
+                factor = a[r][col] / a[col][col]
+                a[r] = [v - factor * p for v, p in zip(a[r], a[col])]
+    return [a[i][n] / a[i][i] if abs(a[i][i]) >= 1e-12 else 0.0 for i in range(n)]
+
+
+class PeakRssSampler:
+    """Samples this process's RSS on a background thread while a job runs (context manager)."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'PeakRssSampler':
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def current_rss() -> int:
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
@@ -3,6 +3,10 @@ from typing import List, Tuple, Optional
 from pathlib import Path
 import logging
 
+from core.markdown_blocks import LIST, PARAGRAPH, Section, iter_bullets, tokenize
+
+BULLET_MARKER = re.compile(r'^[-*+]\s*')
+
 class DualLanguageCombiner:
     """Utility class to combine original and translated markdown files into dual-language format."""
     
@@ -34,44 +38,16 @@ class DualLanguageCombiner:
             self.logger.error(f"Error combining markdown files: {str(e)}")
             raise
     
-    def _parse_markdown_sections(self, content: str) -> List[Tuple[str, str, List[str]]]:
+    def _parse_markdown_sections(self, content: str) -> List[Section]:
         """
         Parse markdown content into sections based on headers.
         
         Returns:
-            List of (level, title, content_lines) tuples
+            Sections with their level, title and blocks (see core/markdown_blocks.py)
         """
-        lines = content.strip().split('\n')
-        sections = []
-        current_section = None
-        current_lines = []
-        
-        for line in lines:
-            # Check if this is a header line
-            header_match = re.match(r'^(#{1,6})\s+(.+)$', line.strip())
-            
-            if header_match:
-                # Save previous section if exists
-                if current_section:
-                    sections.append((current_section[0], current_section[1], current_lines))
-                
-                # Start new section
-                level = header_match.group(1)  # Number of # characters
-                title = header_match.group(2).strip()
-                current_section = (level, title)
-                current_lines = []
-            else:
-                # Add to current section content
-                current_lines.append(line)
-        
-        # Add final section
-        if current_section:
-            sections.append((current_section[0], current_section[1], current_lines))
-        
-        return sections
+        return tokenize(content).sections()
     
-    def _combine_sections(self, original_sections: List[Tuple[str, str, List[str]]], 
-                         translated_sections: List[Tuple[str, str, List[str]]]) -> str:
+    def _combine_sections(self, original_sections: List[Section], translated_sections: List[Section]) -> str:
         """
         Combine original and translated sections into dual-language format.
         """
@@ -79,18 +55,18 @@ class DualLanguageCombiner:
         
         # Create mapping of translated sections by normalized title for easier matching
         translated_map = {}
-        for level, title, content in translated_sections:
-            normalized_title = self._normalize_title(title)
-            translated_map[normalized_title] = (level, title, content)
+        for section in translated_sections:
+            translated_map[self._normalize_title(section.title)] = section
         
-        for orig_level, orig_title, orig_content in original_sections:
+        for original_section in original_sections:
+            orig_level, orig_title = original_section.level, original_section.title
             normalized_orig_title = self._normalize_title(orig_title)
             
             # Find matching translated section
             translated_section = translated_map.get(normalized_orig_title)
             
             if translated_section:
-                trans_level, trans_title, trans_content = translated_section
+                trans_title = translated_section.title
                 
                 # Add combined header
                 if orig_level == '#':  # H1 - main title
@@ -103,7 +79,7 @@ class DualLanguageCombiner:
                 combined_lines.append("")
                 
                 # Combine content paragraph by paragraph
-                combined_content = self._combine_content_paragraphs(orig_content, trans_content)
+                combined_content = self._combine_content_paragraphs(original_section.paragraphs(), translated_section.paragraphs())
                 combined_lines.extend(combined_content)
                 combined_lines.append("")
             else:
@@ -111,7 +87,8 @@ class DualLanguageCombiner:
                 self.logger.warn(f"No translation found for section: {orig_title}")
                 combined_lines.append(f"{orig_level} {orig_title}")
                 combined_lines.append("")
-                combined_lines.extend(orig_content)
+                if original_section.body is not None:
+                    combined_lines.append(original_section.body)
                 combined_lines.append("")
         
         # Remove trailing empty lines
@@ -120,37 +97,33 @@ class DualLanguageCombiner:
         
         return '\n'.join(combined_lines)
     
-    def _combine_content_paragraphs(self, orig_content: List[str], trans_content: List[str]) -> List[str]:
+    def _combine_content_paragraphs(self, orig_paragraphs: List[Tuple[int, str]],
+                                    trans_paragraphs: List[Tuple[int, str]]) -> List[str]:
         """
-        Combine content paragraphs from original and translated sections.
+        Combine the (kind, text) paragraphs of an original and a translated section.
         """
         combined = []
         
-        # Split content into paragraphs (separated by empty lines)
-        orig_paragraphs = self._split_into_paragraphs(orig_content)
-        trans_paragraphs = self._split_into_paragraphs(trans_content)
-        
         # Combine paragraphs one by one
         max_paragraphs = max(len(orig_paragraphs), len(trans_paragraphs))
         
         for i in range(max_paragraphs):
-            orig_para = orig_paragraphs[i] if i < len(orig_paragraphs) else []
-            trans_para = trans_paragraphs[i] if i < len(trans_paragraphs) else []
+            orig_kind, orig_para = orig_paragraphs[i] if i < len(orig_paragraphs) else (PARAGRAPH, "")
+            trans_kind, trans_para = trans_paragraphs[i] if i < len(trans_paragraphs) else (PARAGRAPH, "")
             
             # Special handling for bullet points
-            if orig_para and trans_para and self._is_bullet_list(orig_para) and self._is_bullet_list(trans_para):
-                combined_bullets = self._combine_bullet_lists(orig_para, trans_para)
-                combined.extend(combined_bullets)
+            if orig_kind & trans_kind & LIST:
+                combined.extend(self._combine_bullet_lists(orig_para, trans_para))
                 combined.append("")
             else:
                 # Add original paragraph
                 if orig_para:
-                    combined.extend(orig_para)
+                    combined.append(orig_para)
                     combined.append("")
                 
                 # Add translated paragraph
                 if trans_para:
-                    combined.extend(trans_para)
+                    combined.append(trans_para)
                     combined.append("")
         
         # Remove final empty line if exists
@@ -159,32 +132,13 @@ class DualLanguageCombiner:
         
         return combined
     
-    def _is_bullet_list(self, lines: List[str]) -> bool:
-        """Check if the lines form a bullet list."""
-        if not lines:
-            return False
-        
-        # Check if most lines start with bullet points
-        bullet_count = 0
-        non_empty_count = 0
-        
-        for line in lines:
-            stripped = line.strip()
-            if stripped:
-                non_empty_count += 1
-                if stripped.startswith(('- ', '* ', '+ ')):
-                    bullet_count += 1
-        
-        # Consider it a bullet list if most non-empty lines are bullets
-        return non_empty_count > 0 and bullet_count >= non_empty_count * 0.5
-    
-    def _combine_bullet_lists(self, orig_list: List[str], trans_list: List[str]) -> List[str]:
+    def _combine_bullet_lists(self, orig_list: str, trans_list: str) -> List[str]:
         """Combine two bullet lists into dual-language format."""
         combined = []
         
         # Extract bullet items from both lists
-        orig_bullets = self._extract_bullet_items(orig_list)
-        trans_bullets = self._extract_bullet_items(trans_list)
+        orig_bullets = list(iter_bullets(orig_list))
+        trans_bullets = list(iter_bullets(trans_list))
         
         # Combine bullets one by one
         max_bullets = max(len(orig_bullets), len(trans_bullets))
@@ -195,8 +149,8 @@ class DualLanguageCombiner:
             
             if orig_bullet and trans_bullet:
                 # Remove just the bullet marker, keep the rest
-                orig_text = re.sub(r'^[-*+]\s*', '', orig_bullet).strip()
-                trans_text = re.sub(r'^[-*+]\s*', '', trans_bullet).strip()
+                orig_text = BULLET_MARKER.sub('', orig_bullet).strip()
+                trans_text = BULLET_MARKER.sub('', trans_bullet).strip()
                 combined.append(f"- {orig_text} / {trans_text}")
             elif orig_bullet:
                 combined.append(orig_bullet)
@@ -205,36 +159,6 @@ class DualLanguageCombiner:
         
         return combined
     
-    def _extract_bullet_items(self, lines: List[str]) -> List[str]:
-        """Extract bullet items from a list of lines."""
-        bullets = []
-        
-        for line in lines:
-            stripped = line.strip()
-            if stripped and stripped.startswith(('- ', '* ', '+ ')):
-                bullets.append(stripped)
-        
-        return bullets
-    
-    def _split_into_paragraphs(self, lines: List[str]) -> List[List[str]]:
-        """Split lines into paragraphs based on empty lines."""
-        paragraphs = []
-        current_paragraph = []
-        
-        for line in lines:
-            if line.strip() == "":
-                if current_paragraph:
-                    paragraphs.append(current_paragraph)
-                    current_paragraph = []
-            else:
-                current_paragraph.append(line)
-        
-        # Add final paragraph if exists
-        if current_paragraph:
-            paragraphs.append(current_paragraph)
-        
-        return paragraphs
-    
     def _normalize_title(self, title: str) -> str:
         """
         Normalize title for matching by removing common variations.
@@ -1,21 +1,30 @@
 import os
 import json
-import pathlib
-from typing import Dict, Any, Optional
-from markdown import markdown
-from ebooklib import epub
-from bs4 import BeautifulSoup
-import mimetypes
+from typing import Dict, Any, List, Optional
 
 from core.IComposer import IComposer
-from position_based_combiner import PositionBasedCombiner
+from core.ComposerCapabilities import ComposerCapabilities
+from core.CancellationToken import CancellationToken, CompositionCancelled
+from core.composition_stages import CompositionTask, get_composition_pipeline, progress_listener
+from common.compression import stored_path
 from common.logger import get_logger
+from common.storage_layout import book_path
 
 class DualLanguageMarkdownComposer(IComposer):
     """
     Composer that combines original.md and translatedcontent.md into dual-language format
     before converting to EPUB.
     """
+    capabilities = ComposerCapabilities(
+        filenames={
+            'progress_filename': 'composingservice-progress.json',
+            'translated_content_filename': 'translatedcontent.md',
+            'final_epub_filename': 'final.epub',
+        },
+        requires=['originalbook.md', 'translated_content_filename'],
+        # Already processed: our dual-language EPUB and its combined markdown both exist
+        excludes=[['final_epub_filename', 'combined-dual-language.md']],
+    )
     
     def __init__(self, progress_filename: str = "composingservice-progress.json", 
                  translated_content_filename: str = "translatedcontent.md", 
@@ -24,52 +33,39 @@ class DualLanguageMarkdownComposer(IComposer):
         self.progress_filename = progress_filename
         self.translated_content_filename = translated_content_filename
         self.final_epub_filename = final_epub_filename
-        self.combiner = PositionBasedCombiner()
     
     def get_name(self) -> str:
         return "dual_language_markdown"
     
-    def can_compose(self, book_id: str, storage_root: str) -> bool:
-        """Check if both originalbook.md and translatedcontent.md exist for this book."""
-        book_dir = pathlib.Path(storage_root) / book_id
-        original_path = book_dir / "originalbook.md"
-        translated_path = book_dir / self.translated_content_filename
-        
-        # Must have both files to create dual-language content
-        has_both_files = original_path.exists() and translated_path.exists()
-        
-        # Also check that we haven't already processed this with dual-language
-        final_epub_path = book_dir / self.final_epub_filename
-        combined_path = book_dir / "combined-dual-language.md"
-        
-        # If we already have a combined file and our dual-language epub, don't reprocess
-        already_processed = final_epub_path.exists() and combined_path.exists()
-        
-        return has_both_files and not already_processed
+    def get_input_filenames(self) -> List[str]:
+        return ["originalbook.md", self.translated_content_filename]
     
     def compose(self, book_id: str, storage_root: str, config: Optional[Dict[str, Any]] = None) -> bool:
         """
         Combine originalbook.md and translatedcontent.md into dual-language format,
         then convert to EPUB.
         """
+        token = (config or {}).get('cancellation_token') or CancellationToken()
         try:
             self.logger.info(f"Starting dual-language composition for book: {book_id}", book_id)
             
-            book_dir = pathlib.Path(storage_root) / book_id
+            book_dir = book_path(storage_root, book_id)
             original_path = book_dir / "originalbook.md"
             translated_path = book_dir / self.translated_content_filename
             combined_path = book_dir / "combined-dual-language.md"
             output_epub_path = book_dir / self.final_epub_filename
             
             # Check if files exist
-            if not original_path.exists():
+            if stored_path(original_path) is None:
                 self.logger.error(f"Original content file not found: {original_path}", book_id)
                 return False
             
-            if not translated_path.exists():
+            if stored_path(translated_path) is None:
                 self.logger.error(f"Translated content file not found: {translated_path}", book_id)
                 return False
             
+            token.check()
+            
             # Load progress
             progress = self.get_progress(book_id, storage_root)
             progress['status'] = 'processing'
@@ -77,145 +73,36 @@ class DualLanguageMarkdownComposer(IComposer):
             progress['step'] = 'combining_content'
             self.save_progress(book_id, storage_root, progress)
             
-            # Combine original and translated content using position-based matching
             self.logger.info(f"Combining original and translated content for book: {book_id}", book_id)
             
-            # Read both files
-            with open(original_path, 'r', encoding='utf-8') as f:
-                original_content = f.read()
-            with open(translated_path, 'r', encoding='utf-8') as f:
-                translated_content = f.read()
-            
-            # Combine using position-based matching
-            combined_content = self.combiner.combine_by_position(original_content, translated_content)
-            
-            # Write combined content
-            with open(combined_path, 'w', encoding='utf-8') as f:
-                f.write(combined_content)
-            
-            success = True
-            
-            if not success:
-                self.logger.error(f"Failed to combine content for book: {book_id}", book_id)
-                progress['status'] = 'error'
-                progress['error'] = 'Failed to combine original and translated content'
-                progress['error_at'] = self._get_timestamp()
+            # Read, combine, render and write through the shared composition pipeline
+            task = CompositionTask(
+                book_id, book_dir, translated_path, output_epub_path,
+                title=f'Dual Language Book - {book_id}',
+                author='Dual Language Translation Service',
+                fallback_chapter_title='Dual Language Content',
+                original_path=original_path,
+                combined_path=combined_path,
+                dual_language_titles=True,
+                progressive_settle_seconds=(config or {}).get('progressive_settle_seconds'),
+                token=token)
+            task = get_composition_pipeline().run(task, progress_listener(self, book_id, storage_root, progress))
+            for warning in task.warnings:
+                self.logger.warn(warning, book_id)
+            
+            if task.interim:
+                # Interim EPUB of the sections translated so far; composed again as the translation grows
+                progress['status'] = 'partial'
+                progress['coverage'] = task.coverage
+                progress['interim_file'] = str(task.output_path) if task.markdown is not None else None
+                progress['translation_file'] = translated_path.name
+                progress['translation_mtime'] = task.translation_mtime
+                progress['partial_at'] = self._get_timestamp()
+                progress['step'] = 'partial'
                 self.save_progress(book_id, storage_root, progress)
-                return False
-            
-            # Update progress
-            progress['step'] = 'converting_to_epub'
-            self.save_progress(book_id, storage_root, progress)
-            
-            # Read combined markdown content
-            with open(combined_path, 'r', encoding='utf-8') as f:
-                md_content = f.read()
-            
-            # Convert markdown to HTML
-            html_content = markdown(md_content, output_format='html')
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Create EPUB book
-            book = epub.EpubBook()
-            book.set_identifier(f'book_{book_id}')
-            
-            # Try to extract title from the content, fallback to book_id
-            title = self._extract_title_from_content(soup) or f'Dual Language Book - {book_id}'
-            book.set_title(title)
-            book.set_language('en')  # Could be enhanced to support multiple languages
-            book.add_author('Dual Language Translation Service')
-            
-            # Handle images
-            image_tags = soup.find_all('img')
-            for i, img_tag in enumerate(image_tags):
-                img_src = img_tag.get('src')
-                if not img_src:
-                    continue
-                
-                img_path = book_dir / str(img_src)
-                if not img_path.exists():
-                    self.logger.warn(f"Image not found: {img_src}", book_id)
-                    continue
                 
-                mime_type, _ = mimetypes.guess_type(str(img_path))
-                mime_type = mime_type or 'image/jpeg'
-                
-                with open(img_path, 'rb') as f:
-                    img_data = f.read()
-                
-                img_name = pathlib.Path(str(img_src)).name
-                epub_img = epub.EpubItem(
-                    uid=f'img{i}',
-                    file_name=f'images/{img_name}',
-                    media_type=mime_type,
-                    content=img_data
-                )
-                
-                # Fix src in HTML
-                if hasattr(img_tag, '__setitem__'):
-                    img_tag['src'] = f'images/{img_name}'
-                book.add_item(epub_img)
-            
-            # Create chapters from headings
-            all_headers = soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5'])
-            if not all_headers:
-                # Fallback: one chapter with all content
-                chapter = epub.EpubHtml(title='Dual Language Content', file_name='chap_01.xhtml', lang='en')
-                chapter.content = str(soup)
-                book.add_item(chapter)
-                book.toc = (chapter,)
-                book.spine = ['nav', chapter]
-            else:
-                chapters = []
-                toc = []
-                chapter_counter = 1
-                
-                current_chunk = []
-                current_title = "Introduction"
-                current_file_name = f"chap_{chapter_counter:02}.xhtml"
-                
-                body_children = list(soup.body.children) if soup.body else list(soup.children)
-                
-                for el in body_children:
-                    if el.name and el.name in ['h1', 'h2', 'h3', 'h4', 'h5']:
-                        # Save previous chapter if we have content
-                        if current_chunk:
-                            chapter_html = ''.join(str(x) for x in current_chunk)
-                            chapter = epub.EpubHtml(title=current_title, file_name=current_file_name, lang='en')
-                            chapter.content = chapter_html
-                            book.add_item(chapter)
-                            chapters.append(chapter)
-                            toc.append(epub.Link(current_file_name, current_title, f'chap{chapter_counter}'))
-                            chapter_counter += 1
-                            current_file_name = f"chap_{chapter_counter:02}.xhtml"
-                            current_chunk = []
-                        
-                        # Extract title (remove dual-language formatting if present)
-                        full_title = el.get_text()
-                        current_title = self._clean_chapter_title(full_title)
-                    
-                    current_chunk.append(el)
-                
-                # Add final chapter
-                if current_chunk:
-                    chapter_html = ''.join(str(x) for x in current_chunk)
-                    chapter = epub.EpubHtml(title=current_title, file_name=current_file_name, lang='en')
-                    chapter.content = chapter_html
-                    book.add_item(chapter)
-                    chapters.append(chapter)
-                    toc.append(epub.Link(current_file_name, current_title, f'chap{chapter_counter}'))
-                
-                # Set table of contents and spine
-                book.toc = tuple(toc)
-                book.spine = ['nav'] + chapters
-            
-            # Add navigation
-            book.add_item(epub.EpubNcx())
-            book.add_item(epub.EpubNav())
-            
-            # Write EPUB
-            self.logger.info(f"Writing EPUB file: {output_epub_path}", book_id)
-            epub.write_epub(str(output_epub_path), book)
+                self.logger.info(f"Translation for {book_id} is {task.coverage}% complete, composed interim EPUB", book_id)
+                return True
             
             # Update progress
             progress['status'] = 'free-completed' if self.final_epub_filename == 'free-final.epub' else 'completed'
@@ -223,11 +110,25 @@ class DualLanguageMarkdownComposer(IComposer):
             progress['output_file'] = str(output_epub_path)
             progress['combined_file'] = str(combined_path)
             progress['step'] = 'completed'
+            if task.coverage is not None:
+                progress['coverage'] = task.coverage
+                progress.pop('interim_file', None)
             self.save_progress(book_id, storage_root, progress)
             
             self.logger.info(f"Successfully created dual-language EPUB: {output_epub_path}", book_id)
             return True
             
+        except CompositionCancelled:
+            self.logger.info(f"Composition cancelled for book: {book_id}", book_id)
+            
+            # Update progress with cancellation
+            progress = self.get_progress(book_id, storage_root)
+            progress['status'] = 'cancelled'
+            progress['cancelled_at'] = self._get_timestamp()
+            self.save_progress(book_id, storage_root, progress)
+            
+            return False
+            
         except Exception as e:
             self.logger.error(f"Error composing dual-language EPUB for {book_id}: {str(e)}", book_id, e)
             
@@ -235,31 +136,15 @@ class DualLanguageMarkdownComposer(IComposer):
             progress = self.get_progress(book_id, storage_root)
             progress['status'] = 'error'
             progress['error'] = str(e)
+            progress['error_type'] = type(e).__name__
             progress['error_at'] = self._get_timestamp()
             self.save_progress(book_id, storage_root, progress)
             
             return False
     
-    def _extract_title_from_content(self, soup: BeautifulSoup) -> Optional[str]:
-        """Extract title from the first H1 tag in the content."""
-        h1_tag = soup.find('h1')
-        if h1_tag:
-            title_text = h1_tag.get_text().strip()
-            # If it's a dual-language title, take the first part
-            if ' / ' in title_text:
-                return title_text.split(' / ')[0].strip()
-            return title_text
-        return None
-    
-    def _clean_chapter_title(self, title: str) -> str:
-        """Clean chapter title by taking the first part if it's dual-language format."""
-        if ' / ' in title:
-            return title.split(' / ')[0].strip()
-        return title.strip()
-    
     def get_progress(self, book_id: str, storage_root: str) -> Dict[str, Any]:
         """Get progress for the given book."""
-        progress_path = pathlib.Path(storage_root) / book_id / self.progress_filename
+        progress_path = book_path(storage_root, book_id) / self.progress_filename
         
         if progress_path.exists():
             try:
@@ -279,7 +164,7 @@ class DualLanguageMarkdownComposer(IComposer):
     def save_progress(self, book_id: str, storage_root: str, progress: Dict[str, Any]) -> None:
         """Save progress for the given book."""
         try:
-            book_dir = pathlib.Path(storage_root) / book_id
+            book_dir = book_path(storage_root, book_id)
             book_dir.mkdir(parents=True, exist_ok=True)
             
             progress_path = book_dir / self.progress_filename
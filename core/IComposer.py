@@ -1,17 +1,28 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+
+from core.ComposerCapabilities import ComposerCapabilities, list_book_files
+from common.storage_layout import book_path
 
 class IComposer(ABC):
     """Interface for all composer implementations."""
     
+    # Files the composer requires and excludes, matched by ComposerFactory without an instance
+    capabilities: ComposerCapabilities
+    
     @abstractmethod
     def get_name(self) -> str:
         """Return the name/identifier of this composer."""
         pass
     
-    @abstractmethod
     def can_compose(self, book_id: str, storage_root: str) -> bool:
-        """Check if this composer can handle the given book."""
+        """Check if this composer can handle the given book, from one listing of its folder."""
+        overrides = {key: getattr(self, key) for key in self.capabilities.filenames}
+        return self.capabilities.matches(list_book_files(book_path(storage_root, book_id)), overrides)
+    
+    @abstractmethod
+    def get_input_filenames(self) -> List[str]:
+        """Return the names of the book files this composer reads (used to estimate its cost)."""
         pass
     
     @abstractmethod
@@ -1,9 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Iterable, List, Optional
 
 class IComposingWorker(ABC):
     @abstractmethod
-    def find_jobs(self) -> List[str]:
+    def find_jobs(self, book_ids: Optional[Iterable[str]] = None) -> List[str]:
         pass
 
     @abstractmethod
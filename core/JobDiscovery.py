@@ -0,0 +1,363 @@
+import ctypes
+import ctypes.util
+import os
+import pathlib
+import select
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Set, Tuple
+
+from common.logger import get_logger
+from common.storage_layout import SHARD_LEVELS, get_storage_layout, is_shard_name
+from core.JobSpool import JobSpool
+
+# Input files whose arrival can turn a folder into a composition job
+WATCHED_FILENAMES = {
+    'originalbook.md',
+    'translatedcontent.md',
+    'free-translatedcontent.md',
+    'free-translatedcontent.json',
+}
+
+# Folders under the storage root that never hold a book
+NON_JOB_DIRS = {'events', 'queue', 'blobs'}
+
+# Filesystems that do not deliver inotify events for changes made by other hosts
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'efs', 'cifs', 'smb3', 'smbfs', '9p', 'fuse.sshfs', 'fuse.s3fs', 'lustre'}
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class JobDiscovery(ABC):
+    """Tells the worker when, and for which books, it is worth scanning storage."""
+
+    @abstractmethod
+    def get_name(self) -> str:
+        """Return the name of this discovery backend."""
+        pass
+
+    @abstractmethod
+    def wait_for_changes(self, timeout: float) -> Optional[Set[str]]:
+        """
+        Block for at most `timeout` seconds waiting for input changes.
+
+        Returns:
+            None when a full storage scan is due, otherwise the (possibly empty)
+            set of book ids whose input files have finished being written.
+        """
+        pass
+
+    def submission_times(self) -> Dict[str, float]:
+        """
+        Take the submission times of the books reported through job tickets
+        since the last call, so the scheduler queues them from when they were submitted.
+        """
+        return {}
+
+    def close(self) -> None:
+        """Release any resources held by the backend."""
+        pass
+
+
+class PollingDiscovery(JobDiscovery):
+    """Requests a full scan every `interval` seconds (the original SLEEP_INTERVAL behaviour)."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last_full_scan = time.monotonic()
+
+    def get_name(self) -> str:
+        return "polling"
+
+    def wait_for_changes(self, timeout: float) -> Optional[Set[str]]:
+        remaining = self.interval - (time.monotonic() - self._last_full_scan)
+        if remaining > 0:
+            time.sleep(min(timeout, remaining))
+            remaining = self.interval - (time.monotonic() - self._last_full_scan)
+        if remaining <= 0:
+            self._last_full_scan = time.monotonic()
+            return None
+        return set()
+
+
+class InotifyDiscovery(JobDiscovery):
+    """
+    Watches the storage root and every book folder with inotify (in the sharded
+    layout, the shard folders in between as well).
+
+    A book is reported once one of WATCHED_FILENAMES is closed after writing or
+    renamed into place. A full scan is still requested every `reconcile_interval`
+    seconds and whenever the kernel event queue overflows.
+    """
+
+    ROOT_MASK = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR | IN_DELETE_SELF | IN_MOVE_SELF
+    SHARD_MASK = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+    BOOK_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR
+
+    def __init__(self, storage_root: str, reconcile_interval: float, settle_seconds: float = 0.25,
+                 layout: str = 'flat'):
+        self.logger = get_logger()
+        self.storage_root = pathlib.Path(storage_root)
+        self.reconcile_interval = reconcile_interval
+        self.settle_seconds = settle_seconds
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Watched book folders, and the storage root and shard folders above them
+        # with the number of shard levels still below each
+        self._watches: Dict[int, pathlib.Path] = {}
+        self._containers: Dict[int, Tuple[pathlib.Path, int]] = {}
+        # Files that already existed when their folder was first watched; they are
+        # reported once they have stopped changing for settle_seconds.
+        self._unsettled: Dict[pathlib.Path, Tuple[str, int, float]] = {}
+        self._needs_full_scan = False
+        self._last_full_scan = time.monotonic()
+        try:
+            self._add_container(self.storage_root, SHARD_LEVELS if layout == 'sharded' else 0, self.ROOT_MASK)
+        except OSError:
+            self.close()
+            raise
+
+    def get_name(self) -> str:
+        return "inotify"
+
+    def wait_for_changes(self, timeout: float) -> Optional[Set[str]]:
+        deadline = time.monotonic() + timeout
+        changed: Set[str] = set()
+        while True:
+            changed |= self._collect_settled()
+            if self._needs_full_scan or time.monotonic() - self._last_full_scan >= self.reconcile_interval:
+                self._needs_full_scan = False
+                self._last_full_scan = time.monotonic()
+                return None
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            if self._unsettled:
+                remaining = min(remaining, self.settle_seconds)
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if readable:
+                # Debounce bursts of writes before reporting
+                time.sleep(self.settle_seconds)
+                changed |= self._read_events()
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _inotify_add_watch(self, path: pathlib.Path, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def _add_watch(self, book_dir: pathlib.Path, mask: int) -> None:
+        # A folder moved into a shard keeps its watch descriptor; only its path changes
+        self._watches[self._inotify_add_watch(book_dir, mask)] = book_dir
+
+    def _add_container(self, folder: pathlib.Path, shard_levels: int, mask: int, new: bool = False) -> None:
+        """Watch the storage root or a shard folder, and the shard and book folders already in it."""
+        self._containers[self._inotify_add_watch(folder, mask)] = (folder, shard_levels)
+        with os.scandir(folder) as entries:
+            children = [pathlib.Path(entry.path) for entry in entries if entry.is_dir()
+                        and entry.name not in NON_JOB_DIRS and not entry.name.startswith('.')]
+        for child in children:
+            if shard_levels and is_shard_name(child.name):
+                self._add_container(child, shard_levels - 1, self.SHARD_MASK, new)
+            elif shard_levels == 0 or folder == self.storage_root:
+                # A book folder, or in the sharded layout a flat one still to migrate
+                if new:
+                    self._watch_new_book(child)
+                else:
+                    self._add_watch(child, self.BOOK_MASK)
+
+    def _watch_new_folder(self, folder: pathlib.Path, shard_levels: int) -> None:
+        """Start watching a new shard folder and the folders already created in it."""
+        try:
+            self._add_container(folder, shard_levels, self.SHARD_MASK, new=True)
+        except OSError as e:
+            self.logger.warn(f"Could not watch {folder}, falling back to full scan: {str(e)}")
+            self._needs_full_scan = True
+
+    def _watch_new_book(self, book_dir: pathlib.Path) -> None:
+        """Start watching a new book folder and pick up files written before the watch existed."""
+        try:
+            self._add_watch(book_dir, self.BOOK_MASK)
+        except OSError as e:
+            self.logger.warn(f"Could not watch {book_dir}, falling back to full scan: {str(e)}")
+            self._needs_full_scan = True
+            return
+        for filename in WATCHED_FILENAMES:
+            path = book_dir / filename
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            self._unsettled[path] = (book_dir.name, stat.st_size, stat.st_mtime)
+
+    def _collect_settled(self) -> Set[str]:
+        settled: Set[str] = set()
+        now = time.time()
+        for path, (book_id, size, mtime) in list(self._unsettled.items()):
+            try:
+                stat = path.stat()
+            except OSError:
+                del self._unsettled[path]
+                continue
+            if stat.st_size != size or stat.st_mtime != mtime:
+                self._unsettled[path] = (book_id, stat.st_size, stat.st_mtime)
+            elif now - mtime >= self.settle_seconds:
+                del self._unsettled[path]
+                settled.add(book_id)
+        return settled
+
+    def _read_events(self) -> Set[str]:
+        changed: Set[str] = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    self._needs_full_scan = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    self._containers.pop(wd, None)
+                    continue
+                if wd in self._containers:
+                    folder, shard_levels = self._containers[wd]
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        if folder == self.storage_root:
+                            self._needs_full_scan = True
+                    elif mask & IN_ISDIR and name not in NON_JOB_DIRS and not name.startswith('.'):
+                        if shard_levels and is_shard_name(name):
+                            self._watch_new_folder(folder / name, shard_levels - 1)
+                        elif shard_levels == 0 or folder == self.storage_root:
+                            self._watch_new_book(folder / name)
+                elif wd in self._watches and name in WATCHED_FILENAMES:
+                    book_dir = self._watches[wd]
+                    self._unsettled.pop(book_dir / name, None)
+                    changed.add(book_dir.name)
+
+
+class SpoolDiscovery(JobDiscovery):
+    """
+    Adds the job tickets in the spool directory to another discovery backend.
+
+    The spool is checked at least every `poll_interval` seconds while waiting,
+    so a book with a ticket is reported within that time however many books are
+    in storage. The wrapped backend still reports its own changes and full scans,
+    which serve as the reconciliation path.
+    """
+
+    def __init__(self, inner: JobDiscovery, spool: JobSpool, poll_interval: float):
+        self.inner = inner
+        self.spool = spool
+        self.poll_interval = poll_interval
+        # book_id -> submission time of its first ticket not yet handed to the scheduler
+        self._submitted: Dict[str, float] = {}
+
+    def get_name(self) -> str:
+        return f"{self.inner.get_name()} + spool"
+
+    def wait_for_changes(self, timeout: float) -> Optional[Set[str]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            tickets = self.spool.take()
+            for book_id, submitted_at in tickets:
+                self._submitted.setdefault(book_id, submitted_at)
+            remaining = max(0.0, deadline - time.monotonic())
+            changed = self.inner.wait_for_changes(0 if tickets else min(self.poll_interval, remaining))
+            if changed is None:
+                return None
+            changed.update(book_id for book_id, _ in tickets)
+            if changed or time.monotonic() >= deadline:
+                return changed
+
+    def submission_times(self) -> Dict[str, float]:
+        submitted, self._submitted = self._submitted, {}
+        return submitted
+
+    def close(self) -> None:
+        self.inner.close()
+
+
+def _load_libc() -> ctypes.CDLL:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError("inotify is not available")
+    return libc
+
+
+def _filesystem_type(path: str) -> Optional[str]:
+    """Return the filesystem type of the mount containing `path`, from /proc/mounts."""
+    try:
+        with open('/proc/mounts', 'r', encoding='utf-8') as f:
+            mounts = [line.split() for line in f]
+    except OSError:
+        return None
+    real_path = os.path.realpath(path)
+    best_mount, best_type = '', None
+    for fields in mounts:
+        if len(fields) < 3:
+            continue
+        mount_point = fields[1].replace('\\040', ' ')
+        if (real_path == mount_point or real_path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) >= len(best_mount):
+            best_mount, best_type = mount_point, fields[2]
+    return best_type
+
+
+def create_job_discovery(storage_root: str, config: dict) -> JobDiscovery:
+    """
+    Create the discovery backend selected by DISCOVERY_MODE (auto, inotify or polling),
+    combined with the job ticket spool when JOB_SPOOL is enabled.
+
+    In auto mode inotify is used on local Linux filesystems, and polling on network
+    mounts such as EFS/NFS that cannot deliver change notifications. With the spool,
+    polling full scans run every JOB_SPOOL_RECONCILE_INTERVAL seconds (SLEEP_INTERVAL unless set).
+    """
+    discovery = _create_storage_discovery(storage_root, config)
+    if not config['job_spool']:
+        return discovery
+    return SpoolDiscovery(discovery, JobSpool(storage_root, config), config['spool_poll_interval'])
+
+
+def _create_storage_discovery(storage_root: str, config: dict) -> JobDiscovery:
+    logger = get_logger()
+    mode = config['discovery_mode']
+    if mode == 'auto':
+        fs_type = _filesystem_type(storage_root)
+        if not sys.platform.startswith('linux') or fs_type in NETWORK_FILESYSTEMS:
+            mode = 'polling'
+            logger.info(f"Storage root is on '{fs_type}', using polling job discovery")
+        else:
+            mode = 'inotify'
+    if mode == 'inotify':
+        try:
+            return InotifyDiscovery(storage_root, config['discovery_reconcile_interval'], layout=get_storage_layout())
+        except OSError as e:
+            logger.warn(f"inotify job discovery unavailable, falling back to polling: {str(e)}")
+    return PollingDiscovery(config['spool_reconcile_interval'] if config['job_spool'] else config['sleep_interval'])
@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import stat
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from common.compression import stored_path, with_logical_names
+from common.logger import get_logger
+from common.storage_layout import NON_BOOK_DIRS, iter_book_dirs
+
+SCHEMA_VERSION = 1
+
+# Input files whose size and mtime are recorded for each book
+INPUT_FILENAMES = [
+    'originalbook.md',
+    'translatedcontent.md',
+    'free-translatedcontent.md',
+    'free-translatedcontent.json',
+]
+
+# Output files whose presence is recorded for each book
+OUTPUT_FILENAMES = ['final.epub', 'dual-language-final.epub', 'free-final.epub', 'interim.epub']
+
+# A row whose folder or progress file changed this recently is re-read on the next
+# scan, since a second change within the filesystem's timestamp granularity would
+# not move the mtime again
+RACY_NS = 2 * 10**9
+
+
+class _BookRow:
+    __slots__ = ('book_id', 'dir_mtime_ns', 'progress_mtime_ns', 'filenames', 'progress', 'inputs')
+
+    def __init__(self, book_id: str, dir_mtime_ns: int, progress_mtime_ns: int, filenames: Set[str],
+                 progress: str, inputs: Dict[str, List[int]]):
+        self.book_id = book_id
+        self.dir_mtime_ns = dir_mtime_ns
+        self.progress_mtime_ns = progress_mtime_ns
+        self.filenames = filenames
+        # Raw progress JSON, parsed on demand so books that are not candidates cost nothing
+        self.progress = progress
+        self.inputs = inputs
+
+
+class JobIndex:
+    """
+    Persistent index of the state of every book under a storage root.
+
+    Each book's folder listing, progress file, input sizes/mtimes and outputs are
+    kept in a local SQLite database together with the mtimes of the book folder
+    and its progress file. A scan stats those two paths and only lists the folder
+    and reads the progress of books where either changed (any file added, removed
+    or renamed, or any progress update), so unchanged books cost two stats instead
+    of a directory listing and a JSON read. Books reported by change notifications
+    are always re-read.
+
+    The index is a cache of what is on disk: it is rebuilt if missing or from an
+    older schema, and reconcile() re-reads every book for recovery.
+    """
+
+    def __init__(self, storage_root: str, config: dict):
+        self.logger = get_logger()
+        self.storage_root = pathlib.Path(storage_root)
+        self.progress_filename = config['progress_filename']
+        self.path = pathlib.Path(config['job_index_dir'] or tempfile.gettempdir()) / _index_filename(storage_root)
+        self._db: Optional[sqlite3.Connection] = None
+        self._rows: Dict[str, _BookRow] = {}
+        self._dirty: Set[str] = set()
+        self._removed: Set[str] = set()
+        # Books listed since the last commit, to drop the ones that are gone after a full scan
+        self._seen: Set[str] = set()
+
+    def listing(self, book_dir: pathlib.Path, force: bool = False) -> Optional[Set[str]]:
+        """
+        The names in a book folder, re-listed only if the folder or its progress
+        file changed since it was indexed (or `force` is set). None if it is not a folder.
+        """
+        self._open()
+        book_id = book_dir.name
+        try:
+            dir_stat = os.stat(book_dir)
+        except (FileNotFoundError, NotADirectoryError):
+            self._forget(book_id)
+            return None
+        if not stat.S_ISDIR(dir_stat.st_mode) or book_id in NON_BOOK_DIRS:
+            return None
+        self._seen.add(book_id)
+        try:
+            progress_mtime_ns = os.stat(book_dir / self.progress_filename).st_mtime_ns
+        except FileNotFoundError:
+            progress_mtime_ns = 0
+        row = self._rows.get(book_id)
+        if not force and row is not None and (row.dir_mtime_ns, row.progress_mtime_ns) == (dir_stat.st_mtime_ns, progress_mtime_ns):
+            return row.filenames
+        return self._refresh(book_dir, dir_stat.st_mtime_ns, progress_mtime_ns)
+
+    def progress(self, book_id: str) -> dict:
+        """The book's progress as of its last refresh, {'status': 'pending'} if it has none."""
+        row = self._rows.get(book_id)
+        if row is None or not row.progress:
+            return {'status': 'pending'}
+        try:
+            return json.loads(row.progress)
+        except ValueError:
+            return {'status': 'pending'}
+
+    def commit(self, scanned_book_ids: Optional[Iterable[str]] = None) -> None:
+        """
+        Write the rows refreshed since the last commit. After a full scan
+        (scanned_book_ids is None) books that were not seen are dropped.
+        """
+        if self._db is None:
+            return
+        if scanned_book_ids is None:
+            self._removed |= set(self._rows) - self._seen
+            for book_id in self._removed:
+                self._rows.pop(book_id, None)
+        self._seen = set()
+        if not self._dirty and not self._removed:
+            return
+        try:
+            with self._db:
+                self._db.executemany("DELETE FROM books WHERE book_id = ?", [(book_id,) for book_id in self._removed])
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO books (book_id, dir_mtime_ns, progress_mtime_ns, filenames, progress, inputs,"
+                    " outputs, status, free_status, attempts, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [self._db_row(self._rows[book_id]) for book_id in self._dirty if book_id in self._rows])
+        except sqlite3.Error as e:
+            self.logger.error(f"Error writing job index {self.path}: {str(e)}", error=e)
+        self._dirty.clear()
+        self._removed.clear()
+
+    def reconcile(self) -> Dict[str, int]:
+        """Re-read every book folder and rewrite the index from scratch. Returns counts of what changed."""
+        self._open()
+        previous = {book_id: (row.filenames, row.progress, row.inputs) for book_id, row in self._rows.items()}
+        self._rows.clear()
+        for item in iter_book_dirs(str(self.storage_root)):
+            self.listing(item, force=True)
+        self._seen.clear()
+        self._dirty.clear()
+        self._removed.clear()
+        with self._db:
+            self._db.execute("DELETE FROM books")
+            self._db.executemany(
+                "INSERT INTO books (book_id, dir_mtime_ns, progress_mtime_ns, filenames, progress, inputs,"
+                " outputs, status, free_status, attempts, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._db_row(row) for row in self._rows.values()])
+        changed = sum(1 for book_id, row in self._rows.items()
+                      if previous.get(book_id) != (row.filenames, row.progress, row.inputs))
+        return {
+            'books': len(self._rows),
+            'changed': changed,
+            'removed': len(set(previous) - set(self._rows)),
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self.commit([])
+            self._db.close()
+            self._db = None
+
+    def _open(self) -> None:
+        """Open the database and load it into memory on first use, so processes that never scan do not pay for it."""
+        if self._db is not None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with self._db:
+                # Processes sharing the index may open it at the same time; only the first creates it
+                self._db.execute("BEGIN IMMEDIATE")
+                if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                    self._db.execute("DROP TABLE IF EXISTS books")
+                    self._db.execute(
+                        "CREATE TABLE books (book_id TEXT PRIMARY KEY, dir_mtime_ns INTEGER, progress_mtime_ns INTEGER,"
+                        " filenames TEXT, progress TEXT, inputs TEXT, outputs TEXT, status TEXT, free_status TEXT,"
+                        " attempts INTEGER, indexed_at REAL)")
+                    self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    self.logger.info(f"Created job index {self.path} for {self.storage_root}")
+        for book_id, dir_mtime_ns, progress_mtime_ns, filenames, progress, inputs in self._db.execute(
+                "SELECT book_id, dir_mtime_ns, progress_mtime_ns, filenames, progress, inputs FROM books"):
+            self._rows[book_id] = _BookRow(book_id, dir_mtime_ns, progress_mtime_ns, set(json.loads(filenames)),
+                                           progress, json.loads(inputs))
+
+    def _refresh(self, book_dir: pathlib.Path, dir_mtime_ns: int, progress_mtime_ns: int) -> Optional[Set[str]]:
+        book_id = book_dir.name
+        try:
+            with os.scandir(book_dir) as entries:
+                filenames = with_logical_names(entry.name for entry in entries)
+        except (FileNotFoundError, NotADirectoryError):
+            self._forget(book_id)
+            return None
+        progress = ''
+        if self.progress_filename in filenames:
+            try:
+                with open(book_dir / self.progress_filename, 'r', encoding='utf-8') as f:
+                    progress = f.read()
+                json.loads(progress)
+            except (OSError, ValueError):
+                # Half-written: do not trust this row, read it again next scan
+                progress, dir_mtime_ns = '', -1
+        inputs = {}
+        for name in INPUT_FILENAMES:
+            if name in filenames:
+                try:
+                    input_stat = (stored_path(book_dir / name) or book_dir / name).stat()
+                    inputs[name] = [input_stat.st_size, input_stat.st_mtime_ns]
+                except OSError:
+                    pass
+        if time.time_ns() - max(dir_mtime_ns, progress_mtime_ns) < RACY_NS:
+            dir_mtime_ns = -1
+        self._rows[book_id] = _BookRow(book_id, dir_mtime_ns, progress_mtime_ns, filenames, progress, inputs)
+        self._dirty.add(book_id)
+        return filenames
+
+    def _forget(self, book_id: str) -> None:
+        if self._rows.pop(book_id, None) is not None:
+            self._removed.add(book_id)
+        self._dirty.discard(book_id)
+
+    def _db_row(self, row: _BookRow) -> Tuple:
+        progress = self.progress(row.book_id)
+        return (
+            row.book_id, row.dir_mtime_ns, row.progress_mtime_ns, json.dumps(sorted(row.filenames)), row.progress,
+            json.dumps(row.inputs), json.dumps([name for name in OUTPUT_FILENAMES if name in row.filenames]),
+            progress.get('status'), progress.get('free_status'), progress.get('attempts'), time.time(),
+        )
+
+
+def _index_filename(storage_root: str) -> str:
+    """One index per storage root, so several roots (or deployments) can share an index directory."""
+    digest = hashlib.sha1(os.path.realpath(storage_root).encode('utf-8')).hexdigest()[:12]
+    return f"composingservice-index-{digest}.sqlite"
@@ -0,0 +1,116 @@
+import multiprocessing
+import signal
+import sys
+from typing import Any, Callable, Optional, Tuple
+
+# Outcomes of an isolated run
+OUTCOME_SUCCESS = 'success'
+OUTCOME_FAILURE = 'failure'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_OOM = 'oom'
+OUTCOME_CRASHED = 'crashed'
+
+# A failed job whose peak address space reached this share of the limit is reported as oom
+OOM_THRESHOLD = 0.9
+
+
+class JobIsolation:
+    """
+    Runs a single job in a child process with a wall-clock timeout and an
+    address-space ceiling (RLIMIT_AS), so a runaway book cannot hang or take
+    down the worker.
+    """
+
+    def __init__(self, timeout_seconds: int, memory_limit_mb: int):
+        self.timeout_seconds = timeout_seconds
+        self.memory_limit_bytes = memory_limit_mb * 1024 * 1024
+
+    @property
+    def enabled(self) -> bool:
+        return self.timeout_seconds > 0 or self.memory_limit_bytes > 0
+
+    def run(self, target: Callable[..., bool], args: Tuple[Any, ...]) -> Tuple[str, str]:
+        """
+        Run target(*args) in a child process.
+
+        Returns:
+            (outcome, message) where outcome is one of success, failure, timeout,
+            oom or crashed.
+        """
+        # fork keeps preloaded modules and the composer cache; spawn where fork is unavailable
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        context = multiprocessing.get_context(method)
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_child, args=(sender, self.memory_limit_bytes, target, args), daemon=True)
+        process.start()
+        sender.close()
+
+        timeout = self.timeout_seconds if self.timeout_seconds > 0 else None
+        result: Optional[Tuple[str, str]] = None
+        try:
+            timed_out = not receiver.poll(timeout)
+            if not timed_out:
+                result = receiver.recv()
+        except EOFError:
+            # The child died before reporting
+            pass
+        except BaseException:
+            # The worker is shutting down; do not leave the job running behind it
+            process.kill()
+            process.join()
+            raise
+        finally:
+            receiver.close()
+
+        if timed_out:
+            process.terminate()
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+            process.join()
+            return OUTCOME_TIMEOUT, f"Composition exceeded the {self.timeout_seconds}s time limit"
+
+        process.join()
+        if result is not None:
+            return result
+        if process.exitcode == -signal.SIGKILL or (self.memory_limit_bytes and process.exitcode is not None and process.exitcode < 0):
+            return OUTCOME_OOM, f"Composition process was killed (exit code {process.exitcode}), most likely out of memory"
+        return OUTCOME_CRASHED, f"Composition process exited unexpectedly (exit code {process.exitcode})"
+
+
+def _run_child(sender, memory_limit_bytes: int, target: Callable[..., bool], args: Tuple[Any, ...]) -> None:
+    # A forked child inherits the worker's drain handlers, which ignore signals outside
+    # the worker process; terminate() on a timed-out job must stop it
+    for signum in ('SIGTERM', 'SIGALRM'):
+        if hasattr(signal, signum):
+            signal.signal(getattr(signal, signum), signal.SIG_DFL)
+    if memory_limit_bytes and sys.platform != 'win32':
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+    try:
+        success = target(*args)
+    except MemoryError:
+        sender.send((OUTCOME_OOM, f"Composition ran out of memory (limit {memory_limit_bytes // (1024 * 1024)}MB)"))
+        return
+    except Exception as e:
+        sender.send((OUTCOME_FAILURE, str(e)))
+        return
+    if success:
+        sender.send((OUTCOME_SUCCESS, ''))
+    elif memory_limit_bytes and _peak_address_space() >= memory_limit_bytes * OOM_THRESHOLD:
+        # Composers catch MemoryError themselves; the peak address space gives it away
+        sender.send((OUTCOME_OOM, f"Composition ran out of memory (limit {memory_limit_bytes // (1024 * 1024)}MB)"))
+    else:
+        sender.send((OUTCOME_FAILURE, ''))
+
+
+def _peak_address_space() -> int:
+    """Peak virtual memory size of this process in bytes (VmPeak), or 0 if unknown."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmPeak:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
@@ -0,0 +1,188 @@
+import json
+import os
+import pathlib
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from common.logger import get_logger
+from common.storage_layout import book_path
+
+
+class JobLeaseManager:
+    """
+    Claims books on shared storage so that several worker nodes never compose
+    the same book at once.
+
+    A lease is a small JSON file in the book folder created with O_CREAT|O_EXCL,
+    which is atomic on local disks and on NFSv4/EFS. Its mtime is the heartbeat:
+    the owner touches it every `lease_heartbeat_interval` seconds, and a lease
+    whose mtime is older than `lease_ttl` seconds is considered abandoned.
+
+    An abandoned lease is reclaimed through a takeover marker named after the
+    lease's random token, also created with O_EXCL, so exactly one node can
+    replace any given lease.
+    """
+
+    def __init__(self, storage_root: str, config: dict, owner: Optional[str] = None):
+        self.logger = get_logger(storage_root)
+        self.storage_root = storage_root
+        self.lease_filename = config['lease_filename']
+        self.ttl = config['lease_ttl']
+        self.heartbeat_interval = config['lease_heartbeat_interval']
+        self.owner = owner or f"{config['node_id']}:{os.getpid()}"
+        # book_id -> token of the lease this node currently holds
+        self._held: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def claim(self, book_id: str, service: str) -> bool:
+        """Try to take the lease for a book. Returns True if this node now holds it."""
+        lease_path = self._lease_path(book_id)
+        with self._lock:
+            if book_id in self._held:
+                return True
+        if self._create(book_id, lease_path, service):
+            return True
+
+        current = self._read(lease_path)
+        if current is None:
+            # Released between our create attempt and the read; try once more
+            return self._create(book_id, lease_path, service)
+        if not self._is_expired(lease_path):
+            return False
+
+        takeover_path = lease_path.with_name(f"{self.lease_filename}.takeover.{current['token']}")
+        if not self._create_exclusive(takeover_path, self.owner):
+            # A reclaimer that died mid-takeover must not block the book forever
+            if self._is_expired(takeover_path):
+                try:
+                    os.unlink(takeover_path)
+                except FileNotFoundError:
+                    pass
+            return False
+        try:
+            # Only replace the lease we judged expired, never a newer one
+            latest = self._read(lease_path)
+            if latest is None or latest.get('token') != current['token'] or not self._is_expired(lease_path):
+                return False
+            self.logger.warn(f"Reclaiming expired lease held by {current.get('owner')}", book_id)
+            os.unlink(lease_path)
+            return self._create(book_id, lease_path, service)
+        except FileNotFoundError:
+            return False
+        finally:
+            try:
+                os.unlink(takeover_path)
+            except FileNotFoundError:
+                pass
+
+    def release(self, book_id: str) -> None:
+        """Give up the lease for a book if this node still holds it."""
+        with self._lock:
+            token = self._held.pop(book_id, None)
+        if token is None:
+            return
+        lease_path = self._lease_path(book_id)
+        current = self._read(lease_path)
+        if current is not None and current.get('token') == token:
+            try:
+                os.unlink(lease_path)
+            except FileNotFoundError:
+                pass
+
+    def release_all(self) -> None:
+        """Give up every lease this node holds."""
+        with self._lock:
+            book_ids = list(self._held)
+        for book_id in book_ids:
+            self.release(book_id)
+
+    def heartbeat(self) -> None:
+        """Refresh every held lease, dropping any that another node has taken over."""
+        with self._lock:
+            held = dict(self._held)
+        for book_id, token in held.items():
+            lease_path = self._lease_path(book_id)
+            current = self._read(lease_path)
+            if current is None or current.get('token') != token:
+                self.logger.warn(f"Lost lease for {book_id}", book_id)
+                with self._lock:
+                    if self._held.get(book_id) == token:
+                        del self._held[book_id]
+                continue
+            try:
+                os.utime(lease_path)
+            except OSError as e:
+                self.logger.error(f"Error refreshing lease for {book_id}: {str(e)}", book_id, error=e)
+
+    def holds(self, book_id: str) -> bool:
+        with self._lock:
+            return book_id in self._held
+
+    def start_heartbeat(self) -> None:
+        """Refresh held leases from a background thread until stop_heartbeat() is called."""
+        if self._heartbeat_thread is not None:
+            return
+        self._stop.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="lease-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop_heartbeat(self) -> None:
+        self._stop.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                self.logger.error(f"Error in lease heartbeat: {str(e)}", error=e)
+
+    def _lease_path(self, book_id: str) -> pathlib.Path:
+        return book_path(self.storage_root, book_id) / self.lease_filename
+
+    def _create(self, book_id: str, lease_path: pathlib.Path, service: str) -> bool:
+        token = uuid.uuid4().hex
+        lease = {
+            'owner': self.owner,
+            'token': token,
+            'service': service,
+            'acquired_at': time.time(),
+        }
+        if not self._create_exclusive(lease_path, json.dumps(lease)):
+            return False
+        with self._lock:
+            self._held[book_id] = token
+        return True
+
+    def _create_exclusive(self, path: pathlib.Path, content: str) -> bool:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return True
+
+    def _read(self, lease_path: pathlib.Path) -> Optional[dict]:
+        try:
+            with open(lease_path, 'r', encoding='utf-8') as f:
+                lease = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Still being written by its creator; treat as held with an unknown token
+            return {'owner': None, 'token': 'partial'}
+        return lease
+
+    def _is_expired(self, path: pathlib.Path) -> bool:
+        try:
+            return time.time() - path.stat().st_mtime > self.ttl
+        except FileNotFoundError:
+            return False
+
@@ -0,0 +1,184 @@
+import json
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from core.ComposingJob import ComposingJob
+from common.logger import get_logger
+from common.storage_backend import get_storage_backend
+
+# Priority classes accepted by /api/compose, most urgent first
+PRIORITY_CLASSES = ['high', 'normal', 'low']
+DEFAULT_PRIORITY = 'normal'
+
+# Rank used for jobs that have waited longer than the configured maximum
+AGED_RANK = -1
+
+
+class JobScheduler:
+    """
+    Orders pending composition jobs for dispatch.
+
+    - Priority class first (high, normal, low); jobs that have waited longer than
+      `scheduler_max_wait` seconds are promoted ahead of every class.
+    - Weighted fairness between services within the same class, so free jobs
+      keep moving while paid jobs are queued.
+    - Shortest job first by input bytes within a service.
+    - Books larger than `scheduler_large_job_bytes` go to a separate lane that may
+      only occupy `scheduler_large_job_slots` running slots at once.
+
+    When an `estimator` is given, every newly queued job gets its predicted
+    wall time, which is published with the queue snapshot. With `publish` off
+    the scheduler only orders jobs in memory (used by `main.py --plan`).
+    """
+
+    def __init__(self, storage_root: str, config: dict, weights: Dict[str, int],
+                 estimator: Optional[Callable[[ComposingJob], Optional[float]]] = None, publish: bool = True):
+        self.logger = get_logger()
+        self.storage_root = storage_root
+        self.weights = weights
+        self.large_job_bytes = config['scheduler_large_job_bytes']
+        self.large_job_slots = config['scheduler_large_job_slots']
+        self.max_wait = config['scheduler_max_wait']
+        self.storage = get_storage_backend(storage_root)
+        self.queue_key = config['queue_filename']
+        self.estimator = estimator
+        self.publish = publish
+        self._queue: Dict[Tuple[str, str], ComposingJob] = {}
+        # Weighted fair queueing: each dispatch advances its service by 1/weight
+        self._virtual_time: Dict[str, float] = {service: 0.0 for service in weights}
+        self._last_snapshot_keys: List[Tuple[str, str]] = []
+        self._last_snapshot_at = 0.0
+
+    def update(self, jobs: List[ComposingJob], scanned_book_ids: Optional[Iterable[str]] = None,
+               submitted_at: Optional[Dict[str, float]] = None) -> None:
+        """
+        Merge scan results into the queue.
+
+        Jobs keep their original enqueue time across scans. A newly queued job
+        for a book in `submitted_at` (job tickets) is enqueued from its
+        submission time, so tickets taken together keep their order for aging
+        and between jobs of the same size. Queued jobs for books that were
+        scanned (all books when scanned_book_ids is None) but no longer need
+        composition are dropped.
+        """
+        found = {(job.service, job.book_id): job for job in jobs}
+        scanned = None if scanned_book_ids is None else set(scanned_book_ids) | {job.book_id for job in jobs}
+        for key in list(self._queue):
+            if key not in found and (scanned is None or key[1] in scanned):
+                del self._queue[key]
+        for key, job in found.items():
+            queued = self._queue.get(key)
+            if queued is not None:
+                job.enqueued_at = queued.enqueued_at
+                if queued.input_bytes == job.input_bytes:
+                    job.estimated_seconds = queued.estimated_seconds
+            elif submitted_at and job.book_id in submitted_at:
+                job.enqueued_at = min(job.enqueued_at, submitted_at[job.book_id])
+            if job.estimated_seconds is None and self.estimator is not None:
+                job.estimated_seconds = self._estimate(job)
+            self._queue[key] = job
+        self._write_snapshot()
+
+    def next_job(self, busy_books: Optional[Set[str]] = None, running: Optional[List[ComposingJob]] = None) -> Optional[ComposingJob]:
+        """Pop the next job to dispatch, skipping busy books and a full large-job lane."""
+        busy_books = busy_books or set()
+        large_running = sum(1 for job in running or [] if self.is_large(job))
+        eligible = [
+            job for job in self._queue.values()
+            if job.book_id not in busy_books and not (self.is_large(job) and large_running >= self.large_job_slots)
+        ]
+        if not eligible:
+            return None
+
+        job = self._order(eligible, time.time(), self._virtual_time)[0]
+        self._virtual_time[job.service] = self._virtual_time.get(job.service, 0.0) + 1.0 / self._weight(job.service)
+        del self._queue[(job.service, job.book_id)]
+        self._write_snapshot()
+        return job
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def is_large(self, job: ComposingJob) -> bool:
+        return job.input_bytes > self.large_job_bytes
+
+    def snapshot(self) -> List[dict]:
+        """Return the queue in dispatch order (ignoring busy books and lane limits), with wait times."""
+        now = time.time()
+        ordered = self._order(list(self._queue.values()), now, dict(self._virtual_time))
+        return [
+            {
+                'position': position,
+                'bookId': job.book_id,
+                'service': job.service,
+                'priority': job.priority,
+                'inputBytes': job.input_bytes,
+                'lane': 'large' if self.is_large(job) else 'standard',
+                'waitSeconds': round(now - job.enqueued_at, 1),
+                'estimatedSeconds': job.estimated_seconds,
+            }
+            for position, job in enumerate(ordered, start=1)
+        ]
+
+    def _order(self, jobs: List[ComposingJob], now: float, virtual_time: Dict[str, float]) -> List[ComposingJob]:
+        """
+        Order jobs by rank, then interleave services by weighted fair queueing,
+        taking each service's jobs smallest first. Idle services are caught up in
+        `virtual_time` so they cannot bank credit while they had nothing queued.
+        """
+        by_rank: Dict[int, Dict[str, List[ComposingJob]]] = {}
+        for job in jobs:
+            by_rank.setdefault(self._rank(job, now), {}).setdefault(job.service, []).append(job)
+
+        ordered: List[ComposingJob] = []
+        simulated = dict(virtual_time)
+        for rank in sorted(by_rank):
+            per_service = {
+                service: sorted(service_jobs, key=lambda j: (j.input_bytes, j.enqueued_at), reverse=True)
+                for service, service_jobs in by_rank[rank].items()
+            }
+            while per_service:
+                floor = min(simulated.get(service, 0.0) for service in per_service)
+                for service in list(simulated):
+                    if service not in per_service:
+                        simulated[service] = max(simulated[service], floor)
+                        if not ordered:
+                            virtual_time[service] = simulated[service]
+                service = min(per_service, key=lambda s: (simulated.get(s, 0.0), -self._weight(s)))
+                ordered.append(per_service[service].pop())
+                simulated[service] = simulated.get(service, 0.0) + 1.0 / self._weight(service)
+                if not per_service[service]:
+                    del per_service[service]
+        return ordered
+
+    def _estimate(self, job: ComposingJob) -> Optional[float]:
+        try:
+            return self.estimator(job)
+        except Exception as e:
+            self.logger.error(f"Error estimating {job.book_id}: {str(e)}", job.book_id, error=e)
+            return None
+
+    def _weight(self, service: str) -> int:
+        return max(1, self.weights.get(service, 1))
+
+    def _rank(self, job: ComposingJob, now: float) -> int:
+        if now - job.enqueued_at >= self.max_wait:
+            return AGED_RANK
+        if job.priority in PRIORITY_CLASSES:
+            return PRIORITY_CLASSES.index(job.priority)
+        return PRIORITY_CLASSES.index(DEFAULT_PRIORITY)
+
+    def _write_snapshot(self) -> None:
+        """Publish the queue for /api/queue when it changed, or every 30s to refresh wait times."""
+        if not self.publish:
+            return
+        keys = sorted(self._queue)
+        if keys == self._last_snapshot_keys and time.monotonic() - self._last_snapshot_at < 30:
+            return
+        self._last_snapshot_keys = keys
+        self._last_snapshot_at = time.monotonic()
+        try:
+            snapshot = {'updated_at': time.time(), 'jobs': self.snapshot()}
+            self.storage.write_bytes(self.queue_key, json.dumps(snapshot, indent=2, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            self.logger.error(f"Error writing queue snapshot: {str(e)}", error=e)
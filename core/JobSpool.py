@@ -0,0 +1,64 @@
+import json
+import time
+from typing import List, Tuple
+
+from common.logger import get_logger
+from common.storage_backend import get_storage_backend
+
+
+def write_ticket(storage_root: str, spool_dirname: str, book_id: str, **fields) -> str:
+    """
+    Drop a ticket for a book into the storage root's spool directory.
+
+    The ticket is written atomically (under a temporary name renamed into place
+    on a local root), so the worker never sees a partial ticket. Names start
+    with the submission time in nanoseconds, so listing order is submission order.
+    """
+    ticket = {'bookId': book_id, 'submitted_at': time.time()}
+    ticket.update(fields)
+    key = f"{spool_dirname}/{time.time_ns():020d}-{book_id}.json"
+    get_storage_backend(storage_root).write_bytes(key, json.dumps(ticket, ensure_ascii=False).encode('utf-8'))
+    return key
+
+
+class JobSpool:
+    """
+    Consumes the job tickets that producers such as /api/compose drop into the
+    spool directory (`storage/queue/`, or the `queue/` prefix of the storage backend).
+
+    Finding new work only lists the spool, which holds just the tickets not yet
+    taken, so pickup latency does not depend on how many books are in storage.
+    A ticket is removed as soon as it is taken; should the worker stop before
+    queueing the book, the periodic full scan still finds it.
+    """
+
+    def __init__(self, storage_root: str, config: dict):
+        self.logger = get_logger()
+        self.storage = get_storage_backend(storage_root)
+        self.prefix = f"{config['spool_dirname']}/"
+
+    def take(self) -> List[Tuple[str, float]]:
+        """
+        Remove the waiting tickets and return (book id, submission time) for
+        each, in submission order. A book with several tickets is returned once,
+        with its first submission.
+        """
+        keys = sorted(key for key in self.storage.list(self.prefix)
+                      if key.endswith('.json') and not key[len(self.prefix):].startswith('.'))
+        tickets: List[Tuple[str, float]] = []
+        taken = set()
+        for key in keys:
+            try:
+                ticket = json.loads(self.storage.read_bytes(key))
+                book_id = ticket['bookId']
+                submitted_at = float(ticket.get('submitted_at') or time.time())
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.logger.warn(f"Discarding unreadable job ticket {key}: {str(e)}")
+                book_id = None
+            self.storage.delete(key)
+            if book_id and book_id not in taken:
+                taken.add(book_id)
+                tickets.append((book_id, submitted_at))
+        return tickets
@@ -1,14 +1,27 @@
 import json
-import pathlib
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from core.IComposer import IComposer
+from core.ComposerCapabilities import ComposerCapabilities
 from common.logger import get_logger
+from common.storage_layout import book_path
 
 class ParagraphByParagraphComposer(IComposer):
     """
     Composer that combines original and translated content paragraph by paragraph.
     This is a placeholder for future implementation.
     """
+    capabilities = ComposerCapabilities(
+        filenames={
+            'progress_filename': 'composingservice-progress.json',
+            'translated_content_filename': 'translatedcontent.md',
+            'original_content_filename': 'originalbook.md',
+            'translated_json_filename': 'translatedcontent.json',
+            'content_breakdown_filename': 'contentbreakdown.json',
+            'final_epub_filename': 'final.epub',
+        },
+        requires=['translated_content_filename', 'original_content_filename',
+                  'translated_json_filename', 'content_breakdown_filename'],
+    )
     
     def __init__(self, progress_filename: str = "composingservice-progress.json", translated_content_filename: str = "translatedcontent.md", original_content_filename: str = "originalbook.md", translated_json_filename: str = "translatedcontent.json", content_breakdown_filename: str = "contentbreakdown.json", final_epub_filename: str = "final.epub"):
         self.logger = get_logger()
@@ -22,22 +35,8 @@ class ParagraphByParagraphComposer(IComposer):
     def get_name(self) -> str:
         return "paragraph_by_paragraph"
     
-    def can_compose(self, book_id: str, storage_root: str) -> bool:
-        """Check if all required files exist for paragraph-by-paragraph composition."""
-        book_dir = pathlib.Path(storage_root) / book_id
-        
-        required_files = [
-            self.translated_content_filename,
-            self.original_content_filename,
-            self.translated_json_filename,
-            self.content_breakdown_filename
-        ]
-        
-        for filename in required_files:
-            if not (book_dir / filename).exists():
-                return False
-        
-        return True
+    def get_input_filenames(self) -> List[str]:
+        return [self.original_content_filename, self.translated_content_filename, self.translated_json_filename]
     
     def compose(self, book_id: str, storage_root: str, config: Optional[Dict[str, Any]] = None) -> bool:
         """
@@ -79,6 +78,7 @@ class ParagraphByParagraphComposer(IComposer):
             progress = self.get_progress(book_id, storage_root)
             progress['status'] = 'error'
             progress['error'] = str(e)
+            progress['error_type'] = type(e).__name__
             progress['error_at'] = self._get_timestamp()
             self.save_progress(book_id, storage_root, progress)
             
@@ -86,7 +86,7 @@ class ParagraphByParagraphComposer(IComposer):
     
     def get_progress(self, book_id: str, storage_root: str) -> Dict[str, Any]:
         """Get progress for the given book."""
-        progress_path = pathlib.Path(storage_root) / book_id / self.progress_filename
+        progress_path = book_path(storage_root, book_id) / self.progress_filename
         
         if progress_path.exists():
             try:
@@ -106,7 +106,7 @@ class ParagraphByParagraphComposer(IComposer):
     def save_progress(self, book_id: str, storage_root: str, progress: Dict[str, Any]) -> None:
         """Save progress for the given book."""
         try:
-            book_dir = pathlib.Path(storage_root) / book_id
+            book_dir = book_path(storage_root, book_id)
             book_dir.mkdir(parents=True, exist_ok=True)
             
             progress_path = book_dir / self.progress_filename
@@ -0,0 +1,133 @@
+import random
+from datetime import datetime, timedelta
+from typing import Optional
+
+from core.JobIsolation import OUTCOME_CRASHED, OUTCOME_FAILURE
+
+# Progress statuses owned by the retry policy
+RETRY_SCHEDULED = 'retry_scheduled'
+DEAD_LETTER = 'dead_letter'
+
+# Dead-letter reason of books left in 'error' by composers that did not record an error type
+LEGACY_ERROR = 'legacy_error'
+
+# Status the composers record for a failed composition. The worker replaces it
+# through this policy, but books that failed before the policy existed kept it
+FAILED = 'error'
+
+# Exception types (recorded by the composers as error_type) that usually clear up
+# on their own: storage hiccups on EFS/NFS and inputs read while still being written
+RETRYABLE_ERROR_TYPES = {
+    'OSError',
+    'IOError',
+    'FileNotFoundError',
+    'PermissionError',
+    'BlockingIOError',
+    'InterruptedError',
+    'BrokenPipeError',
+    'ConnectionError',
+    'ConnectionResetError',
+    'TimeoutError',
+    'UnicodeDecodeError',
+}
+
+
+class RetryPolicy:
+    """
+    Decides what happens to a book after a failed composition.
+
+    - Retryable failures (crashed processes, storage errors, half-written inputs,
+      or a composer giving up without recording an exception) are retried after
+      an exponential backoff with jitter, up to `retry_max_attempts` attempts.
+    - Permanent failures (timeout, oom, any other exception) and failures that
+      ran out of attempts move the book to the dead-letter state, where it stays
+      until it is resubmitted through /api/compose.
+
+    A book still in the plain 'error' status is treated as one more failure
+    of its recorded error type, so books that failed before attempts were
+    counted are retried or given up on like new ones. Without an error type
+    (composers before the policy did not record one) the failure cannot be
+    classified and the book counts as dead-lettered (reason legacy_error), as
+    it was never retried before; retrying all of them at once on upgrade
+    would recompose every book that ever failed, bad inputs included.
+
+    Progress keys are read and written with a prefix so the paid ('') and free
+    ('free_') services keep separate attempt counts in the shared progress file.
+    """
+
+    def __init__(self, config: dict):
+        self.max_attempts = config['retry_max_attempts']
+        self.base_delay = config['retry_base_delay']
+        self.max_delay = config['retry_max_delay']
+
+    def is_retryable(self, outcome: str, error_type: Optional[str]) -> bool:
+        if outcome == OUTCOME_CRASHED:
+            return True
+        if outcome != OUTCOME_FAILURE:
+            # timeout and oom would fail the same way again
+            return False
+        return error_type is None or error_type in RETRYABLE_ERROR_TYPES
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait before the next attempt, after `attempts` failed attempts."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        # Equal jitter: keep half the delay so retries still back off, spread the
+        # other half so books that failed together do not all retry together
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def record_failure(self, progress: dict, outcome: str, prefix: str = '') -> str:
+        """Count a failed attempt in `progress` and schedule a retry or dead-letter it. Returns the new status."""
+        attempts = progress.get(f'{prefix}attempts', 0) + 1
+        progress[f'{prefix}attempts'] = attempts
+        retryable = self.is_retryable(outcome, progress.get(f'{prefix}error_type'))
+        if retryable and attempts < self.max_attempts:
+            retry_at = datetime.now() + timedelta(seconds=self.backoff(attempts))
+            progress[f'{prefix}status'] = RETRY_SCHEDULED
+            progress[f'{prefix}next_retry_at'] = retry_at.isoformat()
+        else:
+            progress[f'{prefix}status'] = DEAD_LETTER
+            progress[f'{prefix}dead_letter_reason'] = 'max_attempts' if retryable else (
+                outcome if outcome != OUTCOME_FAILURE else 'permanent_error')
+            progress[f'{prefix}dead_lettered_at'] = datetime.now().isoformat()
+            progress.pop(f'{prefix}next_retry_at', None)
+        return progress[f'{prefix}status']
+
+    def retry_at(self, progress: dict, prefix: str = '') -> Optional[datetime]:
+        """
+        When a scheduled retry becomes due, or None if no retry is scheduled. A
+        book left in 'error' that gave_up() does not rule out is due the base
+        delay after its error (right away if the error has no time).
+        """
+        status = progress.get(f'{prefix}status')
+        if status == FAILED:
+            try:
+                return datetime.fromisoformat(progress[f'{prefix}error_at']) + timedelta(seconds=self.base_delay)
+            except (KeyError, TypeError, ValueError):
+                return None
+        if status != RETRY_SCHEDULED:
+            return None
+        try:
+            return datetime.fromisoformat(progress[f'{prefix}next_retry_at'])
+        except (KeyError, TypeError, ValueError):
+            return datetime.now()
+
+    def gave_up(self, progress: dict, prefix: str = '') -> bool:
+        """True for a dead-lettered book, and for one left in 'error' by a failure that would not be retried."""
+        status = progress.get(f'{prefix}status')
+        if status == DEAD_LETTER:
+            return True
+        if status != FAILED:
+            return False
+        if self.dead_letter_reason(progress, prefix) == LEGACY_ERROR:
+            return True
+        attempts = progress.get(f'{prefix}attempts', 0) + 1
+        return not (self.is_retryable(OUTCOME_FAILURE, progress.get(f'{prefix}error_type')) and attempts < self.max_attempts)
+
+    def dead_letter_reason(self, progress: dict, prefix: str = '') -> Optional[str]:
+        """Why a book was given up on: its recorded reason, legacy_error for an unclassifiable 'error', else None."""
+        status = progress.get(f'{prefix}status')
+        if status == DEAD_LETTER:
+            return progress.get(f'{prefix}dead_letter_reason')
+        if status == FAILED and not progress.get(f'{prefix}error_type'):
+            return LEGACY_ERROR
+        return None
@@ -0,0 +1,114 @@
+import errno
+import os
+import pathlib
+from typing import Dict, Optional
+
+from common.logger import get_logger
+from common.storage_layout import get_storage_layout, iter_flat_book_dirs, sharded_book_path
+from core.JobLease import JobLeaseManager
+
+# Service name under which the migration holds a book's lease while moving it
+MIGRATION_SERVICE = 'storage-migration'
+
+# Log progress every this many books
+PROGRESS_EVERY = 1000
+
+
+class StorageMigration:
+    """
+    Moves the flat book folders of a storage root into the sharded layout while
+    the workers and the API keep serving it.
+
+    Run it once every worker and API instance of the root has STORAGE_LAYOUT=sharded:
+    from then on new books get sharded folders, and books that are still flat are
+    found where they are. Each book is moved with a single rename while the
+    migration holds its lease, so a worker never composes a book that is being
+    moved, and a book that is being composed is left for a later pass. Files
+    written to the old path by a client that looked the book up just before the
+    move are merged into the sharded folder on the next pass.
+    """
+
+    def __init__(self, storage_root: str, config: dict):
+        self.logger = get_logger(storage_root)
+        self.storage_root = storage_root
+        self.leases = JobLeaseManager(storage_root, config, owner=f"{config['node_id']}:{os.getpid()}:migration")
+
+    def run(self, max_passes: int = 3) -> Dict[str, int]:
+        """
+        Move every flat book folder, repeating the pass while books were skipped
+        as busy or written to during the move. Returns counts of what was done.
+        """
+        if get_storage_layout() != 'sharded':
+            raise ValueError("STORAGE_LAYOUT must be 'sharded' for the storage root before its folders are migrated")
+        counts = {'moved': 0, 'merged': 0, 'busy': 0, 'failed': 0}
+        for _ in range(max_passes):
+            counts['busy'] = counts['failed'] = 0
+            pass_counts = self._run_pass()
+            for key, value in pass_counts.items():
+                counts[key] += value
+            if not (pass_counts['busy'] or pass_counts['merged']):
+                break
+        return counts
+
+    def migrate_book(self, book_dir: pathlib.Path) -> Optional[str]:
+        """Move one flat book folder into its shard: 'moved', 'merged', 'busy' or 'failed' (None if it is gone)."""
+        book_id = book_dir.name
+        if not self.leases.claim(book_id, MIGRATION_SERVICE):
+            return 'busy'
+        target = sharded_book_path(self.storage_root, book_id)
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.rename(book_dir, target)
+                return 'moved'
+            except FileNotFoundError:
+                return None
+            except OSError as e:
+                if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                    raise
+            # The sharded folder exists already: an earlier pass moved the book and a
+            # late writer re-created the flat folder, so merge what it wrote
+            _merge_folder(book_dir, target)
+            return 'merged'
+        except OSError as e:
+            self.logger.error(f"Error moving {book_dir} to {target}: {str(e)}", error=e)
+            return 'failed'
+        finally:
+            self.leases.release(book_id)
+
+    def _run_pass(self) -> Dict[str, int]:
+        counts = {'moved': 0, 'merged': 0, 'busy': 0, 'failed': 0}
+        seen = 0
+        for book_dir in iter_flat_book_dirs(self.storage_root, 'sharded'):
+            result = self.migrate_book(book_dir)
+            if result is not None:
+                counts[result] += 1
+            seen += 1
+            if seen % PROGRESS_EVERY == 0:
+                self.logger.info(f"Storage migration of {self.storage_root}: {seen} folder(s) processed, "
+                                 f"{counts['moved']} moved, {counts['busy']} busy")
+        return counts
+
+
+def _merge_folder(source: pathlib.Path, target: pathlib.Path) -> None:
+    """Move the entries of `source` into `target`, keeping the newer file where both have one, then remove `source`."""
+    with os.scandir(source) as entries:
+        names = [entry.name for entry in entries]
+    for name in names:
+        source_path, target_path = source / name, target / name
+        if source_path.is_dir() and not source_path.is_symlink():
+            target_path.mkdir(exist_ok=True)
+            _merge_folder(source_path, target_path)
+            continue
+        try:
+            if target_path.exists() and target_path.stat().st_mtime >= source_path.stat().st_mtime:
+                source_path.unlink()
+            else:
+                os.replace(source_path, target_path)
+        except FileNotFoundError:
+            pass
+    try:
+        source.rmdir()
+    except OSError:
+        # Still being written to; the next pass picks up the rest
+        pass
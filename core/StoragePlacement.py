@@ -0,0 +1,98 @@
+import hashlib
+import json
+import pathlib
+import shutil
+import threading
+from typing import List, Optional
+
+from common.logger import get_logger
+from common.storage_backend import get_storage_backend
+from common.storage_layout import book_path
+
+# Placement policies for new jobs, selected by STORAGE_PLACEMENT
+PLACEMENT_POLICIES = ['most_free', 'least_loaded', 'round_robin', 'hash']
+
+
+class StoragePlacement:
+    """
+    Maps books to the storage roots of a multi-root deployment.
+
+    An existing book stays on the root whose folder holds it. A new book is
+    placed by the `storage_placement` policy, scaled by each root's weight
+    (roots with weight 0 take no new jobs):
+
+    - most_free: the root with the most free space
+    - least_loaded: the root with the fewest queued and running jobs per
+      composition slot, from the scaling signal its worker publishes
+    - round_robin: roots in turn
+    - hash: a stable root per book id
+    """
+
+    def __init__(self, roots: List[dict], config: dict):
+        self.logger = get_logger()
+        self.roots = roots
+        self.scaling_filename = config['scaling_filename']
+        self.policy = config['storage_placement']
+        if self.policy not in PLACEMENT_POLICIES:
+            self.logger.warn(f"Unknown storage placement '{self.policy}', using most_free")
+            self.policy = 'most_free'
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def find_book_root(self, book_id: str) -> Optional[str]:
+        """The storage root holding an existing book, or None if no root holds it."""
+        for root in self.roots:
+            if get_storage_backend(root['path']).book_exists(book_id):
+                return root['path']
+        return None
+
+    def find_book_dir(self, book_id: str) -> Optional[pathlib.Path]:
+        """The folder of an existing book, or None if no root holds it."""
+        for root in self.roots:
+            book_dir = book_path(root['path'], book_id)
+            if book_dir.is_dir():
+                return book_dir
+        return None
+
+    def book_dir(self, book_id: str) -> pathlib.Path:
+        """The folder of a book: where it already is, or where a new one is placed."""
+        return self.find_book_dir(book_id) or book_path(self.place(book_id), book_id)
+
+    def place(self, book_id: str) -> str:
+        """Choose the storage root for a new book."""
+        # With every weight at 0, place on all roots equally rather than on none
+        candidates = [root for root in self.roots if root['weight'] > 0] or [dict(root, weight=1) for root in self.roots]
+        if len(candidates) == 1:
+            return candidates[0]['path']
+        if self.policy == 'hash':
+            return self._weighted(candidates, int(hashlib.sha1(book_id.encode('utf-8')).hexdigest(), 16))['path']
+        if self.policy == 'round_robin':
+            with self._lock:
+                self._next += 1
+                return self._weighted(candidates, self._next - 1)['path']
+        if self.policy == 'least_loaded':
+            return min(candidates, key=lambda root: self._load(root) / root['weight'])['path']
+        return max(candidates, key=lambda root: self._free_bytes(root) * root['weight'])['path']
+
+    def _weighted(self, roots: List[dict], n: int) -> dict:
+        """The n-th slot of a cycle in which each root appears `weight` times."""
+        n %= sum(root['weight'] for root in roots)
+        for root in roots:
+            if n < root['weight']:
+                return root
+            n -= root['weight']
+        return roots[-1]
+
+    def _free_bytes(self, root: dict) -> int:
+        try:
+            return shutil.disk_usage(root['path']).free
+        except OSError as e:
+            self.logger.warn(f"Cannot read free space of {root['path']}: {str(e)}")
+            return 0
+
+    def _load(self, root: dict) -> float:
+        try:
+            signal = json.loads(get_storage_backend(root['path']).read_bytes(self.scaling_filename))
+        except (OSError, ValueError):
+            return 0.0
+        return (signal.get('queued', 0) + signal.get('running', 0)) / max(1, signal.get('concurrency') or 1)
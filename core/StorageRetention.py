@@ -0,0 +1,359 @@
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from common.compression import COMPRESSION_CODECS, compress_file, logical_name
+from common.logger import get_logger
+from common.storage_backend import get_storage_backend
+from common.storage_layout import NON_BOOK_DIRS, iter_book_dirs
+from core.JobLease import JobLeaseManager
+
+# Service name under which the retention manager holds a book's lease while it changes the book
+RETENTION_SERVICE = 'storage-retention'
+
+# Prefix of the API's upload folders in the system temp directory, followed by the API's pid
+UPLOAD_DIR_PREFIX = 'dc-epub-composer-upload-'
+
+# Progress statuses after which a book is not composed again unless it is resubmitted
+SETTLED_STATUSES = ['completed', 'error', 'cancelled', 'dead_letter', 'timeout', 'oom']
+
+# Free composition statuses of a book that is still queued or being composed
+ACTIVE_FREE_STATUSES = ['pending', 'processing', 'retry_scheduled', 'partial']
+
+# Text artifacts that are compressed once their book has gone cold
+COMPRESSIBLE_SUFFIXES = ('.md', '.log')
+
+# Files smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 4096
+
+# Outputs next to which an interim EPUB is obsolete
+FINAL_EPUB_FILENAMES = ['final.epub', 'dual-language-final.epub', 'free-final.epub']
+
+DAY = 24 * 60 * 60
+HOUR = 60 * 60
+
+
+class _BookUsage:
+    __slots__ = ('book_dir', 'files', 'size', 'last_modified')
+
+    def __init__(self, book_dir: pathlib.Path, files: Dict[str, os.stat_result], size: int, last_modified: float):
+        self.book_dir = book_dir
+        self.files = files
+        self.size = size
+        self.last_modified = last_modified
+
+
+class StorageRetention:
+    """
+    Keeps a storage root from growing without bound once its books are done.
+
+    A pass walks every book folder once. In books that are settled (composed,
+    failed for good or cancelled) and untouched for a while it:
+
+    - compresses the markdown inputs, the combined markdown and the book logs
+      (RETENTION_COMPRESS_AFTER_DAYS, with RETENTION_COMPRESSION). Composers and
+      the scans read the compressed files as if they were plain (see
+      common/compression.py), so such a book can still be composed again.
+    - removes intermediate artifacts: the prepared original and rendered
+      sections caches, and an interim EPUB once the final one exists
+      (RETENTION_ARTIFACT_MAX_AGE_DAYS).
+    - removes the whole book folder after RETENTION_BOOK_MAX_AGE_DAYS, and the
+      oldest settled books while the root holds more than RETENTION_MAX_STORAGE_GB.
+
+    Each book is changed only while the manager holds its lease, so a book that
+    is being composed is left for a later pass. Orphaned temporary files (from
+    writers that died between writing and renaming) and upload folders of API
+    processes that are gone are removed after RETENTION_TEMP_MAX_AGE_HOURS, as
+    are uploaded blobs that no book links to any more.
+
+    Every pass returns a report of what it reclaimed, which is also written to
+    `retention_report_filename` in the storage root.
+    """
+
+    def __init__(self, storage_root: str, config: dict):
+        self.logger = get_logger(storage_root)
+        self.storage_root = storage_root
+        self.config = config
+        self.storage = get_storage_backend(storage_root)
+        self.codec = config['retention_compression']
+        if self.codec not in COMPRESSION_CODECS:
+            raise ValueError(f"Unknown RETENTION_COMPRESSION '{self.codec}', expected one of {', '.join(COMPRESSION_CODECS)}")
+        self.leases = JobLeaseManager(storage_root, config, owner=f"{config['node_id']}:{os.getpid()}:retention")
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def run(self) -> dict:
+        """Run one retention pass over the storage root and return its report."""
+        now = time.time()
+        report = {
+            'started_at': datetime.now().isoformat(),
+            'books': 0,
+            'busy': 0,
+            'compressed': {'files': 0, 'bytes': 0},
+            'artifacts': {'files': 0, 'bytes': 0},
+            'evicted': {'books': 0, 'bytes': 0},
+            'temp': {'files': 0, 'bytes': 0},
+            'blobs': {'files': 0, 'bytes': 0},
+        }
+        storage_bytes = 0
+        # (last modified, book id, usage) of settled books, candidates for size-based eviction
+        settled: List[Tuple[float, str, _BookUsage]] = []
+        self._sweep_temp(pathlib.Path(self.storage_root), now, report)
+        for name in NON_BOOK_DIRS:
+            self._sweep_temp(pathlib.Path(self.storage_root) / name, now, report)
+        self._sweep_upload_dirs(now, report)
+        # Books of a remote STORAGE_BACKEND are only a working copy here; the bucket's lifecycle rules apply to them
+        manage_books = self.storage.is_local()
+        for book_dir in iter_book_dirs(self.storage_root):
+            if self._stop.is_set():
+                break
+            usage = self._scan_book(book_dir, now, report)
+            if usage is None:
+                continue
+            report['books'] += 1
+            if manage_books and self._is_settled(usage):
+                usage = self._apply_to_book(usage, now, report)
+                if usage is None:
+                    continue
+                settled.append((usage.last_modified, book_dir.name, usage))
+            storage_bytes += usage.size
+        if manage_books:
+            storage_bytes -= self._evict_for_size(settled, storage_bytes, report)
+            self._sweep_blobs(now, report)
+        report['reclaimed_bytes'] = sum(report[key]['bytes'] for key in ('compressed', 'artifacts', 'evicted', 'temp', 'blobs'))
+        report['storage_bytes'] = storage_bytes
+        report['finished_at'] = datetime.now().isoformat()
+        try:
+            self.storage.write_bytes(self.config['retention_report_filename'], json.dumps(report, indent=2).encode('utf-8'))
+        except Exception as e:
+            self.logger.warn(f"Error writing retention report: {str(e)}")
+        self.logger.info(f"Retention pass over {self.storage_root}: {report['books']} book(s), "
+                         f"{report['reclaimed_bytes']} bytes reclaimed ({report['compressed']['files']} file(s) compressed, "
+                         f"{report['artifacts']['files']} artifact(s) and {report['evicted']['books']} book(s) removed, "
+                         f"{report['temp']['files']} temp file(s) and {report['blobs']['files']} unreferenced blob(s)), "
+                         f"{report['busy']} busy")
+        return report
+
+    def start(self, interval: float) -> None:
+        """Run a retention pass every `interval` seconds from a background thread until stop() is called."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.run()
+                except Exception as e:
+                    self.logger.error(f"Error in retention pass: {str(e)}", error=e)
+
+        self._thread = threading.Thread(target=loop, name="storage-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background passes; a pass in progress stops after its current book."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _scan_book(self, book_dir: pathlib.Path, now: float, report: dict) -> Optional[_BookUsage]:
+        """Stat the files of a book folder once, removing orphaned temporary files on the way."""
+        files: Dict[str, os.stat_result] = {}
+        size = 0
+        last_modified = 0.0
+        for path in _iter_files(book_dir):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            name = path.relative_to(book_dir).as_posix()
+            if _is_temp_file(path.name):
+                if now - st.st_mtime > self.config['retention_temp_max_age_hours'] * HOUR:
+                    _remove(path, st.st_size, report['temp'])
+                continue
+            files[name] = st
+            size += st.st_size
+            if not path.name.startswith(self.config['lease_filename']):
+                last_modified = max(last_modified, st.st_mtime)
+        if not files and not book_dir.is_dir():
+            return None
+        return _BookUsage(book_dir, files, size, last_modified)
+
+    def _is_settled(self, usage: _BookUsage) -> bool:
+        progress_filename = self.config['progress_filename']
+        if progress_filename not in usage.files:
+            return False
+        try:
+            with open(usage.book_dir / progress_filename, 'r', encoding='utf-8') as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return progress.get('status') in SETTLED_STATUSES and progress.get('free_status') not in ACTIVE_FREE_STATUSES
+
+    def _apply_to_book(self, usage: _BookUsage, now: float, report: dict) -> Optional[_BookUsage]:
+        """Compress and evict what the policies allow in one settled book. Returns its usage afterwards, None if it is gone."""
+        idle = now - usage.last_modified
+        book_max_age = self.config['retention_book_max_age_days'] * DAY
+        evict_book = book_max_age > 0 and idle > book_max_age
+        artifacts = self._obsolete_artifacts(usage) if idle > self.config['retention_artifact_max_age_days'] * DAY else []
+        compress_after = self.config['retention_compress_after_days'] * DAY
+        to_compress = [name for name, st in usage.files.items()
+                       if compress_after > 0 and idle > compress_after and name.endswith(COMPRESSIBLE_SUFFIXES)
+                       and logical_name(name) == name and st.st_size >= MIN_COMPRESS_BYTES]
+        if not (evict_book or artifacts or to_compress):
+            return usage
+
+        book_id = usage.book_dir.name
+        if not self.leases.claim(book_id, RETENTION_SERVICE):
+            report['busy'] += 1
+            return usage
+        try:
+            if evict_book:
+                self._evict_book(usage, report)
+                return None
+            for name in artifacts:
+                _remove(usage.book_dir / name, usage.files[name].st_size, report['artifacts'])
+                usage.size -= usage.files.pop(name).st_size
+            for name in to_compress:
+                before = usage.files[name].st_size
+                try:
+                    after = compress_file(usage.book_dir / name, self.codec)
+                except FileNotFoundError:
+                    continue
+                except Exception as e:
+                    self.logger.error(f"Error compressing {usage.book_dir / name}: {str(e)}", book_id, error=e)
+                    continue
+                report['compressed']['files'] += 1
+                report['compressed']['bytes'] += max(0, before - after)
+                usage.size -= max(0, before - after)
+            return usage
+        finally:
+            self.leases.release(book_id)
+
+    def _obsolete_artifacts(self, usage: _BookUsage) -> List[str]:
+        """Caches and intermediate files the book no longer needs."""
+        artifacts = [name for name in (self.config['prepared_original_filename'], self.config['rendered_sections_filename'])
+                     if name in usage.files]
+        interim = self.config['interim_epub_filename']
+        if interim in usage.files and any(name in usage.files for name in FINAL_EPUB_FILENAMES):
+            artifacts.append(interim)
+        return artifacts
+
+    def _evict_for_size(self, settled: List[Tuple[float, str, _BookUsage]], storage_bytes: int, report: dict) -> int:
+        """Remove the least recently modified settled books until the root is within RETENTION_MAX_STORAGE_GB."""
+        limit = int(self.config['retention_max_storage_gb'] * 1024 ** 3)
+        reclaimed = 0
+        if limit <= 0 or storage_bytes <= limit:
+            return reclaimed
+        for _, book_id, usage in sorted(settled, key=lambda item: item[0]):
+            if storage_bytes - reclaimed <= limit or self._stop.is_set():
+                break
+            if not self.leases.claim(book_id, RETENTION_SERVICE):
+                report['busy'] += 1
+                continue
+            try:
+                reclaimed += self._evict_book(usage, report)
+            finally:
+                self.leases.release(book_id)
+        return reclaimed
+
+    def _evict_book(self, usage: _BookUsage, report: dict) -> int:
+        book_id = usage.book_dir.name
+        try:
+            shutil.rmtree(usage.book_dir)
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            self.logger.error(f"Error removing book folder {usage.book_dir}: {str(e)}", error=e)
+            return 0
+        self.logger.info(f"Removed book {book_id} ({usage.size} bytes) under the retention policy")
+        report['evicted']['books'] += 1
+        report['evicted']['bytes'] += usage.size
+        return usage.size
+
+    def _sweep_temp(self, folder: pathlib.Path, now: float, report: dict) -> None:
+        """Remove orphaned temporary files directly in a folder."""
+        max_age = self.config['retention_temp_max_age_hours'] * HOUR
+        try:
+            with os.scandir(folder) as entries:
+                candidates = [entry for entry in entries if _is_temp_file(entry.name) and entry.is_file()]
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for entry in candidates:
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime > max_age:
+                _remove(pathlib.Path(entry.path), st.st_size, report['temp'])
+
+    def _sweep_blobs(self, now: float, report: dict) -> None:
+        """Remove uploaded blobs (see core/BlobStore.py) that no book folder links to any more."""
+        max_age = self.config['retention_temp_max_age_hours'] * HOUR
+        for path in _iter_files(pathlib.Path(self.storage_root) / self.config['blob_dirname']):
+            if self._stop.is_set():
+                return
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            # The age guard keeps a blob an upload has just stored but not linked yet
+            if st.st_nlink == 1 and now - st.st_mtime > max_age and not _is_temp_file(path.name):
+                _remove(path, st.st_size, report['blobs'])
+
+    def _sweep_upload_dirs(self, now: float, report: dict) -> None:
+        """Remove upload folders left in the system temp directory by API processes that are gone."""
+        max_age = self.config['retention_temp_max_age_hours'] * HOUR
+        try:
+            with os.scandir(tempfile.gettempdir()) as entries:
+                candidates = [entry for entry in entries if entry.name.startswith(UPLOAD_DIR_PREFIX) and entry.is_dir()]
+        except OSError:
+            return
+        for entry in candidates:
+            pid = entry.name[len(UPLOAD_DIR_PREFIX):].split('-', 1)[0]
+            try:
+                if now - entry.stat().st_mtime <= max_age or (pid.isdigit() and _is_running(int(pid))):
+                    continue
+                sizes = [path.stat().st_size for path in _iter_files(pathlib.Path(entry.path))]
+                shutil.rmtree(entry.path)
+            except OSError:
+                continue
+            report['temp']['files'] += len(sizes)
+            report['temp']['bytes'] += sum(sizes)
+
+
+def _iter_files(folder: pathlib.Path):
+    for dirpath, _, filenames in os.walk(folder):
+        for name in filenames:
+            yield pathlib.Path(dirpath) / name
+
+
+def _is_temp_file(name: str) -> bool:
+    """Files written under a temporary name and renamed into place: `.{name}.{pid}[.{thread}].tmp`."""
+    return name.startswith('.') and name.endswith('.tmp')
+
+
+def _remove(path: pathlib.Path, size: int, counts: Dict[str, int]) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        return
+    counts['files'] += 1
+    counts['bytes'] += size
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
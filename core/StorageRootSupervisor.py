@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+import signal
+import time
+from typing import Dict, List, Optional
+
+from common.configuration import storage_root_environment
+from common.logger import get_logger
+
+# How long to wait before restarting the worker of a root whose process died
+RESTART_DELAY = 10.0
+
+# How often the supervisor checks on the root workers
+SUPERVISOR_POLL_INTERVAL = 1.0
+
+
+def apply_storage_root(root: dict) -> None:
+    """Configure this process to serve a single storage root, with the root's options applied."""
+    os.environ.pop('STORAGE_ROOTS', None)
+    os.environ.update(storage_root_environment(root))
+
+
+def _serve_storage_root(root: dict) -> None:
+    """Entry point of a root worker process."""
+    apply_storage_root(root)
+    from core.ComposingWorker import ComposingWorker
+    ComposingWorker(root['path']).run()
+
+
+class StorageRootSupervisor:
+    """
+    Serves several storage roots from one deployment by running a worker
+    process per root.
+
+    Each root worker is an ordinary single-root ComposingWorker, so it scans,
+    queues, scales and leases its own root independently, with the root's
+    options (concurrency, scan interval, discovery mode) applied to its
+    configuration. SIGTERM is forwarded to every root worker, which drain as
+    usual; the supervisor exits once they all have. A root worker that dies
+    is restarted after RESTART_DELAY seconds.
+    """
+
+    def __init__(self, roots: List[dict]):
+        self.logger = get_logger()
+        self.roots = roots
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: Dict[str, multiprocessing.Process] = {}
+        self._restart_at: Dict[str, float] = {}
+        self._stopping = False
+
+    def run(self) -> None:
+        for root in self.roots:
+            self._start(root)
+        previous_handler = signal.signal(signal.SIGTERM, self._on_sigterm)
+        try:
+            while self._processes or self._restart_at:
+                time.sleep(SUPERVISOR_POLL_INTERVAL)
+                self._check_processes()
+        except KeyboardInterrupt:
+            # The root workers got the same SIGINT from the terminal
+            self.logger.info("Received interrupt signal. Waiting for storage root workers to stop...")
+            self._stopping = True
+            for process in self._processes.values():
+                process.join()
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+
+    def _start(self, root: dict) -> None:
+        process = self._context.Process(target=_serve_storage_root, args=(root,), name=f"worker-{root['path']}")
+        process.start()
+        self._processes[root['path']] = process
+        self.logger.info(f"Started worker for storage root {root['path']} (pid {process.pid})")
+
+    def _check_processes(self) -> None:
+        now = time.monotonic()
+        for root in self.roots:
+            path = root['path']
+            process = self._processes.get(path)
+            if process is None:
+                restart_at: Optional[float] = self._restart_at.get(path)
+                if restart_at is not None and now >= restart_at and not self._stopping:
+                    del self._restart_at[path]
+                    self._start(root)
+                continue
+            if process.is_alive():
+                continue
+            del self._processes[path]
+            if self._stopping:
+                self.logger.info(f"Worker for storage root {path} stopped")
+            else:
+                self.logger.error(f"Worker for storage root {path} exited with code {process.exitcode}, "
+                                  f"restarting in {RESTART_DELAY:.0f}s")
+                self._restart_at[path] = now + RESTART_DELAY
+        if self._stopping:
+            self._restart_at.clear()
+
+    def _on_sigterm(self, signum, frame) -> None:
+        self.logger.info("SIGTERM received, draining the storage root workers")
+        self._stopping = True
+        for process in self._processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
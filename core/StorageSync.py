@@ -0,0 +1,242 @@
+import json
+import os
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from common.logger import get_logger
+from common.storage_backend import ObjectStat, StorageBackend, get_storage_backend, is_appended_record
+from common.storage_layout import NON_BOOK_DIRS, SHARD_LEVELS, get_storage_layout
+
+# Tolerance when comparing local and object modification times (S3 keeps whole seconds)
+MTIME_SLACK = 1.0
+
+# Folder of the working copy recording, per book, the ETag and local stat of each synced file
+SYNC_STATE_DIR = '.storage-sync'
+
+
+class StorageSync:
+    """
+    Keeps the worker's local working copy of the books (STORAGE_ROOT) in step
+    with a storage backend that is not a local directory, such as S3.
+
+    The worker scans, leases and composes in the working copy exactly as it does
+    on a local root. pull() brings down the objects of books that are new or
+    newer in the backend (inputs, images, progress written by the API, cancel
+    markers) before a scan, and push() uploads what the worker wrote (progress,
+    EPUBs, logs) after a job or a progress change.
+
+    After each transfer the object's ETag and the local file's size and mtime
+    are recorded under SYNC_STATE_DIR, so a file only moves again once one side
+    changes it: an object is pulled when its ETag changed, and a file is pushed
+    when its local stat changed. Modification times alone cannot tell, as S3
+    keeps whole seconds and an input may be replaced at the same size within
+    one. Files without a recorded sync (or on backends without ETags) fall back
+    to comparing modification times and sizes. Leases stay in the working copy,
+    so with several worker nodes the working copy must be shared storage.
+    """
+
+    def __init__(self, backend: StorageBackend, storage_root: str, config: dict):
+        self.logger = get_logger()
+        self.backend = backend
+        self.storage_root = pathlib.Path(storage_root)
+        self.cancel_filename = config['cancel_filename']
+        self.lease_filename = config['lease_filename']
+        self.workers = config['s3_transfer_workers']
+        self.book_depth = SHARD_LEVELS + 1 if get_storage_layout() == 'sharded' else 1
+
+    def pull(self, book_ids: Optional[Iterable[str]] = None) -> int:
+        """Download the books that changed in the backend (all of them, or only `book_ids`). Returns the files fetched."""
+        if book_ids is None:
+            books = self._group_by_book(self.backend.list(''))
+        else:
+            books = {}
+            for book_id in book_ids:
+                book_key = self.backend.book_key(book_id)
+                books[book_key] = {key[len(book_key) + 1:]: stat
+                                   for key, stat in self.backend.list(book_key + '/').items()}
+        transfers = []
+        changed_states = {}
+        for book_key, objects in books.items():
+            state = self._load_state(book_key)
+            planned, adopted = self._plan_pull(book_key, objects, state)
+            if planned or adopted:
+                changed_states[book_key] = state
+            transfers.extend(planned)
+        self._run(transfers)
+        for book_key, state in changed_states.items():
+            self._save_state(book_key, state)
+        return len(transfers)
+
+    def push(self, book_id: str, names: Optional[List[str]] = None) -> int:
+        """Upload the files of a book that are new or newer than their objects (all of them, or only `names`)."""
+        book_key = self.backend.book_key(book_id)
+        book_dir = self.storage_root / book_key
+        remote = {key[len(book_key) + 1:]: stat for key, stat in self.backend.list(book_key + '/').items()}
+        state = self._load_state(book_key)
+        transfers = []
+        for path in _iter_files(book_dir):
+            name = path.relative_to(book_dir).as_posix()
+            if (names is not None and name not in names) or not self._is_pushed(name):
+                continue
+            try:
+                local = path.stat()
+            except FileNotFoundError:
+                continue
+            stat = remote.get(name)
+            synced = state.get(name)
+            if stat is None:
+                changed = True
+            elif stat.etag is not None and synced is not None:
+                # Pushed if changed here, unless the object also changed since and is newer
+                changed = _local_changed(local, synced) and (stat.etag == synced['etag'] or local.st_mtime >= stat.mtime)
+            else:
+                changed = local.st_mtime > stat.mtime + MTIME_SLACK
+            if changed:
+                transfers.append((self._upload, path, f"{book_key}/{name}", state, name))
+        self._run(transfers)
+        if transfers:
+            self._save_state(book_key, state)
+        return len(transfers)
+
+    def _plan_pull(self, book_key: str, objects: Dict[str, ObjectStat], state: Dict[str, dict]) -> Tuple[List[tuple], bool]:
+        """
+        The downloads a book needs. Files synced before ETags were recorded, whose
+        mtime is still the object's (set by that transfer), adopt the object's ETag;
+        the second value says whether any did.
+        """
+        book_dir = self.storage_root / book_key
+        transfers = []
+        adopted = False
+        for name, stat in objects.items():
+            if is_appended_record(name):
+                # Records the API appended to a book log stay in the backend (read_appended)
+                continue
+            path = book_dir / name
+            try:
+                local = path.stat()
+            except FileNotFoundError:
+                local = None
+            synced = state.get(name)
+            if local is None:
+                changed = True
+            elif stat.etag is not None and synced is not None:
+                # Pulled if replaced there, unless the local file also changed since and is newer
+                changed = self._is_pulled(name) and stat.etag != synced['etag'] and (
+                    not _local_changed(local, synced) or stat.mtime >= local.st_mtime)
+            else:
+                changed = stat.mtime > local.st_mtime + MTIME_SLACK or (
+                    abs(stat.mtime - local.st_mtime) <= MTIME_SLACK and stat.size != local.st_size and self._is_pulled(name))
+                if not changed and stat.etag is not None and (local.st_mtime, local.st_size) == (stat.mtime, stat.size):
+                    _record(state, name, local, stat.etag)
+                    adopted = True
+            if changed:
+                transfers.append((self._download, f"{book_key}/{name}", path, state, name))
+        # A cancel marker removed through the API (job resubmitted) must not linger here
+        cancel_path = book_dir / self.cancel_filename
+        if self.cancel_filename not in objects and cancel_path.exists():
+            cancel_path.unlink()
+        return transfers, adopted
+
+    def _group_by_book(self, objects: Dict[str, ObjectStat]) -> Dict[str, Dict[str, ObjectStat]]:
+        books: Dict[str, Dict[str, ObjectStat]] = {}
+        for key, stat in objects.items():
+            parts = key.split('/')
+            if len(parts) <= self.book_depth or parts[0] in NON_BOOK_DIRS:
+                continue
+            books.setdefault('/'.join(parts[:self.book_depth]), {})['/'.join(parts[self.book_depth:])] = stat
+        return books
+
+    def _is_pulled(self, name: str) -> bool:
+        return not name.startswith(self.lease_filename)
+
+    def _is_pushed(self, name: str) -> bool:
+        """Leases coordinate the nodes sharing this working copy, and the API owns cancel markers."""
+        return not (name.startswith(self.lease_filename) or name == self.cancel_filename
+                    or pathlib.PurePosixPath(name).name.startswith('.'))
+
+    def _download(self, key: str, path: pathlib.Path, state: Dict[str, dict], name: str) -> None:
+        stat = self.backend.stat(key)
+        if stat is None:
+            return
+        self.backend.download(key, path)
+        os.utime(path, (stat.mtime, stat.mtime))
+        _record(state, name, path.stat(), stat.etag)
+
+    def _upload(self, path: pathlib.Path, key: str, state: Dict[str, dict], name: str) -> None:
+        before = path.stat()
+        self.backend.upload(path, key)
+        stat = self.backend.stat(key)
+        if stat is None:
+            return
+        local = path.stat()
+        if (local.st_size, local.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+            # Written again during the upload: leave it to be pushed next time
+            return
+        os.utime(path, (stat.mtime, stat.mtime))
+        _record(state, name, path.stat(), stat.etag)
+
+    def _state_path(self, book_key: str) -> pathlib.Path:
+        return self.storage_root / SYNC_STATE_DIR / f"{book_key}.json"
+
+    def _load_state(self, book_key: str) -> Dict[str, dict]:
+        try:
+            with open(self._state_path(book_key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, book_key: str, state: Dict[str, dict]) -> None:
+        """Write a book's sync state under a temporary name and rename it into place."""
+        path = self._state_path(book_key)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # Only costs a fallback to modification times for this book
+            self.logger.warn(f"Cannot write sync state {path}: {str(e)}")
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _run(self, transfers: List[tuple]) -> None:
+        """Run the transfers in parallel; each large object is itself transferred in parallel parts."""
+        if not transfers:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(transfers)), thread_name_prefix='storage-sync') as pool:
+            futures = [(pool.submit(transfer, *args), args) for transfer, *args in transfers]
+            for future, args in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.error(f"Error syncing {args[0]} to {args[1]}: {str(e)}", error=e)
+
+
+def _local_changed(local: os.stat_result, synced: dict) -> bool:
+    return (local.st_size, local.st_mtime_ns) != (synced['size'], synced['mtime_ns'])
+
+
+def _record(state: Dict[str, dict], name: str, local: os.stat_result, etag: Optional[str]) -> None:
+    """Remember the object's ETag and the local file's stat right after a transfer."""
+    if etag is None:
+        state.pop(name, None)
+    else:
+        state[name] = {'etag': etag, 'size': local.st_size, 'mtime_ns': local.st_mtime_ns}
+
+
+def _iter_files(folder: pathlib.Path) -> Iterable[pathlib.Path]:
+    for dirpath, _, filenames in os.walk(folder):
+        for name in filenames:
+            yield pathlib.Path(dirpath) / name
+
+
+def create_storage_sync(storage_root: str, config: dict) -> Optional[StorageSync]:
+    """The sync between the working copy and STORAGE_BACKEND, or None when the storage root is the local directory itself."""
+    backend = get_storage_backend(storage_root)
+    if backend.is_local():
+        return None
+    return StorageSync(backend, storage_root, config)
@@ -0,0 +1,340 @@
+"""
+Stages of an EPUB composition, shared by the composers and run through the
+CompositionPipeline:
+
+    read_inputs (io) -> combine (cpu) -> render (cpu) -> read_images (io) -> write_epub (io)
+
+Stage functions are module-level and only pass plain data (strings, bytes and
+lists) in the CompositionTask, so CPU stages can run in another process.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import pathlib
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from markdown import Markdown, markdown
+from ebooklib import epub
+from bs4 import BeautifulSoup
+
+from core.CancellationToken import CancellationToken
+from core.CompositionPipeline import CompositionPipeline, Listener, PipelineStage, STAGE_CPU, STAGE_IO
+from core.original_preparation import load_prepared_original
+from position_based_combiner import PositionBasedCombiner
+from common.compression import open_text, stored_path
+from common.configuration import get_composer_config
+
+HEADING_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5']
+
+# Reference-style link definitions ("[id]: url") can be used from other sections,
+# so documents with any are rendered whole
+REFERENCE_DEFINITION = re.compile(r'^ {0,3}\[[^\]]+\]:\s*\S', re.MULTILINE)
+
+
+class CompositionTask:
+    """Inputs, settings and intermediate results of one book's composition."""
+
+    def __init__(self, book_id: str, book_dir: pathlib.Path, translated_path: pathlib.Path,
+                 output_path: pathlib.Path, title: str, author: str, fallback_chapter_title: str,
+                 original_path: Optional[pathlib.Path] = None, combined_path: Optional[pathlib.Path] = None,
+                 dual_language_titles: bool = False, skip_unreadable_images: bool = False,
+                 progressive_settle_seconds: Optional[int] = None, token: Optional[CancellationToken] = None):
+        self.book_id = book_id
+        self.book_dir = book_dir
+        self.translated_path = translated_path
+        self.output_path = output_path
+        # Used when the content has no H1 to take the title from (dual-language only)
+        self.title = title
+        self.author = author
+        self.fallback_chapter_title = fallback_chapter_title
+        # Set for dual-language composition: combine original and translation first
+        self.original_path = original_path
+        self.combined_path = combined_path
+        # Keep only the first part of "Original / Translation" headings in titles
+        self.dual_language_titles = dual_language_titles
+        self.skip_unreadable_images = skip_unreadable_images
+        # Progressive mode (dual-language only): while the translation has fewer sections
+        # than the original and was written to within this many seconds, compose an
+        # interim EPUB of the sections translated so far
+        self.progressive_settle_seconds = progressive_settle_seconds
+        self.token = token or CancellationToken()
+
+        self.original_content: Optional[str] = None
+        # Sections of the original prepared before the translation arrived (see core/original_preparation.py)
+        self.original_sections: Optional[list] = None
+        self.translated_content: Optional[str] = None
+        self.translation_mtime: Optional[float] = None
+        # Markdown of each combined section, rendered one by one in progressive mode
+        self.sections: Optional[List[str]] = None
+        # Section markdown hash -> HTML from earlier progressive compositions of this book
+        self.rendered_sections: Optional[Dict[str, str]] = None
+        # Percentage of the original's sections that are translated (progressive mode)
+        self.coverage: Optional[float] = None
+        # True when only the sections translated so far were composed, into the interim EPUB
+        self.interim = False
+        self.markdown: Optional[str] = None
+        # (title, file name, xhtml) per chapter, in reading order
+        self.chapters: List[Tuple[str, str, str]] = []
+        # True when the content has no headings and became one untitled chapter
+        self.single_chapter = False
+        # (uid, source path relative to the book folder, file name in the EPUB)
+        self.images: List[Tuple[str, str, str]] = []
+        self.image_data: Dict[str, bytes] = {}
+        # Messages for the composer to log; stages may run in another process
+        self.warnings: List[str] = []
+
+
+def read_inputs(task: CompositionTask) -> CompositionTask:
+    config = get_composer_config()
+    if task.original_path is not None:
+        with open_text(task.original_path) as f:
+            task.original_content = f.read()
+        task.original_sections = load_prepared_original(task.book_dir, config['prepared_original_filename'],
+                                                        task.original_content)
+    # Inputs of a book composed again after the retention manager compressed them are read transparently
+    task.translation_mtime = os.stat(stored_path(task.translated_path) or task.translated_path).st_mtime
+    with open_text(task.translated_path) as f:
+        task.translated_content = f.read()
+    if task.progressive_settle_seconds is not None and task.original_path is not None:
+        try:
+            with open(task.book_dir / config['rendered_sections_filename'], 'r', encoding='utf-8') as f:
+                task.rendered_sections = json.load(f)
+        except (OSError, ValueError):
+            task.rendered_sections = {}
+    return task
+
+
+def combine(task: CompositionTask) -> CompositionTask:
+    if task.original_content is None:
+        task.markdown = task.translated_content
+    elif task.progressive_settle_seconds is None:
+        task.markdown = PositionBasedCombiner().combine_by_position(task.original_content, task.translated_content, task.token,
+                                                                    task.original_sections)
+    else:
+        combiner = PositionBasedCombiner()
+        original_sections = task.original_sections or combiner.prepare_document(task.original_content)
+        translated_sections = combiner.prepare_document(task.translated_content)
+        settled = time.time() - task.translation_mtime >= task.progressive_settle_seconds
+        if len(translated_sections) < len(original_sections) and not settled:
+            # Still being written: the last section may be cut short, so leave it for next time
+            translated_sections = translated_sections[:-1]
+            task.interim = True
+            task.output_path = task.book_dir / get_composer_config()['interim_epub_filename']
+            task.combined_path = None
+        if original_sections:
+            task.coverage = round(min(100.0, 100 * len(translated_sections) / len(original_sections)), 1)
+        if task.interim:
+            original_sections = original_sections[:len(translated_sections)]
+        if translated_sections or not task.interim:
+            task.sections = combiner.combine_sections(original_sections, translated_sections, task.token)
+            task.markdown = '\n'.join(task.sections)
+    task.original_content = task.translated_content = task.original_sections = None
+    return task
+
+
+def render(task: CompositionTask) -> CompositionTask:
+    """Convert markdown to XHTML, point images at their place in the EPUB and split chapters at headings."""
+    if task.markdown is None:
+        # An interim composition with no complete section yet
+        return task
+    if task.sections is not None and not REFERENCE_DEFINITION.search(task.markdown):
+        html_content = _render_sections(task)
+    else:
+        html_content = markdown(task.markdown, output_format='html')
+    soup = BeautifulSoup(html_content, 'html.parser')
+    task.token.check()
+
+    if task.dual_language_titles:
+        h1_tag = soup.find('h1')
+        if h1_tag and _clean_title(h1_tag.get_text()):
+            task.title = _clean_title(h1_tag.get_text())
+
+    for i, img_tag in enumerate(soup.find_all('img')):
+        task.token.check()
+        img_src = img_tag.get('src')
+        if not img_src:
+            continue
+        if not (task.book_dir / str(img_src)).exists():
+            task.warnings.append(f"Image not found: {img_src}")
+            continue
+        file_name = f'images/{pathlib.Path(str(img_src)).name}'
+        task.images.append((f'img{i}', str(img_src), file_name))
+        if hasattr(img_tag, '__setitem__'):
+            img_tag['src'] = file_name
+
+    if not soup.find_all(HEADING_TAGS):
+        # Fallback: one chapter with all content
+        task.chapters = [(task.fallback_chapter_title, 'chap_01.xhtml', str(soup))]
+        task.single_chapter = True
+        return task
+
+    chapter_counter = 1
+    current_chunk = []
+    current_title = "Introduction"
+    body_children = list(soup.body.children) if soup.body else list(soup.children)
+    for el in body_children:
+        task.token.check()
+        if el.name and el.name in HEADING_TAGS:
+            if current_chunk:
+                task.chapters.append((current_title, f"chap_{chapter_counter:02}.xhtml", ''.join(str(x) for x in current_chunk)))
+                chapter_counter += 1
+                current_chunk = []
+            current_title = _clean_title(el.get_text()) if task.dual_language_titles else el.get_text()
+        current_chunk.append(el)
+    if current_chunk:
+        task.chapters.append((current_title, f"chap_{chapter_counter:02}.xhtml", ''.join(str(x) for x in current_chunk)))
+    return task
+
+
+def read_images(task: CompositionTask) -> CompositionTask:
+    for uid, img_src, file_name in list(task.images):
+        task.token.check()
+        try:
+            with open(task.book_dir / img_src, 'rb') as f:
+                task.image_data[uid] = f.read()
+        except Exception as e:
+            if not task.skip_unreadable_images:
+                raise
+            task.warnings.append(f"Error processing image {img_src}: {str(e)}")
+    return task
+
+
+def write_epub(task: CompositionTask) -> CompositionTask:
+    if task.markdown is None:
+        return task
+    if task.combined_path is not None:
+        tmp_path = task.combined_path.with_name(f".{task.combined_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(task.markdown)
+        os.replace(tmp_path, task.combined_path)
+
+    book = epub.EpubBook()
+    book.set_identifier(f'book_{task.book_id}')
+    book.set_title(task.title)
+    book.set_language('en')
+    book.add_author(task.author)
+
+    for uid, img_src, file_name in task.images:
+        if uid not in task.image_data:
+            continue
+        mime_type, _ = mimetypes.guess_type(img_src)
+        book.add_item(epub.EpubItem(uid=uid, file_name=file_name, media_type=mime_type or 'image/jpeg',
+                                    content=task.image_data[uid]))
+
+    chapters = []
+    toc = []
+    for number, (title, file_name, content) in enumerate(task.chapters, start=1):
+        chapter = epub.EpubHtml(title=title, file_name=file_name, lang='en')
+        chapter.content = content
+        book.add_item(chapter)
+        chapters.append(chapter)
+        toc.append(epub.Link(file_name, title, f'chap{number}'))
+    book.toc = (chapters[0],) if task.single_chapter else tuple(toc)
+    book.spine = ['nav'] + chapters
+
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+
+    task.token.check()
+    # Written under a temporary name and renamed, so a recomposed book's previous EPUB stays downloadable until then
+    tmp_path = task.output_path.with_name(f".{task.output_path.name}.{os.getpid()}.tmp")
+    try:
+        epub.write_epub(str(tmp_path), book)
+        os.replace(tmp_path, task.output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    if task.rendered_sections is not None:
+        _finish_progressive(task)
+    return task
+
+
+def _render_sections(task: CompositionTask) -> str:
+    """
+    Render the combined document section by section, reusing the HTML of
+    sections that are unchanged since the previous progressive composition.
+    Every section starts at a heading, so the result matches rendering the
+    whole document up to blank lines after raw HTML blocks (reference-style
+    links aside, see REFERENCE_DEFINITION).
+    """
+    renderer = Markdown(output_format='html')
+    rendered = {}
+    parts = []
+    for section in task.sections:
+        task.token.check()
+        key = hashlib.sha1(section.encode('utf-8')).hexdigest()
+        html = task.rendered_sections.get(key)
+        if html is None:
+            html = renderer.reset().convert(section)
+        rendered[key] = html
+        parts.append(html)
+    # Only keep the sections of this version of the book
+    task.rendered_sections = rendered
+    return '\n'.join(parts)
+
+
+def _finish_progressive(task: CompositionTask) -> None:
+    """Save rendered sections for the next interim composition, or clean up after the final one."""
+    config = get_composer_config()
+    cache_path = task.book_dir / config['rendered_sections_filename']
+    if task.interim:
+        tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(task.rendered_sections, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+        return
+    for path in [cache_path, task.book_dir / config['interim_epub_filename']]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def progress_listener(composer, book_id: str, storage_root: str, progress: dict) -> Listener:
+    """Pipeline listener that checks for cancellation and records the current stage as the progress step."""
+    def on_stage(task: CompositionTask, stage_name: str) -> None:
+        task.token.check()
+        progress['step'] = stage_name
+        composer.save_progress(book_id, storage_root, progress)
+    return on_stage
+
+
+def _clean_title(title: str) -> str:
+    """Take the first part of a dual-language "Original / Translation" title."""
+    if ' / ' in title:
+        return title.split(' / ')[0].strip()
+    return title.strip()
+
+
+COMPOSITION_STAGES = [
+    PipelineStage('read_inputs', STAGE_IO, read_inputs),
+    PipelineStage('combine', STAGE_CPU, combine),
+    PipelineStage('render', STAGE_CPU, render),
+    PipelineStage('read_images', STAGE_IO, read_images),
+    PipelineStage('write_epub', STAGE_IO, write_epub),
+]
+
+_pipeline: Optional[CompositionPipeline] = None
+_pipeline_pid: Optional[int] = None
+_pipeline_lock = threading.Lock()
+
+
+def get_composition_pipeline() -> CompositionPipeline:
+    """The composition pipeline shared by every composer in this process (recreated after a fork)."""
+    global _pipeline, _pipeline_pid
+    with _pipeline_lock:
+        if _pipeline is None or _pipeline_pid != os.getpid():
+            config = get_composer_config()
+            _pipeline = CompositionPipeline(
+                COMPOSITION_STAGES,
+                io_workers=config['pipeline_io_workers'],
+                cpu_workers=config['pipeline_cpu_workers'],
+                queue_size=config['pipeline_queue_size'],
+                start_method=config['pool_start_method'],
+            )
+            _pipeline_pid = os.getpid()
+        return _pipeline
@@ -0,0 +1,99 @@
+"""
+Fingerprints of the inputs a book was composed from.
+
+When a paid composition finishes, the worker records the size, modification
+time and SHA-256 of each input in the progress file. A later scan compares the
+inputs of completed books against that record: a file whose size and
+modification time are unchanged is taken as unchanged, and only a file whose
+stat differs is hashed, so a touched but identical input does not cause a
+recomposition. Hashes are of the content, so an input the retention manager
+has compressed since (same modification time, smaller file) still matches.
+"""
+import hashlib
+import pathlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from common.compression import open_binary, stored_path
+
+# Bytes hashed at a time
+CHUNK_SIZE = 1024 * 1024
+
+
+def content_digest(path: pathlib.Path) -> str:
+    """SHA-256 hex digest of a file's content, plain or compressed."""
+    sha256 = hashlib.sha256()
+    with open_binary(path) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def fingerprint_inputs(book_dir: pathlib.Path, names: Iterable[str],
+                       known: Optional[Dict[str, dict]] = None) -> Dict[str, dict]:
+    """
+    The fingerprints of the given inputs of a book that exist. An input whose
+    fingerprint in `known` (recorded at upload or by the previous composition)
+    still has its size and modification time is not hashed again.
+    """
+    fingerprints = {}
+    for name in names:
+        stored = stored_path(book_dir / name)
+        if stored is None:
+            continue
+        stat = stored.stat()
+        previous = (known or {}).get(name) or {}
+        if (stored.name == name and previous.get('sha256')
+                and (previous.get('size'), previous.get('mtime_ns')) == (stat.st_size, stat.st_mtime_ns)):
+            digest = previous['sha256']
+        else:
+            digest = content_digest(stored)
+        fingerprints[name] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest,
+        }
+    return fingerprints
+
+
+def uploaded_fingerprints(progress: dict) -> Dict[str, dict]:
+    """The fingerprints of the inputs /api/compose saved, from the input_sha256 and input_stat it records."""
+    stats = progress.get('input_stat') or {}
+    return {name: dict(stats[name], sha256=digest)
+            for name, digest in (progress.get('input_sha256') or {}).items() if name in stats}
+
+
+def changed_inputs(book_dir: pathlib.Path, recorded: Dict[str, dict],
+                   verified: Optional[Dict[str, Tuple[int, int, str]]] = None) -> List[str]:
+    """
+    The names of the recorded inputs whose content has changed. An input that
+    has been removed is not reported: there is nothing to recompose from.
+
+    `verified` caches the digests computed here by file path and stat, so a
+    file touched once is not hashed again on every scan.
+    """
+    changed = []
+    for name, fingerprint in recorded.items():
+        stored = stored_path(book_dir / name)
+        if stored is None:
+            continue
+        try:
+            stat = stored.stat()
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime_ns == fingerprint['mtime_ns'] and (
+                stat.st_size == fingerprint['size'] or stored.name != name):
+            continue
+        key = str(stored)
+        cached = verified.get(key) if verified is not None else None
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            digest = cached[2]
+        else:
+            digest = content_digest(stored)
+            if verified is not None:
+                verified[key] = (stat.st_size, stat.st_mtime_ns, digest)
+        if digest != fingerprint['sha256']:
+            changed.append(name)
+    return changed
@@ -0,0 +1,197 @@
+"""
+Block tokenizer shared by the dual-language combiners.
+
+A markdown text is split into blocks in a single pass of one compiled regex
+over the whole string, which only stops at blank lines, headings and bullet
+items: headings, and runs of non-blank lines (paragraphs), which are further
+flagged as holding an image or being a bullet list. Blocks are kept as
+(kind, start, end) offsets into the text in three arrays, so tokenizing a
+book copies none of its lines; the text of a block is only sliced out when a
+combiner writes it.
+
+The blocks are the ones the line-by-line parser before it produced: headings
+start sections, lines ahead of the first heading are not part of any
+section, and code fences get no special treatment, so a heading or a blank
+line inside one still starts a section or a paragraph.
+"""
+import re
+from array import array
+from itertools import chain
+from typing import Iterator, List, Optional, Tuple
+
+# Block kinds. A paragraph's kind is PARAGRAPH or'ed with the flags that apply to it
+PARAGRAPH = 0
+IMAGE = 1
+LIST = 2
+HEADING = 16
+
+# Bump when the offsets below change meaning, so stored ones (see core/original_preparation.py) are rebuilt
+BLOCKS_FORMAT = 2
+
+# Lines the tokenizer stops at: a blank line or a heading, which end the
+# paragraph before them, and a bullet item, which is counted in it
+_LINE_EVENT = r"""[^\S\n]*(?:
+    (?P<blank>(?=\n))
+  | (?P<heading>\#{1,6}[^\S\n]+\S[^\n]*)
+  | (?P<bullet>[-*+]\ [^\S\n]*\S)
+)"""
+FIRST_LINE_EVENT = re.compile(_LINE_EVENT, re.VERBOSE)
+# From the newline before such a line; sre finds candidates with a fast search for the newline
+LINE_EVENT = re.compile(r'\n' + _LINE_EVENT, re.VERBOSE)
+
+HEADING_LINE = re.compile(r'[^\S\n]*(\#{1,6})[^\S\n]+(\S[^\n]*?)[^\S\n]*$', re.MULTILINE)
+
+# A bullet item: "- ", "* " or "+ " and some text
+BULLET = re.compile(r'^[^\S\n]*[-*+] [^\S\n]*\S[^\n]*', re.MULTILINE)
+
+
+class MarkdownBlocks:
+    """The blocks of a markdown text, as kinds and offsets into it."""
+    __slots__ = ('text', 'kinds', 'starts', 'ends', 'text_end')
+
+    def __init__(self, text: str, kinds: array, starts: array, ends: array):
+        self.text = text
+        self.kinds = kinds
+        self.starts = starts
+        self.ends = ends
+        # Trailing whitespace of the text belongs to no block or section
+        self.text_end = len(text.rstrip())
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def block(self, index: int) -> str:
+        return self.text[self.starts[index]:self.ends[index]]
+
+    def sections(self) -> List['Section']:
+        """The sections started by the headings, in order."""
+        headings = [index for index, kind in enumerate(self.kinds) if kind == HEADING]
+        sections = []
+        for number, index in enumerate(headings):
+            if number + 1 < len(headings):
+                end_block = headings[number + 1]
+                # The body ends before the newline that ends its last line
+                body_end = self.starts[end_block] - 1
+            else:
+                end_block = len(self.kinds)
+                body_end = self.text_end
+            match = HEADING_LINE.match(self.text, self.starts[index], self.ends[index])
+            sections.append(Section(self, match.group(1), match.group(2), self.ends[index] + 1, body_end,
+                                    index + 1, end_block))
+        return sections
+
+    def to_offsets(self) -> dict:
+        """The blocks as JSON-serializable lists, for from_offsets() with the same text."""
+        return {'format': BLOCKS_FORMAT, 'kinds': self.kinds.tolist(),
+                'starts': self.starts.tolist(), 'ends': self.ends.tolist()}
+
+    @classmethod
+    def from_offsets(cls, text: str, offsets: dict) -> Optional['MarkdownBlocks']:
+        """The blocks stored by to_offsets() for this text, or None if they are in an older format."""
+        if offsets.get('format') != BLOCKS_FORMAT:
+            return None
+        return cls(text, array('B', offsets['kinds']), array('q', offsets['starts']), array('q', offsets['ends']))
+
+
+class Section:
+    """A heading and the blocks up to the next one."""
+    __slots__ = ('blocks', 'level', 'title', 'body_start', 'body_end', 'first_block', 'end_block')
+
+    def __init__(self, blocks: MarkdownBlocks, level: str, title: str, body_start: int, body_end: int,
+                 first_block: int, end_block: int):
+        self.blocks = blocks
+        self.level = level
+        self.title = title
+        self.body_start = body_start
+        self.body_end = body_end
+        self.first_block = first_block
+        self.end_block = end_block
+
+    @property
+    def body(self) -> Optional[str]:
+        """The lines between the heading and the next one as they are, blank ones included; None if there are none."""
+        if self.body_start > self.body_end:
+            return None
+        return self.blocks.text[self.body_start:self.body_end]
+
+    def paragraphs(self) -> List[Tuple[int, str]]:
+        """The (kind, text) of each block of the section."""
+        blocks, first, last = self.blocks, self.first_block, self.end_block
+        text = blocks.text
+        return [(kind, text[start:end]) for kind, start, end
+                in zip(blocks.kinds[first:last], blocks.starts[first:last], blocks.ends[first:last])]
+
+
+def tokenize(text: str) -> MarkdownBlocks:
+    """Split a markdown text into blocks in one pass."""
+    kinds = array('B')
+    starts = array('q')
+    ends = array('q')
+    text_end = len(text.rstrip())
+    if not text_end:
+        return MarkdownBlocks(text, kinds, starts, ends)
+    # Image lines are found in their own pass over the text; the paragraphs
+    # come in order, so one cursor into the list finds theirs
+    images = _image_lines(text, text_end)
+    images.append(text_end + 1)
+    image = 0
+    bullets = 0
+
+    # Paragraphs are the lines between the events that end them
+    events = LINE_EVENT.finditer(text, 0, text_end)
+    first = FIRST_LINE_EVENT.match(text, 0, text_end)
+    if first is not None:
+        events = chain([first], events)
+    paragraph_start = 0
+    for match in chain(events, [None]):
+        if match is None:
+            line_start = text_end + 1
+        else:
+            line_start = match.start() + 1 if match.re is LINE_EVENT else 0
+            if match.lastgroup == 'bullet':
+                # Part of the paragraph, which goes on
+                bullets += 1
+                continue
+        if line_start > paragraph_start:
+            end = line_start - 1
+            kind = PARAGRAPH
+            while images[image] < paragraph_start:
+                image += 1
+            if images[image] < end:
+                kind = IMAGE
+            if bullets and bullets * 2 >= text.count('\n', paragraph_start, end) + 1:
+                kind |= LIST
+            kinds.append(kind)
+            starts.append(paragraph_start)
+            ends.append(end)
+            bullets = 0
+        if match is None:
+            break
+        line_end = match.end()
+        if match.lastgroup == 'heading':
+            kinds.append(HEADING)
+            starts.append(line_start)
+            ends.append(line_end)
+        paragraph_start = line_end + 1
+    return MarkdownBlocks(text, kinds, starts, ends)
+
+
+def _image_lines(text: str, end: int) -> List[int]:
+    """The start of each line with both "![" and "](" on it."""
+    lines = []
+    position = text.find('![', 0, end)
+    while position != -1:
+        line_start = text.rfind('\n', 0, position) + 1
+        line_end = text.find('\n', position, end)
+        if line_end == -1:
+            line_end = end
+        if text.find('](', line_start, line_end) != -1:
+            lines.append(line_start)
+        position = text.find('![', line_end, end)
+    return lines
+
+
+def iter_bullets(text: str) -> Iterator[str]:
+    """The bullet items of a list block, stripped."""
+    for match in BULLET.finditer(text):
+        yield match.group().strip()
@@ -0,0 +1,65 @@
+"""
+Speculative preparation of originalbook.md.
+
+The original usually lands well before the translation. The worker tokenizes
+it into blocks as soon as it appears and stores their offsets in the book
+folder, keyed by the SHA-256 of the content they were built from, so that
+composing the book later only tokenizes the translation before merging.
+A prepared file whose hash no longer matches the original is ignored.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import time
+from typing import Optional
+
+from common.compression import open_text
+from core.markdown_blocks import MarkdownBlocks, tokenize
+
+ORIGINAL_FILENAME = 'originalbook.md'
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def prepare_original(book_dir: pathlib.Path, prepared_filename: str) -> bool:
+    """Parse the book's original and store the result. Returns False if there is no original (any more)."""
+    try:
+        with open_text(book_dir / ORIGINAL_FILENAME) as f:
+            content = f.read()
+    except FileNotFoundError:
+        return False
+    prepared = {
+        'sha256': content_hash(content),
+        'prepared_at': time.time(),
+        'blocks': tokenize(content).to_offsets(),
+    }
+    prepared_path = book_dir / prepared_filename
+    tmp_path = prepared_path.with_name(f".{prepared_filename}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(prepared, f, ensure_ascii=False)
+    os.replace(tmp_path, prepared_path)
+    return True
+
+
+def load_prepared_original(book_dir: pathlib.Path, prepared_filename: str, content: str) -> Optional[list]:
+    """The prepared sections for this exact original content, or None if there are none (or they are stale)."""
+    try:
+        with open(book_dir / prepared_filename, 'r', encoding='utf-8') as f:
+            prepared = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if prepared.get('sha256') != content_hash(content) or 'blocks' not in prepared:
+        return None
+    blocks = MarkdownBlocks.from_offsets(content, prepared['blocks'])
+    return blocks.sections() if blocks is not None else None
+
+
+def needs_preparation(book_dir: pathlib.Path, prepared_filename: str) -> bool:
+    """True if the original is newer than its prepared file, or has none."""
+    try:
+        return (book_dir / ORIGINAL_FILENAME).stat().st_mtime > (book_dir / prepared_filename).stat().st_mtime
+    except FileNotFoundError:
+        return (book_dir / ORIGINAL_FILENAME).exists()
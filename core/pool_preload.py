@@ -0,0 +1,22 @@
+"""
+Imported once by the forkserver parent of the composition pool.
+
+Loads the heavy composition dependencies and the composer registry, then
+freezes the garbage collector so every forked child shares these pages
+copy-on-write instead of touching (and copying) them on its first collection.
+"""
+
+import gc
+
+import markdown
+import ebooklib.epub
+import bs4
+import lxml.etree
+
+from core.ComposerFactory import ComposerFactory
+
+# Building the registry once here warms up every composer module import
+ComposerFactory()
+
+gc.collect()
+gc.freeze()
@@ -1,9 +1,10 @@
-import os
 import json
 import uuid
 import time
 from typing import Any
 
+from common.storage_backend import get_storage_backend
+
 def write_service_event(topic: str, book_id: str, service: str, storage_root: str = "storage", **extra: Any) -> str:
     """
     Write a service event as a JSON file in the format compatible with shared-core-npm.
@@ -16,13 +17,13 @@ def write_service_event(topic: str, book_id: str, service: str, storage_root: st
         "service": service,
         **extra
     }
-    events_dir = os.path.join(storage_root, "events")
-    os.makedirs(events_dir, exist_ok=True)
     filename = f"{event['timestamp']}_{topic}_{book_id}_{event['guid']}.json"
-    filepath = os.path.join(events_dir, filename)
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(event, f, indent=2)
-    return filepath
+    key = f"events/{filename}"
+    # Through STORAGE_BACKEND, so downstream services see events wherever the books live
+    storage = get_storage_backend(storage_root)
+    storage.write_bytes(key, json.dumps(event, indent=2).encode("utf-8"))
+    local_path = storage.local_path(key)
+    return str(local_path) if local_path is not None else key
 
 # Example usage:
 # write_service_event("service-start", "book123", "composingservice")
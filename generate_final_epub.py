@@ -11,6 +11,7 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from position_based_combiner import PositionBasedCombiner
+from common.storage_layout import book_path, iter_book_dirs
 
 def generate_final_dual_language_epub(storage_root="storage", job_id=None):
     """Generate the final dual-language EPUB with proper Vietnamese integration."""
@@ -21,8 +22,7 @@ def generate_final_dual_language_epub(storage_root="storage", job_id=None):
     
     # If no job_id specified, find available jobs
     if job_id is None:
-        available_jobs = [d.name for d in storage_path.iterdir() if d.is_dir() and not d.name.startswith('.')]
-        available_jobs = [job for job in available_jobs if job not in ['events']]  # Exclude non-job folders
+        available_jobs = [d.name for d in iter_book_dirs(str(storage_path))]  # Flat or sharded (STORAGE_LAYOUT)
         if available_jobs:
             job_id = available_jobs[0]  # Use first available job
             print(f"📂 Auto-selected job: {job_id}")
@@ -30,7 +30,7 @@ def generate_final_dual_language_epub(storage_root="storage", job_id=None):
             print("❌ No job folders found in storage")
             return False
     
-    job_path = storage_path / job_id
+    job_path = book_path(str(storage_path), job_id)
     original_file = job_path / "originalbook.md"
     
     # Check for both regular and free translated content
@@ -4,6 +4,7 @@ Composing Service (Console Version)
 Main entry point for the composing service.
 """
 
+import argparse
 import sys
 import os
 from pathlib import Path
@@ -12,19 +13,101 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from core.ComposingWorker import ComposingWorker
-from common.configuration import get_storage_root
+from core.JobIndex import JobIndex
+from core.StorageMigration import StorageMigration
+from core.StorageRetention import StorageRetention
+from core.StorageRootSupervisor import StorageRootSupervisor, apply_storage_root
+from common.configuration import get_composer_config, get_storage_roots
 from common.logger import get_logger
 
+def _megabytes(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+def print_plan(worker: ComposingWorker):
+    """Print the dry-run plan of the pending jobs."""
+    plan = worker.plan()
+    print(f"{len(plan['jobs'])} pending job(s), concurrency {plan['concurrency']}")
+    for job in plan['jobs']:
+        features = job['features']
+        print(f"{job['startSeconds']:>9.1f}s -> {job['finishSeconds']:>9.1f}s  {job['bookId']} "
+              f"[{job['service']}, {job['priority']}, {job['composer']}] "
+              f"est. {job['estimatedSeconds']:.1f}s, {_megabytes(job['estimatedPeakRssBytes'])} peak RSS ({job['basis']}); "
+              f"input {_megabytes(features['input_bytes'])}, {features['sections']} sections, "
+              f"{features['paragraphs']} paragraphs, {features['images']} images")
+    print(f"Makespan: {plan['makespanSeconds']:.1f}s, peak concurrent RSS: {_megabytes(plan['peakRssBytes'])}")
+
 def main():
     """Main entry point."""
-    storage_root = get_storage_root()
-    logger = get_logger(storage_root)
-    
-    logger.info(f"Starting Composing Service with storage root: {storage_root}")
+    parser = argparse.ArgumentParser(description='Composing Service')
+    parser.add_argument('--plan', action='store_true',
+                        help='Print the pending jobs with estimated duration, memory and schedule, without composing anything')
+    parser.add_argument('--reconcile-index', action='store_true',
+                        help='Rebuild the job index of every storage root from what is on disk, then exit')
+    parser.add_argument('--migrate-storage', action='store_true',
+                        help='Move the flat book folders of every storage root into the sharded layout, then exit')
+    parser.add_argument('--retention', action='store_true',
+                        help='Run one retention pass (compression, eviction, temp cleanup) over every storage root, then exit')
+    args = parser.parse_args()
+
+    roots = get_storage_roots()
+    logger = get_logger(roots[0]['path'])
+
+    if args.reconcile_index:
+        for root in roots:
+            index = JobIndex(root['path'], get_composer_config())
+            counts = index.reconcile()
+            index.close()
+            print(f"{root['path']}: {counts['books']} book(s) indexed, {counts['changed']} changed, "
+                  f"{counts['removed']} removed ({index.path})")
+        return
+
+    if args.migrate_storage:
+        environment = dict(os.environ)
+        for root in roots:
+            apply_storage_root(root)
+            counts = StorageMigration(root['path'], get_composer_config()).run()
+            print(f"{root['path']}: {counts['moved']} folder(s) moved, {counts['merged']} merged, "
+                  f"{counts['busy']} busy (run again later), {counts['failed']} failed")
+            os.environ.clear()
+            os.environ.update(environment)
+        return
+
+    if args.retention:
+        environment = dict(os.environ)
+        for root in roots:
+            apply_storage_root(root)
+            report = StorageRetention(root['path'], get_composer_config()).run()
+            print(f"{root['path']}: {_megabytes(report['reclaimed_bytes'])} reclaimed from {report['books']} book(s): "
+                  f"{report['compressed']['files']} file(s) compressed ({_megabytes(report['compressed']['bytes'])}), "
+                  f"{report['artifacts']['files']} artifact(s) ({_megabytes(report['artifacts']['bytes'])}) and "
+                  f"{report['evicted']['books']} book(s) ({_megabytes(report['evicted']['bytes'])}) removed, "
+                  f"{report['temp']['files']} temp file(s) ({_megabytes(report['temp']['bytes'])}), "
+                  f"{report['blobs']['files']} unreferenced blob(s) ({_megabytes(report['blobs']['bytes'])}); "
+                  f"{report['busy']} busy, {_megabytes(report['storage_bytes'])} in use")
+            os.environ.clear()
+            os.environ.update(environment)
+        return
+
+    if args.plan:
+        environment = dict(os.environ)
+        for root in roots:
+            if len(roots) > 1:
+                print(f"== {root['path']}")
+            apply_storage_root(root)
+            print_plan(ComposingWorker(root['path']))
+            os.environ.clear()
+            os.environ.update(environment)
+        return
     
     try:
-        worker = ComposingWorker(storage_root)
-        worker.run()
+        if len(roots) > 1:
+            logger.info(f"Starting Composing Service with storage roots: {', '.join(root['path'] for root in roots)}")
+            StorageRootSupervisor(roots).run()
+        else:
+            apply_storage_root(roots[0])
+            logger.info(f"Starting Composing Service with storage root: {roots[0]['path']}")
+            worker = ComposingWorker(roots[0]['path'])
+            worker.run()
     except KeyboardInterrupt:
         logger.info("Composing Service interrupted by user")
     except Exception as e:
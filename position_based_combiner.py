@@ -11,34 +11,59 @@ from pathlib import Path
 # Add the dc-epub-composer directory to the Python path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from core.DualLanguageCombiner import DualLanguageCombiner
+from typing import Optional
+
+from core.CancellationToken import CancellationToken
+from core.markdown_blocks import IMAGE, PARAGRAPH, tokenize
 
 class PositionBasedCombiner:
     """Combines dual-language content by section position instead of title matching."""
     
-    def __init__(self):
-        self.combiner = DualLanguageCombiner()
+    def prepare_document(self, content: str) -> list:
+        """Tokenize a document into sections (see core/markdown_blocks.py) for combine_by_position."""
+        return tokenize(content).sections()
     
-    def combine_by_position(self, original_content: str, translated_content: str) -> str:
-        """Combine content by matching sections in order."""
+    def combine_by_position(self, original_content: str, translated_content: str,
+                            cancellation_token: Optional[CancellationToken] = None,
+                            original_sections: Optional[list] = None) -> str:
+        """
+        Combine content by matching sections in order.
+        
+        original_sections, from prepare_document(original_content), skips parsing
+        the original again.
+        """
         
         # Parse both documents into sections
-        original_sections = self.combiner._parse_markdown_sections(original_content)
-        translated_sections = self.combiner._parse_markdown_sections(translated_content)
+        if original_sections is None:
+            original_sections = self.prepare_document(original_content)
+        translated_sections = self.prepare_document(translated_content)
         
+        return '\n'.join(self.combine_sections(original_sections, translated_sections, cancellation_token))
+    
+    def combine_sections(self, original_sections: list, translated_sections: list,
+                         cancellation_token: Optional[CancellationToken] = None) -> list:
+        """
+        Combine sections from prepare_document() by position.
+        
+        Returns the markdown of each combined section; joined with newlines they
+        form the combined document.
+        """
         print(f"📊 Position-based matching:")
         print(f"   Original sections: {len(original_sections)}")
         print(f"   Translated sections: {len(translated_sections)}")
         
-        combined_lines = []
+        combined_sections = []
         
         # Match sections by position (index)
         max_sections = min(len(original_sections), len(translated_sections))
         print(f"   Matching first {max_sections} sections")
         
         for i in range(max_sections):
-            orig_level, orig_title, orig_content = original_sections[i]
-            trans_level, trans_title, trans_content = translated_sections[i]
+            if cancellation_token:
+                cancellation_token.check()
+            orig_level, orig_title = original_sections[i].level, original_sections[i].title
+            trans_title = translated_sections[i].title
+            combined_lines = []
             
             # Combine headers
             if orig_level == '#':  # H1 - main title
@@ -52,115 +77,75 @@ class PositionBasedCombiner:
             combined_lines.append("")
             
             # Combine content paragraph by paragraph
-            combined_content = self._combine_content_by_position(orig_content, trans_content)
+            combined_content = self._combine_paragraphs_by_position(original_sections[i].paragraphs(),
+                                                                    translated_sections[i].paragraphs())
             combined_lines.extend(combined_content)
             combined_lines.append("")
+            combined_sections.append(combined_lines)
         
         # Add any remaining sections from the longer document
         if len(original_sections) > max_sections:
             print(f"   Adding {len(original_sections) - max_sections} remaining original sections")
-            for i in range(max_sections, len(original_sections)):
-                orig_level, orig_title, orig_content = original_sections[i]
-                combined_lines.append(f"{orig_level} {orig_title}")
-                combined_lines.append("")
-                combined_lines.extend(orig_content)
-                combined_lines.append("")
+            for section in original_sections[max_sections:]:
+                combined_sections.append(self._section_as_is(section))
         
         if len(translated_sections) > max_sections:
             print(f"   Adding {len(translated_sections) - max_sections} remaining translated sections")
-            for i in range(max_sections, len(translated_sections)):
-                trans_level, trans_title, trans_content = translated_sections[i]
-                combined_lines.append(f"{trans_level} {trans_title}")
-                combined_lines.append("")
-                combined_lines.extend(trans_content)
-                combined_lines.append("")
+            for section in translated_sections[max_sections:]:
+                combined_sections.append(self._section_as_is(section))
         
         # Remove trailing empty lines
-        while combined_lines and combined_lines[-1] == "":
-            combined_lines.pop()
+        if combined_sections:
+            while combined_sections[-1] and combined_sections[-1][-1] == "":
+                combined_sections[-1].pop()
         
-        return '\n'.join(combined_lines)
+        return ['\n'.join(combined_lines) for combined_lines in combined_sections]
     
-    def _combine_content_by_position(self, orig_content: list, trans_content: list) -> list:
-        """Combine content paragraphs by position, avoiding image duplication."""
+    def _section_as_is(self, section) -> list:
+        """The lines of a section that has no counterpart, unchanged."""
+        lines = [f"{section.level} {section.title}", ""]
+        if section.body is not None:
+            lines.append(section.body)
+        lines.append("")
+        return lines
+    
+    def _combine_paragraphs_by_position(self, orig_paragraphs: list, trans_paragraphs: list) -> list:
+        """Combine (kind, text) paragraphs by position, avoiding image duplication."""
         combined = []
         
-        # Split into paragraphs
-        orig_paragraphs = self._split_into_paragraphs(orig_content)
-        trans_paragraphs = self._split_into_paragraphs(trans_content)
-        
         # Combine paragraphs by position
         max_paragraphs = max(len(orig_paragraphs), len(trans_paragraphs))
         
         for i in range(max_paragraphs):
-            orig_para = orig_paragraphs[i] if i < len(orig_paragraphs) else []
-            trans_para = trans_paragraphs[i] if i < len(trans_paragraphs) else []
+            orig_kind, orig_para = orig_paragraphs[i] if i < len(orig_paragraphs) else (PARAGRAPH, "")
+            trans_kind, trans_para = trans_paragraphs[i] if i < len(trans_paragraphs) else (PARAGRAPH, "")
             
-            # Check if this paragraph contains images
-            orig_has_images = self._contains_images(orig_para)
-            trans_has_images = self._contains_images(trans_para)
-            
-            if orig_has_images or trans_has_images:
+            if orig_kind & IMAGE or trans_kind & IMAGE:
                 # For image paragraphs, only include once (prefer original)
                 if orig_para:
-                    combined.extend(orig_para)
+                    combined.append(orig_para)
                     combined.append("")
                 elif trans_para:
-                    combined.extend(trans_para)
+                    combined.append(trans_para)
                     combined.append("")
             else:
                 # For text paragraphs, include both languages
                 # Add original paragraph
                 if orig_para:
-                    combined.extend(orig_para)
+                    combined.append(orig_para)
                     combined.append("")
                 
                 # Add translated paragraph with Vietnamese styling
                 if trans_para:
-                    styled_para = self._add_vietnamese_styling(trans_para)
-                    combined.extend(styled_para)
+                    combined.append(self._add_vietnamese_styling(trans_para))
                     combined.append("")
         
         return combined
     
-    def _contains_images(self, paragraph: list) -> bool:
-        """Check if a paragraph contains markdown images."""
-        for line in paragraph:
-            # Check for markdown image syntax: ![alt](image.png) or ![](image.png)
-            if '![' in line and '](' in line:
-                return True
-        return False
-    
-    def _add_vietnamese_styling(self, paragraph: list) -> list:
-        """Add italic styling to Vietnamese content."""
-        styled_paragraph = []
-        for line in paragraph:
-            if line.strip():  # Only style non-empty lines
-                # Use simple italic formatting for Vietnamese content
-                styled_line = f'*{line}*'
-                styled_paragraph.append(styled_line)
-            else:
-                styled_paragraph.append(line)  # Keep empty lines as is
-        return styled_paragraph
-    
-    def _split_into_paragraphs(self, content: list) -> list:
-        """Split content into paragraphs separated by empty lines."""
-        paragraphs = []
-        current_paragraph = []
-        
-        for line in content:
-            if line.strip() == "":
-                if current_paragraph:
-                    paragraphs.append(current_paragraph)
-                    current_paragraph = []
-            else:
-                current_paragraph.append(line)
-        
-        # Add the last paragraph if it exists
-        if current_paragraph:
-            paragraphs.append(current_paragraph)
-        
-        return paragraphs
+    def _add_vietnamese_styling(self, paragraph: str) -> str:
+        """Add italic styling to Vietnamese content, line by line."""
+        # The lines of a paragraph are never blank
+        return '*' + paragraph.replace('\n', '*\n*') + '*'
 
 def test_position_based_combination(storage_root="storage-new", job_id="1265e85f-3ba7-475b-b7a2-f9fdf1dc5043"):
     """Test the position-based combination approach."""
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Tests for the job index: when a book's row is served from the index and when it is re-read.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import pathlib
+from pathlib import Path
+
+# Add the composingservice directory to the Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from core.JobIndex import RACY_NS, JobIndex
+from common.logger import get_logger
+
+PROGRESS_FILENAME = "composingservice-progress.json"
+
+def _config(index_dir: str) -> dict:
+    return {'progress_filename': PROGRESS_FILENAME, 'job_index_dir': index_dir}
+
+def _make_book(storage_root: str, book_id: str) -> pathlib.Path:
+    book_dir = pathlib.Path(storage_root) / book_id
+    book_dir.mkdir()
+    (book_dir / "originalbook.md").write_text("# Title\n\nText.\n", encoding='utf-8')
+    with open(book_dir / PROGRESS_FILENAME, 'w', encoding='utf-8') as f:
+        json.dump({'status': 'pending'}, f)
+    return book_dir
+
+def _backdate(path: pathlib.Path, mtime_ns: int) -> None:
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def _settle(book_dir: pathlib.Path) -> int:
+    """Move the folder and its progress file out of the racy window, as if they were written a while ago."""
+    mtime_ns = time.time_ns() - 2 * RACY_NS
+    _backdate(book_dir / PROGRESS_FILENAME, mtime_ns)
+    _backdate(book_dir, mtime_ns)
+    return mtime_ns
+
+def test_rename_into_book_folder():
+    """A file renamed into a settled book folder moves the folder's mtime and is listed on the next scan."""
+    with tempfile.TemporaryDirectory() as storage_root, tempfile.TemporaryDirectory() as index_dir:
+        get_logger(storage_root)
+        book_dir = _make_book(storage_root, "book-1")
+        _settle(book_dir)
+        index = JobIndex(storage_root, _config(index_dir))
+        assert index.listing(book_dir) == {"originalbook.md", PROGRESS_FILENAME}
+        index.commit()
+
+        # The translation is written elsewhere and renamed in, as uploads and copies to EFS do
+        staging = pathlib.Path(storage_root) / ".staging-translatedcontent.md"
+        staging.write_text("# Titre\n\nTexte.\n", encoding='utf-8')
+        os.replace(staging, book_dir / "translatedcontent.md")
+        assert "translatedcontent.md" in index.listing(book_dir)
+        index.commit()
+
+        # A fresh process loads the row from the database
+        reopened = JobIndex(storage_root, _config(index_dir))
+        assert "translatedcontent.md" in reopened.listing(book_dir)
+        reopened.close()
+        index.close()
+
+def test_unchanged_rows_are_served_from_the_index():
+    """Without a change to the folder's or the progress file's mtime, the indexed listing is reused."""
+    with tempfile.TemporaryDirectory() as storage_root, tempfile.TemporaryDirectory() as index_dir:
+        get_logger(storage_root)
+        book_dir = _make_book(storage_root, "book-1")
+        mtime_ns = _settle(book_dir)
+        index = JobIndex(storage_root, _config(index_dir))
+        index.listing(book_dir)
+        index.commit()
+
+        # A rename whose folder mtime ends up where it was is not seen...
+        (book_dir / "translatedcontent.md").write_text("Texte.\n", encoding='utf-8')
+        _backdate(book_dir, mtime_ns)
+        assert "translatedcontent.md" not in index.listing(book_dir)
+        # ...until the book is reported by a change notification
+        assert "translatedcontent.md" in index.listing(book_dir, force=True)
+        index.close()
+
+def test_racy_rows_are_read_again():
+    """A row indexed within RACY_NS of its folder's mtime is re-listed even if that mtime does not move again."""
+    with tempfile.TemporaryDirectory() as storage_root, tempfile.TemporaryDirectory() as index_dir:
+        get_logger(storage_root)
+        book_dir = _make_book(storage_root, "book-1")
+        mtime_ns = book_dir.stat().st_mtime_ns
+        index = JobIndex(storage_root, _config(index_dir))
+        assert "translatedcontent.md" not in index.listing(book_dir)
+        index.commit()
+
+        # A second change within the filesystem's timestamp granularity leaves the mtime as it was
+        (book_dir / "translatedcontent.md").write_text("Texte.\n", encoding='utf-8')
+        _backdate(book_dir, mtime_ns)
+        assert "translatedcontent.md" in index.listing(book_dir)
+        index.close()
+
+def test_progress_change_and_removed_books():
+    """A progress update rewritten in place is re-read; a full scan drops books that are gone."""
+    with tempfile.TemporaryDirectory() as storage_root, tempfile.TemporaryDirectory() as index_dir:
+        get_logger(storage_root)
+        book_dir = _make_book(storage_root, "book-1")
+        gone_dir = _make_book(storage_root, "book-2")
+        mtime_ns = _settle(book_dir)
+        index = JobIndex(storage_root, _config(index_dir))
+        index.listing(book_dir)
+        index.listing(gone_dir)
+        index.commit()
+        assert index.progress("book-1") == {'status': 'pending'}
+
+        with open(book_dir / PROGRESS_FILENAME, 'w', encoding='utf-8') as f:
+            json.dump({'status': 'completed'}, f)
+        _backdate(book_dir / PROGRESS_FILENAME, mtime_ns + 1)
+        _backdate(book_dir, mtime_ns)
+        index.listing(book_dir)
+        assert index.progress("book-1") == {'status': 'completed'}
+
+        shutil.rmtree(gone_dir)
+        index.commit()
+        reopened = JobIndex(storage_root, _config(index_dir))
+        reopened.listing(book_dir)
+        assert reopened.progress("book-1") == {'status': 'completed'}
+        assert reopened.progress("book-2") == {'status': 'pending'}
+        reopened.close()
+        index.close()
+
+def test_in_place_edit_of_completed_book():
+    """A completed book whose translation is rewritten in place is recomposed, although its row is served from the index."""
+    with tempfile.TemporaryDirectory() as storage_root, tempfile.TemporaryDirectory() as index_dir:
+        get_logger(storage_root)
+        os.environ['JOB_INDEX'] = 'true'
+        os.environ['JOB_INDEX_DIR'] = index_dir
+        from core.ComposingWorker import ComposingWorker
+        from core.input_fingerprints import fingerprint_inputs
+        book_dir = pathlib.Path(storage_root) / "book-1"
+        book_dir.mkdir()
+        (book_dir / "translatedcontent.md").write_text("# Titre\n\nTexte.\n", encoding='utf-8')
+        (book_dir / "final.epub").write_bytes(b"epub")
+        with open(book_dir / PROGRESS_FILENAME, 'w', encoding='utf-8') as f:
+            json.dump({'status': 'completed', 'composer': 'simple_markdown',
+                       'composed_inputs': fingerprint_inputs(book_dir, ["translatedcontent.md"])}, f)
+        mtime_ns = _settle(book_dir)
+        worker = ComposingWorker(storage_root)
+        assert worker.job_index is not None
+        assert worker.find_jobs() == []
+
+        with open(book_dir / "translatedcontent.md", 'a', encoding='utf-8') as f:
+            f.write("Plus de texte.\n")
+        _backdate(book_dir, mtime_ns)
+        assert worker.find_jobs() == ["book-1"]
+
+if __name__ == "__main__":
+    print("Testing JobIndex...")
+    test_rename_into_book_folder()
+    test_unchanged_rows_are_served_from_the_index()
+    test_racy_rows_are_read_again()
+    test_progress_change_and_removed_books()
+    test_in_place_edit_of_completed_book()
+    print("Test PASSED")
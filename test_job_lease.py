@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Multi-process test for lease-based job claiming on shared storage.
+"""
+
+import sys
+import os
+import json
+import time
+import tempfile
+import pathlib
+import random
+import multiprocessing
+from pathlib import Path
+
+# Add the composingservice directory to the Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from core.JobLease import JobLeaseManager
+from core.SimpleMarkdownComposer import SimpleMarkdownComposer
+from common.logger import get_logger
+from common.storage_layout import book_path
+
+LEASE_CONFIG = {
+    'lease_filename': 'composingservice.lease',
+    'lease_ttl': 2,
+    'lease_heartbeat_interval': 1,
+    'node_id': 'test-node',
+}
+
+def _compose_worker(storage_root: str, node: int, book_ids: list, rounds: int):
+    """Simulated worker node: claim, 'compose' by appending to a journal, release."""
+    leases = JobLeaseManager(storage_root, LEASE_CONFIG, owner=f"node-{node}")
+    for _ in range(rounds):
+        for book_id in book_ids:
+            if not leases.claim(book_id, "composingservice"):
+                continue
+            journal = pathlib.Path(storage_root) / book_id / "journal.log"
+            with open(journal, 'a', encoding='utf-8') as f:
+                f.write(f"start {node} {time.time()}\n")
+            time.sleep(0.005)
+            with open(journal, 'a', encoding='utf-8') as f:
+                f.write(f"end {node} {time.time()}\n")
+            leases.release(book_id)
+
+def test_no_double_composition():
+    """Several processes racing for the same books never hold one at the same time."""
+    with tempfile.TemporaryDirectory() as storage_root:
+        get_logger(storage_root)
+        book_ids = [f"book-{i}" for i in range(5)]
+        for book_id in book_ids:
+            (pathlib.Path(storage_root) / book_id).mkdir()
+        
+        processes = [
+            multiprocessing.Process(target=_compose_worker, args=(storage_root, node, book_ids, 20))
+            for node in range(6)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        
+        total_compositions = 0
+        for book_id in book_ids:
+            journal = pathlib.Path(storage_root) / book_id / "journal.log"
+            lines = journal.read_text(encoding='utf-8').splitlines()
+            # Every start must be immediately followed by the same node's end
+            assert len(lines) % 2 == 0
+            for start, end in zip(lines[::2], lines[1::2]):
+                assert start.split()[:2] == ['start', end.split()[1]]
+                assert end.startswith('end ')
+            total_compositions += len(lines) // 2
+            assert not (pathlib.Path(storage_root) / book_id / LEASE_CONFIG['lease_filename']).exists()
+        
+        print(f"Compositions without overlap: {total_compositions}")
+        assert total_compositions > 0
+
+class JournalComposer(SimpleMarkdownComposer):
+    """Stands in for a composition: journals it, writes the EPUB and marks the book completed."""
+    
+    def compose(self, book_id, storage_root, config=None):
+        book_dir = book_path(storage_root, book_id)
+        with open(book_dir / "journal.log", 'a', encoding='utf-8') as f:
+            f.write(f"compose {os.getpid()}\n")
+        time.sleep(0.02)
+        (book_dir / self.final_epub_filename).write_bytes(b'epub')
+        progress = self.get_progress(book_id, storage_root)
+        progress['status'] = 'completed'
+        self.save_progress(book_id, storage_root, progress)
+        return True
+
+def _scan_claim_compose_worker(storage_root: str, node: int, rounds: int):
+    """Simulated worker node running the worker's own scan -> claim -> compose steps."""
+    from core.ComposingWorker import ComposingWorker, FreeComposingWorker
+    worker = ComposingWorker(storage_root)
+    worker.composer_factory.register_composer('simple_markdown', JournalComposer)
+    free_worker = FreeComposingWorker(storage_root)
+    leases = JobLeaseManager(storage_root, LEASE_CONFIG, owner=f"node-{node}")
+    for _ in range(rounds):
+        jobs = worker.scan_jobs(free_worker)
+        # Nodes work through their (soon stale) scans in different orders
+        random.Random(node).shuffle(jobs)
+        for job in jobs:
+            if not worker._claim_job(job, leases, free_worker):
+                continue
+            try:
+                worker.process_book(job.book_id)
+            finally:
+                leases.release(job.book_id)
+
+def test_each_book_composed_once():
+    """Nodes working from stale scans compose every book exactly once."""
+    with tempfile.TemporaryDirectory() as storage_root:
+        get_logger(storage_root)
+        book_ids = [f"book-{i}" for i in range(8)]
+        for book_id in book_ids:
+            book_dir = pathlib.Path(storage_root) / book_id
+            book_dir.mkdir()
+            (book_dir / "translatedcontent.md").write_text(f"# {book_id}\n\nText.\n", encoding='utf-8')
+        
+        processes = [
+            multiprocessing.Process(target=_scan_claim_compose_worker, args=(storage_root, node, 3))
+            for node in range(6)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        
+        for book_id in book_ids:
+            journal = pathlib.Path(storage_root) / book_id / "journal.log"
+            compositions = journal.read_text(encoding='utf-8').splitlines()
+            assert len(compositions) == 1, f"{book_id} composed {len(compositions)} times"
+            assert not (pathlib.Path(storage_root) / book_id / LEASE_CONFIG['lease_filename']).exists()
+        print(f"Books composed exactly once: {len(book_ids)}")
+
+def test_expired_lease_is_reclaimed():
+    """A crashed node's lease is taken over once its heartbeat is older than the TTL."""
+    with tempfile.TemporaryDirectory() as storage_root:
+        get_logger(storage_root)
+        book_dir = pathlib.Path(storage_root) / "crashed-book"
+        book_dir.mkdir()
+        
+        crashed = JobLeaseManager(storage_root, LEASE_CONFIG, owner="crashed-node")
+        survivor = JobLeaseManager(storage_root, LEASE_CONFIG, owner="survivor-node")
+        assert crashed.claim("crashed-book", "composingservice")
+        assert not survivor.claim("crashed-book", "composingservice")
+        
+        # Age the heartbeat past the TTL
+        lease_path = book_dir / LEASE_CONFIG['lease_filename']
+        old = time.time() - LEASE_CONFIG['lease_ttl'] - 1
+        os.utime(lease_path, (old, old))
+        
+        assert survivor.claim("crashed-book", "composingservice")
+        with open(lease_path, 'r', encoding='utf-8') as f:
+            assert json.load(f)['owner'] == "survivor-node"
+        
+        # The crashed node notices on its next heartbeat and cannot release the new lease
+        crashed.heartbeat()
+        assert not crashed.holds("crashed-book")
+        crashed.release("crashed-book")
+        assert lease_path.exists()
+
+if __name__ == "__main__":
+    print("Testing JobLeaseManager...")
+    test_no_double_composition()
+    test_each_book_composed_once()
+    test_expired_lease_is_reclaimed()
+    print("Test PASSED")
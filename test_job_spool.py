@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for the job ticket spool: ordering, deduplication and submission times.
+"""
+
+import sys
+import time
+import tempfile
+import pathlib
+from pathlib import Path
+
+# Add the composingservice directory to the Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from core.ComposingJob import ComposingJob
+from core.JobDiscovery import PollingDiscovery, SpoolDiscovery
+from core.JobScheduler import JobScheduler
+from core.JobSpool import JobSpool, write_ticket
+from common.logger import get_logger
+
+SPOOL_CONFIG = {'spool_dirname': 'queue'}
+
+SCHEDULER_CONFIG = {
+    'scheduler_large_job_bytes': 10**9,
+    'scheduler_large_job_slots': 1,
+    'scheduler_max_wait': 3600,
+    'queue_filename': 'composingservice-queue.json',
+}
+
+def _submit(storage_root: str, book_ids: list) -> list:
+    """Write a ticket per book id, a moment apart, and return their submission times."""
+    times = []
+    for book_id in book_ids:
+        write_ticket(storage_root, SPOOL_CONFIG['spool_dirname'], book_id, priority='normal')
+        times.append(time.time())
+        time.sleep(0.01)
+    return times
+
+def test_take_order_and_duplicates():
+    """Tickets come out in submission order, one per book with its first submission, and are removed."""
+    with tempfile.TemporaryDirectory() as storage_root:
+        get_logger(storage_root)
+        spool = JobSpool(storage_root, SPOOL_CONFIG)
+        assert spool.take() == []
+
+        times = _submit(storage_root, ["book-c", "book-a", "book-c", "book-b"])
+        queue_dir = pathlib.Path(storage_root) / "queue"
+        # A ticket still being written and an unreadable one
+        (queue_dir / ".tmp-ticket.json").write_text("{", encoding='utf-8')
+        (queue_dir / f"{time.time_ns():020d}-broken.json").write_text("not json", encoding='utf-8')
+
+        tickets = spool.take()
+        assert [book_id for book_id, _ in tickets] == ["book-c", "book-a", "book-b"]
+        submitted = dict(tickets)
+        assert submitted["book-c"] <= times[0] < times[2]
+        assert times[0] < submitted["book-a"] <= times[1]
+        assert sorted(path.name for path in queue_dir.iterdir()) == [".tmp-ticket.json"]
+        assert spool.take() == []
+
+def test_submission_times_reach_the_scheduler():
+    """Books taken from tickets in one batch are queued from their submission times, oldest first."""
+    with tempfile.TemporaryDirectory() as storage_root:
+        get_logger(storage_root)
+        discovery = SpoolDiscovery(PollingDiscovery(3600), JobSpool(storage_root, SPOOL_CONFIG), 0.01)
+        _submit(storage_root, ["book-z", "book-m", "book-a"])
+
+        changed = discovery.wait_for_changes(0)
+        assert changed == {"book-z", "book-m", "book-a"}
+        submitted = discovery.submission_times()
+        assert list(submitted) == ["book-z", "book-m", "book-a"]
+        assert discovery.submission_times() == {}
+
+        scheduler = JobScheduler(storage_root, SCHEDULER_CONFIG, {'composingservice': 1}, publish=False)
+        # The scan finds the books in folder order; equal sizes leave submission order to decide
+        jobs = [ComposingJob('composingservice', book_id, input_bytes=100) for book_id in sorted(changed)]
+        scheduler.update(jobs, changed, submitted)
+        order = [scheduler.next_job().book_id for _ in range(3)]
+        assert order == ["book-z", "book-m", "book-a"]
+
+if __name__ == "__main__":
+    print("Testing JobSpool...")
+    test_take_order_and_duplicates()
+    test_submission_times_reach_the_scheduler()
+    print("Test PASSED")
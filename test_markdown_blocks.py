@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Tests for the markdown block tokenizer and the combiners built on it.
+
+The combiners must produce exactly what the line-by-line parser they replaced
+produced; a reduced copy of that parser is kept here as the reference.
+"""
+
+import io
+import re
+import sys
+import random
+import logging
+import contextlib
+from pathlib import Path
+
+# Add the composingservice directory to the Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from core.DualLanguageCombiner import DualLanguageCombiner
+from core.markdown_blocks import HEADING, IMAGE, LIST, PARAGRAPH, MarkdownBlocks, tokenize
+from position_based_combiner import PositionBasedCombiner
+
+HEADER = re.compile(r'^(#{1,6})\s+(.+)$')
+
+BULLET_PREFIXES = ('- ', '* ', '+ ')
+
+# Lines the random documents are made of, including ones the parsers could disagree on
+LINES = [
+    '# Title', '## Sub title  ', '### Chapter 1: Introduction', '####### not a heading', '#nothead',
+    '  # indented heading', '#\tTab heading', '#  ', 'plain text line', 'another line with **bold**',
+    '- item one', '* item two', '+ item three', '-  spaced', '- ', '1. numbered', 'xin chào thế giới',
+    '![img](a.png)', 'text ![x](b.png) more', '](![ reversed', '', '', '   ', '\t', 'line\r', '# Windows\r', '\r',
+    '```', '```python', '~~~', '    code', '| a | b |', '|---|---|', '  | c | d |',
+]
+
+def _quiet_logger() -> logging.Logger:
+    logger = logging.getLogger('test_markdown_blocks')
+    logger.setLevel(logging.ERROR)
+    return logger
+
+# Reference: the line-by-line parsing and combining the tokenizer replaced
+
+def reference_sections(content: str) -> list:
+    """(level, title, lines) for each heading."""
+    sections = []
+    for line in content.strip().split('\n'):
+        match = HEADER.match(line.strip())
+        if match:
+            sections.append((match.group(1), match.group(2).strip(), []))
+        elif sections:
+            sections[-1][2].append(line)
+    return sections
+
+def reference_paragraphs(lines: list) -> list:
+    paragraphs, current = [], []
+    for line in lines:
+        if line.strip() == "":
+            if current:
+                paragraphs.append(current)
+                current = []
+        else:
+            current.append(line)
+    if current:
+        paragraphs.append(current)
+    return paragraphs
+
+def _is_bullet_list(lines: list) -> bool:
+    items = [line.strip() for line in lines if line.strip()]
+    return bool(items) and sum(1 for item in items if item.startswith(BULLET_PREFIXES)) >= len(items) * 0.5
+
+def _combine_bullets(orig_lines: list, trans_lines: list) -> list:
+    orig = [line.strip() for line in orig_lines if line.strip().startswith(BULLET_PREFIXES)]
+    trans = [line.strip() for line in trans_lines if line.strip().startswith(BULLET_PREFIXES)]
+    combined = []
+    for i in range(max(len(orig), len(trans))):
+        orig_item = orig[i] if i < len(orig) else ""
+        trans_item = trans[i] if i < len(trans) else ""
+        if orig_item and trans_item:
+            orig_text = re.sub(r'^[-*+]\s*', '', orig_item).strip()
+            trans_text = re.sub(r'^[-*+]\s*', '', trans_item).strip()
+            combined.append(f"- {orig_text} / {trans_text}")
+        else:
+            combined.append(orig_item or trans_item)
+    return combined
+
+def reference_dual_language(original: str, translated: str) -> str:
+    """DualLanguageCombiner.combine_markdown_files: sections matched by normalized title."""
+    normalize = DualLanguageCombiner(_quiet_logger())._normalize_title
+    translated_map = {normalize(title): (level, title, lines) for level, title, lines in reference_sections(translated)}
+    combined = []
+    for level, title, lines in reference_sections(original):
+        match = translated_map.get(normalize(title))
+        if match is None:
+            combined += [f"{level} {title}", ""] + lines + [""]
+            continue
+        combined += [f"# {title}", "", f"# {match[1]}"] if level == '#' else [f"{level} {title} / {match[1]}"]
+        combined.append("")
+        orig_paragraphs, trans_paragraphs = reference_paragraphs(lines), reference_paragraphs(match[2])
+        body = []
+        for i in range(max(len(orig_paragraphs), len(trans_paragraphs))):
+            orig = orig_paragraphs[i] if i < len(orig_paragraphs) else []
+            trans = trans_paragraphs[i] if i < len(trans_paragraphs) else []
+            if orig and trans and _is_bullet_list(orig) and _is_bullet_list(trans):
+                body += _combine_bullets(orig, trans) + [""]
+            else:
+                body += (orig + [""] if orig else []) + (trans + [""] if trans else [])
+        if body and body[-1] == "":
+            body.pop()
+        combined += body + [""]
+    while combined and combined[-1] == "":
+        combined.pop()
+    return '\n'.join(combined)
+
+def reference_position_based(original: str, translated: str) -> str:
+    """PositionBasedCombiner.combine_by_position: sections matched in order, translations in italics."""
+    orig_sections, trans_sections = reference_sections(original), reference_sections(translated)
+    matched = min(len(orig_sections), len(trans_sections))
+    combined = []
+    for (level, title, orig_lines), (_, trans_title, trans_lines) in zip(orig_sections, trans_sections):
+        lines = [f"# {title}", "", f'# *{trans_title}*'] if level == '#' else [f'{level} {title} / *{trans_title}*']
+        lines.append("")
+        orig_paragraphs, trans_paragraphs = reference_paragraphs(orig_lines), reference_paragraphs(trans_lines)
+        for i in range(max(len(orig_paragraphs), len(trans_paragraphs))):
+            orig = orig_paragraphs[i] if i < len(orig_paragraphs) else []
+            trans = trans_paragraphs[i] if i < len(trans_paragraphs) else []
+            if any('![' in line and '](' in line for line in orig + trans):
+                lines += (orig or trans) + [""]
+            else:
+                lines += (orig + [""] if orig else []) + ([f'*{line}*' for line in trans] + [""] if trans else [])
+        combined.append(lines + [""])
+    for level, title, lines in orig_sections[matched:] + trans_sections[matched:]:
+        combined.append([f"{level} {title}", ""] + lines + [""])
+    if combined:
+        while combined[-1] and combined[-1][-1] == "":
+            combined[-1].pop()
+    return '\n'.join('\n'.join(lines) for lines in combined)
+
+def random_document(rng: random.Random) -> str:
+    text = '\n'.join(rng.choice(LINES) for _ in range(rng.randint(0, 40)))
+    if rng.random() < 0.3:
+        text = '  \n\n' + text
+    if rng.random() < 0.3:
+        text += '\n\n  \n'
+    return text
+
+def test_tokenize_blocks():
+    """Blocks are headings and runs of non-blank lines, flagged as images or lists; fences are plain lines."""
+    text = "Preface\n\n# Title\nIntro\n- a\n- b\n\n![x](a.png)\n```\n# Code heading\n\nstill code\n```\n"
+    blocks = tokenize(text)
+    assert [(blocks.kinds[i], blocks.block(i)) for i in range(len(blocks))] == [
+        (PARAGRAPH, "Preface"),
+        (HEADING, "# Title"),
+        (LIST, "Intro\n- a\n- b"),
+        (IMAGE, "![x](a.png)\n```"),
+        (HEADING, "# Code heading"),
+        (PARAGRAPH, "still code\n```"),
+    ]
+    sections = blocks.sections()
+    assert [(section.level, section.title) for section in sections] == [('#', 'Title'), ('#', 'Code heading')]
+    assert sections[0].body == "Intro\n- a\n- b\n\n![x](a.png)\n```"
+    assert sections[1].paragraphs() == [(PARAGRAPH, "still code\n```")]
+    assert len(tokenize("")) == 0 and len(tokenize(" \n\n\t")) == 0
+
+def test_offsets_round_trip():
+    """Stored offsets rebuild the same blocks; offsets in another format are ignored."""
+    rng = random.Random(7)
+    for _ in range(200):
+        text = random_document(rng)
+        blocks = tokenize(text)
+        offsets = blocks.to_offsets()
+        restored = MarkdownBlocks.from_offsets(text, offsets)
+        assert [restored.block(i) for i in range(len(restored))] == [blocks.block(i) for i in range(len(blocks))]
+        assert list(restored.kinds) == list(blocks.kinds)
+        assert MarkdownBlocks.from_offsets(text, dict(offsets, format=offsets['format'] - 1)) is None
+
+def test_combiners_match_line_parser(documents: int = 3000):
+    """Both combiners produce what the line-by-line parser produced, on random documents."""
+    rng = random.Random(1)
+    dual_language = DualLanguageCombiner(_quiet_logger())
+    position_based = PositionBasedCombiner()
+    for _ in range(documents):
+        original, translated = random_document(rng), random_document(rng)
+        assert dual_language.combine_markdown_files(original, translated) == reference_dual_language(original, translated), \
+            (original, translated)
+        with contextlib.redirect_stdout(io.StringIO()):
+            combined = position_based.combine_by_position(original, translated)
+            prepared = position_based.combine_by_position(original, translated,
+                                                          original_sections=position_based.prepare_document(original))
+        assert combined == prepared == reference_position_based(original, translated), (original, translated)
+    print(f"Documents combined as before: {documents}")
+
+if __name__ == "__main__":
+    print("Testing markdown block tokenizer and combiners...")
+    test_tokenize_blocks()
+    test_offsets_round_trip()
+    test_combiners_match_line_parser()
+    print("Test PASSED")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Tests for the retry policy: failure classification, backoff and dead-letter transitions.
+"""
+
+import sys
+import json
+import tempfile
+import pathlib
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add the composingservice directory to the Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from core.JobIsolation import OUTCOME_CRASHED, OUTCOME_FAILURE, OUTCOME_OOM, OUTCOME_TIMEOUT
+from core.RetryPolicy import DEAD_LETTER, LEGACY_ERROR, RETRY_SCHEDULED, RetryPolicy
+from common.logger import get_logger
+
+RETRY_CONFIG = {
+    'retry_max_attempts': 3,
+    'retry_base_delay': 10,
+    'retry_max_delay': 25,
+}
+
+def test_classification():
+    """Crashes, storage errors and failures without an exception are retried; the rest are permanent."""
+    policy = RetryPolicy(RETRY_CONFIG)
+    assert policy.is_retryable(OUTCOME_CRASHED, None)
+    assert policy.is_retryable(OUTCOME_CRASHED, 'ValueError')
+    assert policy.is_retryable(OUTCOME_FAILURE, None)
+    assert policy.is_retryable(OUTCOME_FAILURE, 'OSError')
+    assert policy.is_retryable(OUTCOME_FAILURE, 'UnicodeDecodeError')
+    assert not policy.is_retryable(OUTCOME_FAILURE, 'ValueError')
+    assert not policy.is_retryable(OUTCOME_TIMEOUT, None)
+    assert not policy.is_retryable(OUTCOME_OOM, None)
+
+def test_backoff():
+    """The delay doubles from the base delay up to the cap, keeping at least half of it."""
+    policy = RetryPolicy(RETRY_CONFIG)
+    for _ in range(100):
+        assert 5 <= policy.backoff(1) <= 10
+        assert 10 <= policy.backoff(2) <= 20
+        assert 12.5 <= policy.backoff(3) <= 25
+        assert 12.5 <= policy.backoff(30) <= 25
+
+def test_transitions():
+    """Retryable failures are scheduled until they run out of attempts; permanent ones go straight to the dead letter."""
+    policy = RetryPolicy(RETRY_CONFIG)
+    progress = {'status': 'error'}
+    assert policy.record_failure(progress, OUTCOME_CRASHED) == RETRY_SCHEDULED
+    assert progress['attempts'] == 1
+    retry_at = policy.retry_at(progress)
+    assert datetime.now() < retry_at <= datetime.now() + timedelta(seconds=10)
+    assert not policy.gave_up(progress)
+
+    assert policy.record_failure(progress, OUTCOME_FAILURE) == RETRY_SCHEDULED
+    assert policy.record_failure(progress, OUTCOME_FAILURE) == DEAD_LETTER
+    assert progress['attempts'] == 3
+    assert progress['dead_letter_reason'] == 'max_attempts'
+    assert 'next_retry_at' not in progress
+    assert policy.retry_at(progress) is None
+    assert policy.gave_up(progress)
+
+    permanent = {'status': 'error', 'error_type': 'ValueError'}
+    assert policy.record_failure(permanent, OUTCOME_FAILURE) == DEAD_LETTER
+    assert permanent['dead_letter_reason'] == 'permanent_error'
+    killed = {'status': OUTCOME_TIMEOUT}
+    assert policy.record_failure(killed, OUTCOME_TIMEOUT) == DEAD_LETTER
+    assert killed['dead_letter_reason'] == OUTCOME_TIMEOUT
+
+    # The free service keeps its own keys in the shared progress file
+    shared = {'status': 'completed', 'free_status': 'error'}
+    assert policy.record_failure(shared, OUTCOME_CRASHED, 'free_') == RETRY_SCHEDULED
+    assert shared['free_attempts'] == 1 and 'attempts' not in shared
+    assert shared['status'] == 'completed'
+
+def test_legacy_error():
+    """A book left in 'error' is classified like a new failure of its recorded error type."""
+    policy = RetryPolicy(RETRY_CONFIG)
+    failed_at = datetime.now() - timedelta(days=3)
+    legacy = {'status': 'error', 'error_type': 'OSError', 'error_at': failed_at.isoformat()}
+    assert not policy.gave_up(legacy)
+    assert policy.retry_at(legacy) == failed_at + timedelta(seconds=10)
+    assert policy.retry_at({'status': 'error', 'error_type': 'OSError'}) is None
+    assert policy.gave_up({'status': 'error', 'error_type': 'ValueError'})
+    assert policy.gave_up({'status': 'error', 'error_type': 'OSError', 'attempts': 2})
+
+    # Composers before the policy only recorded when the error happened
+    unclassified = {'status': 'error', 'error': 'boom', 'error_at': failed_at.isoformat()}
+    assert policy.gave_up(unclassified)
+    assert policy.dead_letter_reason(unclassified) == LEGACY_ERROR
+    assert policy.gave_up({'status': 'completed', 'free_status': 'error'}, 'free_')
+    assert policy.dead_letter_reason(legacy) is None
+
+def _make_book(storage_root: str, book_id: str, progress: dict) -> pathlib.Path:
+    book_dir = pathlib.Path(storage_root) / book_id
+    book_dir.mkdir()
+    (book_dir / "translatedcontent.md").write_text("# Title\n\nText.\n", encoding='utf-8')
+    with open(book_dir / "composingservice-progress.json", 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    return book_dir
+
+def _load_progress(book_dir: pathlib.Path) -> dict:
+    with open(book_dir / "composingservice-progress.json", 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def test_worker_retries_legacy_errors():
+    """The worker retries books that failed with a retryable error before attempts were counted, but not unclassified ones."""
+    with tempfile.TemporaryDirectory() as storage_root:
+        get_logger(storage_root)
+        from core.ComposingWorker import ComposingWorker
+        old = (datetime.now() - timedelta(days=3)).isoformat()
+        _make_book(storage_root, "storage-error", {'status': 'error', 'error_type': 'OSError', 'error_at': old})
+        _make_book(storage_root, "bad-input", {'status': 'error', 'error_type': 'ValueError', 'error_at': old})
+        _make_book(storage_root, "dead", {'status': DEAD_LETTER, 'attempts': 5})
+        _make_book(storage_root, "unclassified", {'status': 'error', 'error': 'boom', 'error_at': old})
+        worker = ComposingWorker(storage_root)
+        assert worker.find_jobs() == ["storage-error"]
+
+def test_pooled_crash_is_an_attempt():
+    """A job whose pool process died is recorded as a crashed attempt and backs off."""
+    with tempfile.TemporaryDirectory() as storage_root:
+        get_logger(storage_root)
+        from core.ComposingWorker import ComposingWorker
+        book_dir = _make_book(storage_root, "crashing-book", {'status': 'processing'})
+        worker = ComposingWorker(storage_root)
+        assert worker.find_jobs() == ["crashing-book"]
+
+        future = Future()
+        future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+        assert worker._finish_pooled_job(future, worker, "crashing-book") == 0
+        progress = _load_progress(book_dir)
+        assert progress['status'] == RETRY_SCHEDULED
+        assert progress['attempts'] == 1
+        assert worker.find_jobs() == []
+
+if __name__ == "__main__":
+    print("Testing RetryPolicy...")
+    test_classification()
+    test_backoff()
+    test_transitions()
+    test_legacy_error()
+    test_worker_retries_legacy_errors()
+    test_pooled_crash_is_an_attempt()
+    print("Test PASSED")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for storage root placement: weights, policies and STORAGE_ROOTS parsing.
+"""
+
+import os
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+
+# Add the composingservice directory to the Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from core.StoragePlacement import PLACEMENT_POLICIES, StoragePlacement
+from common.configuration import get_storage_roots
+from common.logger import get_logger
+
+def _placement(roots: list, policy: str) -> StoragePlacement:
+    return StoragePlacement(roots, {'scaling_filename': 'composingservice-scaling.json', 'storage_placement': policy})
+
+def test_weights():
+    """Round robin and hash follow the weights; a root with weight 0 takes no new books."""
+    with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b, tempfile.TemporaryDirectory() as c:
+        roots = [{'path': a, 'weight': 3, 'options': {}}, {'path': b, 'weight': 1, 'options': {}},
+                 {'path': c, 'weight': 0, 'options': {}}]
+        round_robin = _placement(roots, 'round_robin')
+        assert Counter(round_robin.place(f"book-{i}") for i in range(40)) == {a: 30, b: 10}
+        hashed = _placement(roots, 'hash')
+        assert c not in {hashed.place(f"book-{i}") for i in range(40)}
+        assert hashed.place("book-1") == hashed.place("book-1")
+        for policy in ['most_free', 'least_loaded']:
+            assert _placement(roots, policy).place("book-1") in (a, b)
+
+def test_all_roots_at_weight_zero():
+    """Roots that all have weight 0 share new books equally under every policy instead of failing."""
+    with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+        roots = [{'path': a, 'weight': 0, 'options': {}}, {'path': b, 'weight': 0, 'options': {}}]
+        for policy in PLACEMENT_POLICIES:
+            placement = _placement(roots, policy)
+            assert {placement.place(f"book-{i}") for i in range(10)} <= {a, b}
+        round_robin = _placement(roots, 'round_robin')
+        assert Counter(round_robin.place(f"book-{i}") for i in range(10)) == {a: 5, b: 5}
+
+def test_storage_roots_parsing():
+    """STORAGE_ROOTS must leave at least one root able to take new jobs."""
+    previous = os.environ.get('STORAGE_ROOTS')
+    try:
+        os.environ['STORAGE_ROOTS'] = "/mnt/a;weight=2, /mnt/b;weight=0"
+        assert [(root['path'], root['weight']) for root in get_storage_roots()] == [("/mnt/a", 2), ("/mnt/b", 0)]
+        os.environ['STORAGE_ROOTS'] = "/mnt/a;weight=0,/mnt/b;weight=0"
+        try:
+            get_storage_roots()
+            assert False, "all-zero weights were accepted"
+        except ValueError:
+            pass
+    finally:
+        if previous is None:
+            os.environ.pop('STORAGE_ROOTS', None)
+        else:
+            os.environ['STORAGE_ROOTS'] = previous
+
+if __name__ == "__main__":
+    print("Testing StoragePlacement...")
+    get_logger(tempfile.gettempdir())
+    test_weights()
+    test_all_roots_at_weight_zero()
+    test_storage_roots_parsing()
+    print("Test PASSED")